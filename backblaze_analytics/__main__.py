@@ -6,26 +6,21 @@ class BackblazeAnalyticsCLI(plumbum.cli.Application):
 
 	pass
 
-from .tools.plotLifeLines import AnalysisCLI
-BackblazeAnalyticsCLI.subcommand("KM")(AnalysisCLI)
 
-from .tools.RegressionCLI import RegressionCLI
-BackblazeAnalyticsCLI.subcommand("regression")(RegressionCLI)
-
-from .tools.importer import Importer
-BackblazeAnalyticsCLI.subcommand("import")(Importer)
-
-from .tools.preprocess import Preprocesser
-BackblazeAnalyticsCLI.subcommand("preprocess")(Preprocesser)
-
-from .tools.retrieve import DatasetRetriever
-BackblazeAnalyticsCLI.subcommand("retrieve")(DatasetRetriever)
-
-from .tools.export import DatasetExporter
-BackblazeAnalyticsCLI.subcommand("export")(DatasetExporter)
-
-from .tools.imput import Imputer
-BackblazeAnalyticsCLI.subcommand("imput")(Imputer)
+# Subcommands are registered by name and their modules are imported only when invoked (or when the help is printed), so a subcommand doesn't pay for importing the heavy dependencies of the others
+subcommands = {
+	"KM": "tools.plotLifeLines.AnalysisCLI",
+	"regression": "tools.RegressionCLI.RegressionCLI",
+	"import": "tools.importer.Importer",
+	"preprocess": "tools.preprocess.Preprocesser",
+	"retrieve": "tools.retrieve.DatasetRetriever",
+	"export": "tools.export.DatasetExporter",
+	"imput": "tools.imput.Imputer",
+	"benchmark": "tools.benchmark.Benchmark",
+}
+
+for name, path in subcommands.items():
+	BackblazeAnalyticsCLI.subcommand(name, __package__ + "." + path)
 
 
 if __name__ == "__main__":
@@ -8,16 +8,16 @@ from lazily import lazyImport, pandas
 from lazily import scipy as np
 
 from . import database
+from .compactDTypes import compactFrame
 
 from .core import *
 from .core.Aggregator import *
 
 from .dataset import Dataset
 #from .datasetDescription import attrsSpec
-from .fitters.XGBoostWeibullFitter import WeibullAggregator
 
 from .utils.mtqdm import mtqdm
-from .utils.PickleCache import PickleCache
+from .utils.PickleCache import PickleCache, codeFingerprint, dbFingerprint
 
 plt = lazyImport("matplotlib.pyplot")
 
@@ -25,7 +25,7 @@ plt = lazyImport("matplotlib.pyplot")
 def genDomainsCustomGeneratorMapping(attrName):
 	def func(ds):
 		ar = getattr(ds, attrName)
-		return range(ar.base, len(ar) + 1)
+		return range(ar.base, ar.base + len(ar))
 
 	return (attrName[:-1] + "_id", func)  # models -> model_id
 
@@ -33,6 +33,24 @@ def genDomainsCustomGeneratorMapping(attrName):
 specialDomainsMapping = dict((genDomainsCustomGeneratorMapping(attrName) for attrName in Dataset.indexes))
 
 
+def reportCompaction(what: str, before: int, after: int):
+	print("Compacted dtypes of " + what + ": " + format(before / (1 << 20), ".1f") + " MiB -> " + format(after / (1 << 20), ".1f") + " MiB")
+
+
+def joinModelsAttrs(pds, models, attrs):
+	"""The same as the inner merge of `pds` on `model_id` with the attrs of `models` indexed by id, the clashing names get the `_model` suffix. If all the models are known, the columns of `pds` are not copied."""
+	pos = models.index.get_indexer(pds.loc[:, "model_id"])
+	known = pos >= 0
+	if known.all():
+		pds = pds.copy(deep=False)
+	else:
+		pds = pds.loc[known]
+		pos = pos[known]
+	for attrName in attrs:
+		pds[attrName + "_model" if attrName in pds.columns else attrName] = pandas.Series(models.loc[:, attrName].array.take(pos), index=pds.index)
+	return pds
+
+
 class Analysis:
 	"""A class to make analysis. Call its methods in a Jupyter notebook"""
 
@@ -48,9 +66,24 @@ class Analysis:
 		return ds
 
 	CACHE_NAMESPACE = "analysis"
+	CACHE_CODE_MODULES = ("analysis", "dataset", "drivesIndex", "augment", "database", "compactDTypes", "datasetDescription", "core.Aggregator", "fitters.XGBoostWeibullFitter")  # the modules the cached objects are created by
+
+	def cacheFingerprint(self):
+		"""Everything the cached objects depend on, see `PickleCache`"""
+		from .augment import getAugmentersVersions
 
-	def __init__(self, dbFilePath):
+		return {
+			"db": dbFingerprint(self.dbPath or database.databaseDefaultFileName),
+			"analyticsDB": dbFingerprint(self.analyticsDBPath or database.analysisDatabaseDefaultFileName),
+			"augmenters": getAugmentersVersions(),
+			"code": codeFingerprint(*(__package__ + "." + m for m in self.__class__.CACHE_CODE_MODULES)),
+		}
+
+	def __init__(self, dbFilePath, analyticsDBFilePath=None):
 		self.dbPath = dbFilePath
+		self.analyticsDBPath = analyticsDBFilePath
+
+		from .fitters.XGBoostWeibullFitter import WeibullAggregator  # imports lifelines
 
 		usual = {"duration_col": "duration_worked", "event_col": "failed"}
 		learningTasksCreators = {
@@ -60,14 +93,19 @@ class Analysis:
 			"Weibull": (WeibullAggregator, {"lambda_col": "weibullLambda", "rho_col": "weibullRho"}),
 		}
 		#print(learningTasksCreators)
+		self.learningTasksCreators = learningTasksCreators
 
 		def generateDataSetConstructor(aggr, paramsToFit):
-			return LearningTask(self.createDataFrame(self.getAvailableKeys(), aggregator=aggr), paramsToFit)
+			res = LearningTask(self.deriveDataFrame(self.pch.baseFrame, self.getAvailableKeys(), aggregator=aggr), paramsToFit)
+			if aggr is not None and not self.pch.unaggregatedTask.__resolved__:
+				self.pch.evict("baseFrame")  # an aggregated frame doesn't refer to it, unlike the unaggregated one sharing its columns
+			return res
 
-		tasksPchConfig = {k + "Task": partial(generateDataSetConstructor, aggr, paramsToFit) for k, (aggr, paramsToFit) in learningTasksCreators.items()}
+		tasksPchConfig = {k + "Task": partial(generateDataSetConstructor, aggr, paramsToFit) for k, (aggr, paramsToFit) in learningTasksCreators.items() if aggr is not None}
+		derivedTasksConfig = {k + "Task": partial(generateDataSetConstructor, aggr, paramsToFit) for k, (aggr, paramsToFit) in learningTasksCreators.items() if aggr is None}  # projections of the base frame sharing its columns, not worth storing
 		# print(tasksPchConfig)
 
-		self.pch = PickleCache({"ds": self.loadAndAugmentDataset, **tasksPchConfig}, self.__class__.CACHE_NAMESPACE)
+		self.pch = PickleCache({"ds": self.loadAndAugmentDataset, "baseFrame": self.createBaseFrame, **tasksPchConfig}, self.__class__.CACHE_NAMESPACE, fingerprint=self.cacheFingerprint, derived=derivedTasksConfig)
 		self.domains = {}
 
 	@property
@@ -95,54 +133,71 @@ class Analysis:
 				self.domains[attrName] = self.getSetOfValues(attrName)
 			#print("domains", attrName, self.domains[attrName])
 
-	def loadStats(self):
+	def loadStats(self, sampling: dict = None):
+		"""`sampling` is passed to `Dataset.stats`"""
 		print("The database contains " + ("reduced" if self.ds.reduced else "full") + " dataset")
-		print("Getting stats from dataset....")
-		statz = Dataset.stats(self.dbPath, reduced=self.ds.reduced)
+		print("Getting stats from dataset" + (" (sampled)" if sampling is not None else "") + "....")
+		columns, statz = Dataset.stats(self.dbPath, reduced=self.ds.reduced, analyticsDBPath=self.analyticsDBPath, tuples=True, sampling=sampling)  # `failed` and `duration_worked` are computed by the query
 
 		print("Creating a dataframe from stats....")
-		pds = pandas.DataFrame.from_records(statz, index="id")
+		pds = pandas.DataFrame.from_records(statz, columns=columns, index="id")
 		del statz
-		try:
-			pds["model_id"] = pds.index.map(lambda id: self.ds.drives[id]["model_id"])
-		except IndexError as ex:
+		pds["failed"] = pds.loc[:, "failed"].astype(bool)
+		rows = self.ds.drives.rowsOf(pds.index.to_numpy())
+		if (rows < 0).any():
 			warnings.warn("The drive present in statistic data is not present in tables with info on models. Make sure that you use the right version of the DB. For example you may need to export drives information with `export drives`")
-			raise
-
-		if not self.ds.reduced:
-			pds["failed"] = pds.loc[:, "failure_worked_days_smart"].notnull()
-			pds["duration_worked"] = pds.loc[:, "failure_worked_days_smart"].where(pds.loc[:, "failed"], pds.loc[:, "total_worked_days_smart"])
-		else:
-			pds["failed"] = pds.loc[:, "days_in_dataset_failure"].notnull()
-			pds["duration_worked"] = pds.loc[:, "days_in_dataset_failure"].where(pds.loc[:, "failed"], pds.loc[:, "days_in_dataset"])
+			raise IndexError("Drives absent in the table of drives", pds.index[rows < 0][:10].tolist())
+		pds["model_id"] = self.ds.drives.modelIds[rows]
 
 		return pds
 
 	def loadModelsDataFrame(self):
 		pds = pandas.DataFrame.from_records(self.ds.models, index="id")
-		pds["vendor_id"] = pds.loc[:, "brand_id"].apply(lambda id: self.ds.brands[id]["vendor_id"])
+		vendorsOfBrands = pandas.Series({b["id"]: b["vendor_id"] for b in self.ds.brands if b is not None})
+		pds["vendor_id"] = pds.loc[:, "brand_id"].map(vendorsOfBrands)
 		return pds
 
-	def createDataFrame(self, additionalAttrs, *, aggregator: Aggregator = None):
-		"""Initializes PandasDataFrame with the data from dataset and does some other additional operations."""
-		self.computeDomains(*additionalAttrs)
+	def insertModelAttrIntoPandasDataset(self, pds, attrName: str):
+		"""Adds a column with an attr of the models of the drives"""
+		models = self.loadModelsDataFrame()
+		pds[attrName] = pds.loc[:, "model_id"].map(models.loc[:, attrName])
 
-		pds = self.loadStats()
+	def createBaseFrame(self, sampling: dict = None):
+		"""The stats of the drives sorted by `duration_worked`. It is loaded once, the learning tasks are derived from it."""
+		pds = self.loadStats(sampling)
+		pds.sort_values(by="duration_worked", inplace=True, kind="stable")
+		reportCompaction("the base frame", *compactFrame(pds))
+		return pds
+
+	def deriveDataFrame(self, base, additionalAttrs, *, aggregator: Aggregator = None):
+		"""Aggregates the base frame and adds the attrs of the models to it. Without an aggregator the result shares the columns of the base frame."""
+		self.computeDomains(*(set(additionalAttrs) - self.domains.keys()))
 		models = self.loadModelsDataFrame()
 
 		if aggregator is not None:
-			pds = aggregator.aggregate(pds)
+			pds = aggregator.aggregate(base)
+		else:
+			pds = base
 
 		missingAttrColumns = additionalAttrs - set(models.columns)
 		if missingAttrColumns:
 			warnings.warn("Following columns are missing: " + repr(missingAttrColumns))
-		pds = pds.merge(models.loc[:, additionalAttrs], how="inner", left_on="model_id", right_index=True, suffixes=("", "_model"), copy=False)
-		#print(pds["vendor_id"])
+		pds = joinModelsAttrs(pds, models, [a for a in additionalAttrs if a in models.columns])
 
-		for attrName in additionalAttrs:
-			if attrName not in self.domains:
-				self.computeDomains(attrName)
-
-		if "duration_worked" in pds:
-			pds.sort_values(by="duration_worked", inplace=True)
+		if aggregator is not None and "duration_worked" in pds:
+			pds.sort_values(by="duration_worked", inplace=True, kind="stable")
+		reportCompaction("the frame" + (" aggregated with " + aggregator.__name__ if aggregator is not None else ""), *compactFrame(pds))  # the columns of the base frame are already compact and shared
 		return pds
+
+	def createSampledTask(self, sampling: dict, kind: str = "unaggregated"):
+		"""The same as the `<kind>Task` of `pch`, but only of a sample of drives drawn by the DB (see `database.genDriveStatsDenormSampledQuery` for the params of `sampling`), so the stats of all the drives are never loaded. The sampled base frame is cached too."""
+		aggr, paramsToFit = self.learningTasksCreators[kind]
+		pch = PickleCache({"sampledBaseFrame": partial(self.createBaseFrame, sampling)}, self.__class__.CACHE_NAMESPACE, fingerprint=lambda: {**self.cacheFingerprint(), "sampling": sampling})
+		res = LearningTask(self.deriveDataFrame(pch.sampledBaseFrame, self.getAvailableKeys(), aggregator=aggr), paramsToFit)
+		if aggr is not None:
+			pch.evict("sampledBaseFrame")
+		return res
+
+	def createDataFrame(self, additionalAttrs, *, aggregator: Aggregator = None):
+		"""Initializes PandasDataFrame with the data from dataset and does some other additional operations."""
+		return self.deriveDataFrame(self.createBaseFrame(), additionalAttrs, aggregator=aggregator)
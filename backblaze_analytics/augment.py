@@ -1,8 +1,13 @@
 import enum
+import hashlib
+import json
+import sqlite3
+import sys
 from collections import Iterable, OrderedDict, defaultdict
+from datetime import date
 
 from . import augmenters as augmenterModules
-from .utils.mtqdm import mtqdm
+from .utils import makeSerializeable
 
 
 class Augmenter:
@@ -25,48 +30,118 @@ augmenters = type(augmenters)(sorted(augmenters.items(), key=lambda it: it[1].pr
 NotFound = enum.IntFlag("NotFound", list(augmenters.keys()))
 
 
+def getAugmentersVersions():
+	"""Versions of the augmenters, a part of the fingerprints of the cached augmented datasets"""
+	return OrderedDict((name, str(augmenter.version)) for name, augmenter in augmenters.items())
+
+
+def getStoredVersions():
+	"""The versions the stored results of the augmenters are keyed by: the version of an augmenter and a digest of the versions of the ones before it. An augmenter gets the models augmented by the previous ones, so a change of any of them invalidates its stored results."""
+	res = OrderedDict()
+	before = []
+	for name, augmenter in augmenters.items():
+		version = str(augmenter.version)
+		res[name] = version + "@" + hashlib.sha1(json.dumps(before).encode("utf-8")).hexdigest()[:12]
+		before.append((name, version))
+	return res
+
+
+def diffAttrs(before, after):
+	return {k: v for k, v in after.items() if k not in before or before[k] != v}
+
+
+def serializeAttrs(attrs: dict) -> str:
+	"""The attrs are stored as JSON, not pickled: the DBs with them are shared, and unpickling a downloaded DB would run arbitrary code. Dates become ISO strings, the other non-JSON values become strings."""
+	return json.dumps(makeSerializeable({k: (v.isoformat() if isinstance(v, date) else v) for k, v in attrs.items()}))
+
+
+def deserializeAttrs(attrs):
+	"""Returns `None` for the attrs which cannot be used, i.e. pickled by the previous versions, so they are recomputed"""
+	if not isinstance(attrs, str):
+		return None
+	try:
+		res = json.loads(attrs)
+	except ValueError:
+		return None
+	return res if isinstance(res, dict) else None
+
+
+def augmentModels(models, vendorNames, stored=None, newRecords=None):
+	"""Augments a list of model dicts passing it to each augmenter at once (see `Augmenter.batch`). Returns the list of augmented models and the list of `NotFound` flags. If `stored` (see `DB.getModelsAttrs`) is passed, the attrs added by an augmenter are taken from it if they were computed by the same versions of it and of the augmenters before it (see `getStoredVersions`) for the same model name, and only the rest are passed to the augmenter. The recomputed ones are appended to `newRecords`."""
+	rs = [type(m)(m) for m in models]
+	names = [m["name"] for m in models]
+	notFound = [0] * len(models)
+	anySuccess = [False] * len(models)
+	versions = getStoredVersions()
+	for name, augmenter in augmenters.items():
+		version = versions[name]
+		success = [False] * len(models)
+		toCompute = []
+		for i, m in enumerate(models):
+			rec = stored.get((m["id"], name)) if stored is not None else None
+			attrs = deserializeAttrs(rec["attrs"]) if rec is not None and rec["version"] == version and rec["model_name"] == names[i] else None
+			if attrs is not None:
+				success[i] = bool(rec["found"])
+				rs[i].update(attrs)
+			else:
+				toCompute.append(i)
+
+		if toCompute:
+			befores = [type(rs[i])(rs[i]) for i in toCompute] if newRecords is not None else None
+			computed = augmenter.batch([rs[i] for i in toCompute], [vendorNames[i] for i in toCompute])
+			for j, i in enumerate(toCompute):
+				success[i] = bool(computed[j])
+				if newRecords is not None:
+					newRecords.append({"model_id": models[i]["id"], "augmenter": name, "version": version, "model_name": names[i], "found": int(success[i]), "attrs": serializeAttrs(diffAttrs(befores[j], rs[i]))})
+
+		flag = getattr(NotFound, name)
+		for i, s in enumerate(success):
+			if s:
+				anySuccess[i] = True
+			else:
+				notFound[i] |= flag
+	return [r if ok else m for r, m, ok in zip(rs, models, anySuccess)], notFound
+
+
 def augmentModelDict(model, vendorName):
 	"""Augments a model dict"""
-	notFound = 0
-	r = type(model)(model)
-	for name, augmenter in augmenters.items():
-		success = augmenter(r, vendorName)
-		if not success:
-			notFound |= getattr(NotFound, name)
-		else:
-			model = r
-	return (model, notFound)
+	res, notFound = augmentModels([model], [vendorName])
+	return (res[0], notFound[0])
 
 
-def augmentDataset(dataset):
-	"""Augments data. Returns a report about augmentation."""
+def augmentDataset(dataset, db=None):
+	"""Augments data. Returns a report about augmentation. If `db` is passed, the stored results of the augmenters are used and the missing and outdated ones are computed and stored."""
 	notFound = defaultdict(int)
-	progress = mtqdm(dataset.models)
-	for m in progress:
-		vendorName = dataset.vendors[dataset.brands[m["brand_id"]]["vendor_id"]]["name"]
-		(dataset.models[m["id"]], nf) = augmentModelDict(m, vendorName)
+	stored = db.getModelsAttrs() if db is not None else None
+	newRecords = [] if db is not None else None
+	models = list(dataset.models)
+	vendorNames = [dataset.vendors[dataset.brands[m["brand_id"]]["vendor_id"]]["name"] for m in models]
+	augmented, notFounds = augmentModels(models, vendorNames, stored, newRecords)
+	for m, am, nf in zip(models, augmented, notFounds):
+		dataset.models[m["id"]] = am
 		notFound[m["name"]] |= nf
 		if notFound[m["name"]]:
-			progress.write(m["name"] + ": " + str(notFound[m["name"]]))
-			pass
+			print(m["name"] + ": " + str(notFound[m["name"]]), file=sys.stderr)
+	if newRecords:
+		try:
+			db.saveModelsAttrs(newRecords)
+		except sqlite3.OperationalError as ex:
+			print("Cannot store the results of augmenters: " + str(ex), file=sys.stderr)
 	return notFound
 
 
 def augmentStandaloneCollection(coll):
-	progress = mtqdm(coll)
-	for m in progress:
-		vendorName = None
-		if "brand" in m:
-			vendorName = m["brand"]
-		(mm, nf) = augmentModelDict(m, vendorName)
-		yield (mm)
+	"""Augments a collection of model dicts, i.e. the ones to predict for, `brand` is used as the vendor name. Returns a list."""
+	models = list(coll)
+	res, notFound = augmentModels(models, [m.get("brand", None) for m in models])
+	for m, nf in zip(models, notFound):
 		if nf:
-			progress.write(m["name"] + ": " + str(nf))
-			pass
+			print(m["name"] + ": " + str(nf), file=sys.stderr)
+	return res
 
 
-def augment(o):
+def augment(o, db=None):
 	if isinstance(o, Iterable) or hasattr(o, "__iter__"):
 		return augmentStandaloneCollection(o)
 	else:
-		return augmentDataset(o)
+		return augmentDataset(o, db)
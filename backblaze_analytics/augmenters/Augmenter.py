@@ -1,2 +1,6 @@
 class Augmenter:
-	pass
+	version = "1"  # bump when the attrs produced change, the results stored in the DB are recomputed then
+
+	def batch(self, models, vendorNames):
+		"""Augments a list of model dicts in place, returns a list of flags of success. Override it if the augmenter can process many models faster than one by one."""
+		return [bool(self(m, v)) for m, v in zip(models, vendorNames)]
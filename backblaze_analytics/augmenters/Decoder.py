@@ -1,3 +1,8 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import cpu_count
+
 import HDDModelDecoder
 
 from ..utils import flattenDict
@@ -6,18 +11,59 @@ from .Augmenter import Augmenter
 boolleanOptional = {"variable_rpm"}
 
 
+def getDecoderVersion():
+	try:
+		from importlib.metadata import version
+
+		return version("HDDModelDecoder")
+	except BaseException:
+		return str(getattr(HDDModelDecoder, "__version__", "unknown"))
+
+
+def decodeName(name):
+	"""Returns the flattened decoded attrs or `None`. Module-level to be picklable for process pools."""
+	try:
+		res = HDDModelDecoder.decodeModel(name, True)
+	except BaseException:
+		return None
+	if not res:
+		return None
+	for bName in boolleanOptional - set(res.keys()):
+		res[bName] = False
+	return flattenDict(res)
+
+
 class Decoder(Augmenter):
 	priority = 0
+	version = "1+" + getDecoderVersion()
+	parallelThreshold = 512  # less names are decoded faster than a pool of processes starts
 
 	def __call__(self, model, vendorName):
-		try:
-			res = HDDModelDecoder.decodeModel(model["name"], True)
-			if res:
-				for bName in boolleanOptional - set(res.keys()):
-					res[bName] = False
-				model.update(flattenDict(res))
-				return True
-			else:
-				return False
-		except BaseException:
+		res = decodeName(model["name"])
+		if res is None:
 			return False
+		model.update(res)
+		return True
+
+	def batch(self, models, vendorNames):
+		"""Decodes each distinct name once, in a pool of processes if there are many of them"""
+		names = list(OrderedDict.fromkeys(m["name"] for m in models))
+		decoded = None
+		workers = cpu_count() or 1
+		if len(names) >= self.parallelThreshold and workers > 1:
+			try:
+				with ProcessPoolExecutor(workers) as pool:
+					decoded = list(pool.map(decodeName, names, chunksize=max(1, len(names) // (4 * workers))))
+			except BrokenProcessPool:
+				decoded = None
+		if decoded is None:
+			decoded = [decodeName(n) for n in names]
+		decoded = dict(zip(names, decoded))
+
+		res = []
+		for m in models:
+			attrs = decoded[m["name"]]
+			if attrs is not None:
+				m.update(attrs)
+			res.append(attrs is not None)
+		return res
@@ -1,6 +1,7 @@
+import hashlib
 from datetime import datetime
-
-import dateutil.parser
+from functools import lru_cache
+from pathlib import Path
 
 from ..utils.myTSV import myTSV
 from .Augmenter import Augmenter
@@ -11,6 +12,8 @@ whitelist = {"first_known_date"}
 
 
 def loadModels(additionalDataPath):
+	import dateutil.parser
+
 	models = {}
 	for m in myTSV(additionalDataPath):
 		m["model"] = m["model"].upper()
@@ -22,15 +25,42 @@ def loadModels(additionalDataPath):
 	return models
 
 
-models = loadModels("./additionalData/models.tsv")
+additionalDataPath = Path("./additionalData/models.tsv")
+
+
+@lru_cache(maxsize=None)
+def getModels():
+	"""The table is parsed on the first use rather than on import"""
+	return loadModels(additionalDataPath)
+
+
+@lru_cache(maxsize=None)
+def getVersion():
+	return "1+" + hashlib.sha1(additionalDataPath.read_bytes()).hexdigest()[:12]  # the file is edited by hand
 
 
 class TSV(Augmenter):
 	priority = 1
 
+	@property
+	def version(self):
+		return getVersion()
+
 	def __call__(self, model, vendorName):
-		if model["name"] in models:
-			model.update(models[model["name"]])
+		table = getModels()
+		if model["name"] in table:
+			model.update(table[model["name"]])
 			return True
 		else:
 			return False
+
+	def batch(self, models, vendorNames):
+		"""A single hash join of the models with the table"""
+		table = getModels()
+		res = []
+		for m in models:
+			attrs = table.get(m["name"])
+			if attrs is not None:
+				m.update(attrs)
+			res.append(attrs is not None)
+		return res
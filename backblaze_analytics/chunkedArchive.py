@@ -0,0 +1,312 @@
+"""A seekable archive of the main DB: `drive_stats` is split into chunks of whole drives (contiguous packed rowid ranges), each chunk is xz-compressed independently and in parallel, and an index of the chunks is stored at the end of the file. The records of a drive or of a range of drives are extracted by decompressing only the chunks covering them.
+
+The file layout is `magic | chunk | ... | tables | index | footer`, where the footer is the offset and the size of the index and the magic again. A chunk is columnar: the concatenated raw arrays of the packed rowids and of each column of `drive_stats`, with NULLs stored as sentinels, like in `columnStore.py`. `tables` is the xz-compressed JSON with the rows of the other tables of the DB, BLOBs are stored as `{"$base64": ...}`; `index` is JSON with the schema, the columns and the chunks."""
+
+__all__ = ("writeArchive", "ChunkedArchive")
+
+import base64
+import json
+import lzma
+import sqlite3
+import struct
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from pathlib import Path
+
+import numpy as np
+
+from .columnStore import genSelectQuery, getColumnDType, rowsToArrays
+from .database import TableName, getStatsColumns, packedRowidColumn, tablesNames
+from .rowidHacks import bitsPerDate, maxOrd
+
+magic = b"BBDRVARC"
+formatVersion = 2  # 1 had no encoding of BLOBs
+supportedVersions = (1, 2)
+footerStruct = struct.Struct("<QQ8s")
+
+
+def compressChunk(arrays, preset: int):
+	"""Runs in a worker thread, `lzma` releases the GIL while compressing"""
+	return lzma.compress(b"".join(np.ascontiguousarray(a).tobytes() for a in arrays.values()), preset=preset)
+
+
+def chunkRecord(arrays, offset: int, size: int):
+	rowids = arrays[packedRowidColumn]
+	return OrderedDict((
+		("offset", offset),
+		("size", size),
+		("rows", len(rowids)),
+		("firstDrive", int(rowids[0] >> bitsPerDate)),
+		("lastDrive", int(rowids[-1] >> bitsPerDate)),
+	))
+
+
+def concatArrays(parts):
+	if len(parts) == 1:
+		return parts[0]
+	return OrderedDict((name, np.concatenate([p[name] for p in parts])) for name in parts[0])
+
+
+def splitAtDrive(arrays, chunkRows: int):
+	"""Splits the arrays before the first record of the drive crossing `chunkRows`, so a drive is never split between chunks. Returns `None` as the head if a single drive has more records."""
+	rowids = arrays[packedRowidColumn]
+	drives = rowids >> bitsPerDate
+	cut = int(np.searchsorted(drives, drives[chunkRows - 1], side="left"))
+	if cut == 0:
+		cut = int(np.searchsorted(drives, drives[0], side="right"))
+		if cut == len(rowids):
+			return None, arrays
+	return OrderedDict((n, a[:cut]) for n, a in arrays.items()), OrderedDict((n, a[cut:]) for n, a in arrays.items())
+
+
+def genChunks(db: sqlite3.Connection, columnsSpecs, chunkRows: int, batchSize: int):
+	"""Streams `drive_stats` in rowid order and yields dicts of column arrays of whole drives, each having about `chunkRows` records"""
+	cur = db.execute(genSelectQuery(columnsSpecs))
+	parts = []
+	buffered = 0
+	try:
+		while True:
+			batch = cur.fetchmany(batchSize)
+			if batch:
+				parts.append(rowsToArrays(batch, columnsSpecs))
+				buffered += len(batch)
+			while buffered >= chunkRows:
+				arrays = concatArrays(parts)
+				head, tail = splitAtDrive(arrays, chunkRows)
+				if head is None:
+					break
+				yield head
+				parts = [tail]
+				buffered = len(tail[packedRowidColumn])
+			if not batch:
+				break
+		if buffered:
+			yield concatArrays(parts)
+	finally:
+		cur.close()
+
+
+def sliceDrives(arrays, firstDrive: int, lastDrive: int):
+	"""Zero-copy slices of the arrays with the records of the drives within the range"""
+	rowids = arrays[packedRowidColumn]
+	s = slice(int(np.searchsorted(rowids, firstDrive << bitsPerDate, side="left")), int(np.searchsorted(rowids, (lastDrive << bitsPerDate) | maxOrd, side="right")))
+	return OrderedDict((n, a[s]) for n, a in arrays.items())
+
+
+def getOtherTables(db: sqlite3.Connection):
+	"""Returns the schema of the main DB and the rows of its tables except the records. The rows of the table for CSV import are not stored, after the normalization it is empty."""
+	schema = [r[0] for r in db.execute("select `sql` from `sqlite_master` where `sql` is not NULL and `name` not like 'sqlite_%' order by `type` = 'index', `rowid`;")]
+	skipped = {TableName.fromStr(tablesNames[t]).name for t in ("smart", "csvImportTemp")}
+	tables = OrderedDict()
+	for (name,) in db.execute("select `name` from `sqlite_master` where `type` = 'table' and `name` not like 'sqlite_%';").fetchall():
+		if name not in skipped:
+			tables[name] = db.execute("select * from `" + name + "`;").fetchall()
+	return schema, tables
+
+
+def encodeValue(v):
+	if isinstance(v, bytes):
+		return {"$base64": base64.b64encode(v).decode("ascii")}
+	return v
+
+
+def decodeValue(v):
+	if isinstance(v, dict):
+		return base64.b64decode(v["$base64"])
+	return v
+
+
+def encodeTables(tables):
+	"""JSON can't store BLOBs, i.e. the pickles or JSON of `models_attrs`, they are base64-encoded. The rows are lists of scalars, so a dict is never a value."""
+	return OrderedDict((name, [[encodeValue(v) for v in r] for r in rows]) for name, rows in tables.items())
+
+
+def decodeTables(tables):
+	return OrderedDict((name, [tuple(decodeValue(v) for v in r) for r in rows]) for name, rows in tables.items())
+
+
+def writeArchive(db: sqlite3.Connection, fileName: Path, chunkRows: int = 1 << 20, preset: int = 6, workers: int = None, batchSize: int = 100000, progress=None):
+	"""Writes the archive. `workers` threads compress the chunks (the count of CPUs by default), at most twice as many chunks are kept in memory. `progress(rows)` is called after each chunk is written. Returns the index. A partially written file is removed on failure."""
+	fileName = Path(fileName)
+	if fileName.exists():
+		raise FileExistsError(fileName)
+	if workers is None:
+		workers = cpu_count() or 1
+
+	try:
+		return _writeArchive(db, fileName, chunkRows, preset, workers, batchSize, progress)
+	except BaseException:
+		if fileName.exists():
+			fileName.unlink()
+		raise
+
+
+def _writeArchive(db: sqlite3.Connection, fileName: Path, chunkRows: int, preset: int, workers: int, batchSize: int, progress):
+	columnsSpecs = OrderedDict((name, getColumnDType(name, declaredType)) for name, declaredType in getStatsColumns(db))
+	schema, tables = getOtherTables(db)
+	chunks = []
+
+	with fileName.open("wb") as f, ThreadPoolExecutor(workers) as pool:
+		f.write(magic)
+		pending = deque()
+
+		def writeCompleted():
+			arrays, fut = pending.popleft()
+			blob = fut.result()
+			chunks.append(chunkRecord(arrays, f.tell(), len(blob)))
+			f.write(blob)
+			if progress is not None:
+				progress(len(arrays[packedRowidColumn]))
+
+		for arrays in genChunks(db, columnsSpecs, chunkRows, batchSize):
+			pending.append((arrays, pool.submit(compressChunk, arrays, preset)))
+			if len(pending) >= 2 * workers:
+				writeCompleted()
+		while pending:
+			writeCompleted()
+
+		tablesBlob = lzma.compress(json.dumps(encodeTables(tables)).encode("utf-8"), preset=preset)
+		index = OrderedDict()
+		index["version"] = formatVersion
+		index["schema"] = schema
+		index["recordsTable"] = TableName.fromStr(tablesNames["smart"]).name
+		index["columns"] = [{"name": name, "dtype": dtype.str, "null": null} for name, (dtype, null) in columnsSpecs.items()]
+		index["tables"] = {"offset": f.tell(), "size": len(tablesBlob)}
+		index["rows"] = sum(c["rows"] for c in chunks)
+		index["chunks"] = chunks
+		f.write(tablesBlob)
+
+		indexBlob = json.dumps(index).encode("utf-8")
+		indexOffset = f.tell()
+		f.write(indexBlob)
+		f.write(footerStruct.pack(indexOffset, len(indexBlob), magic))
+	print("Archived", index["rows"], "records in", len(chunks), "chunks", file=sys.stderr)
+	return index
+
+
+class ChunkedArchive:
+	"""Opens an archive for reading. Only the index is read on opening."""
+
+	def __init__(self, fileName: Path):
+		self.fileName = Path(fileName)
+		self.f = self.fileName.open("rb")
+		if self.f.read(len(magic)) != magic:
+			raise ValueError("Not an archive of the DB", self.fileName)
+		self.f.seek(-footerStruct.size, 2)
+		indexOffset, indexSize, m = footerStruct.unpack(self.f.read(footerStruct.size))
+		if m != magic:
+			raise ValueError("The archive is truncated", self.fileName)
+		self.index = json.loads(self.readBlob(indexOffset, indexSize).decode("utf-8"))
+		if self.index["version"] not in supportedVersions:
+			raise ValueError("Unsupported version of the archive", self.index["version"], supportedVersions)
+		self.columnsSpecs = OrderedDict((c["name"], (np.dtype(c["dtype"]), c["null"])) for c in self.index["columns"])
+		self.chunksLastDrives = np.array([c["lastDrive"] for c in self.index["chunks"]], dtype=np.int64)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args, **kwargs):
+		self.close()
+
+	def close(self):
+		self.f.close()
+
+	def __len__(self):
+		return self.index["rows"]
+
+	def readBlob(self, offset: int, size: int):
+		self.f.seek(offset)
+		return self.f.read(size)
+
+	def readChunk(self, i: int):
+		"""Decompresses a chunk into a dict of arrays with the packed rowids and the columns"""
+		c = self.index["chunks"][i]
+		buf = lzma.decompress(self.readBlob(c["offset"], c["size"]))
+		res = OrderedDict()
+		pos = 0
+		for name, dtype in [(packedRowidColumn, np.dtype(np.int64)), *((n, d) for n, (d, null) in self.columnsSpecs.items())]:
+			size = c["rows"] * dtype.itemsize
+			res[name] = np.frombuffer(buf, dtype=dtype, count=c["rows"], offset=pos)
+			pos += size
+		return res
+
+	def chunksOfDrives(self, firstDrive: int, lastDrive: int):
+		"""Indexes of the chunks which may contain records of the drives within the range"""
+		start = int(np.searchsorted(self.chunksLastDrives, firstDrive, side="left"))
+		res = []
+		for i in range(start, len(self.index["chunks"])):
+			if self.index["chunks"][i]["firstDrive"] > lastDrive:
+				break
+			res.append(i)
+		return res
+
+	def readDrives(self, firstDrive: int, lastDrive: int = None):
+		"""Returns a dict of arrays with the records of the drives within the range, decompressing only the chunks covering them"""
+		if lastDrive is None:
+			lastDrive = firstDrive
+		parts = [sliceDrives(self.readChunk(i), firstDrive, lastDrive) for i in self.chunksOfDrives(firstDrive, lastDrive)]
+		if not parts:
+			return OrderedDict((n, np.zeros(0, dtype=d)) for n, d in [(packedRowidColumn, np.dtype(np.int64)), *((n, d) for n, (d, null) in self.columnsSpecs.items())])
+		return concatArrays(parts)
+
+	def history(self, driveId: int):
+		"""The records of a drive with `ord` (days since 2012-01-01, like in the DB) instead of the packed rowids, like `ColumnStore.history`"""
+		arrays = self.readDrives(driveId)
+		res = OrderedDict()
+		res["ord"] = arrays.pop(packedRowidColumn) & maxOrd
+		res.update(arrays)
+		return res
+
+	def readTables(self):
+		t = self.index["tables"]
+		return decodeTables(json.loads(lzma.decompress(self.readBlob(t["offset"], t["size"])).decode("utf-8")))
+
+	def arraysToRows(self, arrays):
+		"""Converts the arrays into rows to insert into SQLite, the sentinels are replaced with NULLs"""
+		cols = [arrays[packedRowidColumn].tolist()]
+		for name, (dtype, null) in self.columnsSpecs.items():
+			a = arrays[name]
+			if null is None:
+				cols.append(a.tolist())
+			else:
+				col = a.astype(object)
+				col[a == null] = None
+				cols.append(col.tolist())
+		return zip(*cols)
+
+	def restore(self, fileName: Path, firstDrive: int = None, lastDrive: int = None, progress=None):
+		"""Restores the DB, or a DB with the records of the drives within the range only, into a new file. Returns the count of restored records."""
+		fileName = Path(fileName)
+		if fileName.exists():
+			raise FileExistsError(fileName)
+		if firstDrive is None:
+			chunks = range(len(self.index["chunks"]))
+		else:
+			if lastDrive is None:
+				lastDrive = firstDrive
+			chunks = self.chunksOfDrives(firstDrive, lastDrive)
+
+		columns = [packedRowidColumn, *self.columnsSpecs]
+		ins = "insert into `" + self.index["recordsTable"] + "` (" + ", ".join("`" + c + "`" for c in columns) + ") values (" + ", ".join("?" * len(columns)) + ");"
+		count = 0
+		with sqlite3.connect(str(fileName), 0, True) as db:
+			db.execute("PRAGMA journal_mode=OFF;")
+			db.execute("PRAGMA synchronous=OFF;")
+			for q in self.index["schema"]:
+				db.execute(q)
+			for name, rows in self.readTables().items():
+				if rows:
+					db.executemany("insert into `" + name + "` values (" + ", ".join("?" * len(rows[0])) + ");", rows)
+			for i in chunks:
+				arrays = self.readChunk(i)
+				if firstDrive is not None:
+					arrays = sliceDrives(arrays, firstDrive, lastDrive)
+				db.executemany(ins, self.arraysToRows(arrays))
+				count += len(arrays[packedRowidColumn])
+				if progress is not None:
+					progress(len(arrays[packedRowidColumn]))
+			db.commit()
+		db.close()
+		return count
@@ -0,0 +1,275 @@
+"""A column store mirroring `drive_stats`: a fixed-width `.npy` file per column, rows sorted by packed rowid, and arrays of drive ids and offsets of their first rows. The files are memory-mapped, so reading a few S.M.A.R.T. columns doesn't read the rest, and the history of a drive is a zero-copy slice found with `np.searchsorted`.
+
+NULLs are stored as sentinels: 255 for normalized values (254 and 255 are not valid normalized S.M.A.R.T. values) and the minimum of int64 for the rest."""
+
+__all__ = ("ColumnStore", "buildColumnStore", "updateColumnStore")
+
+import json
+import os
+import sqlite3
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from .database import getStatsColumns, packedRowidColumn, tablesNames
+from .rowidHacks import bitsPerDate, maxOrd, sqlThisDrive
+
+metaFileName = "meta.json"
+metaVersion = 1
+driveIdsFileName = "drive_ids.npy"
+driveOffsetsFileName = "drive_offsets.npy"
+
+normalizedNull = 255
+int64Null = int(np.iinfo(np.int64).min)
+
+
+def getColumnDType(name: str, declaredType: str):
+	if name == "failure":
+		return np.dtype(np.uint8), None
+	if declaredType.replace(" ", "").upper().startswith("INTEGER(1)"):
+		return np.dtype(np.uint8), normalizedNull
+	return np.dtype(np.int64), int64Null
+
+
+def genSelectQuery(columnsSpecs, where: str = None):
+	"""NULLs are replaced with the sentinels in SQL, so the fetched columns are converted into arrays without Python-level checks"""
+	parts = ["`" + packedRowidColumn + "`"]
+	for name, (dtype, null) in columnsSpecs.items():
+		parts.append("`" + name + "`" if null is None else "ifnull(`" + name + "`, " + str(null) + ")")
+	return "select " + ", ".join(parts) + " from " + tablesNames["smart"] + ((" where " + where) if where else "") + " order by `" + packedRowidColumn + "`;"
+
+
+def rowsToArrays(rows, columnsSpecs):
+	cols = list(zip(*rows)) or [()] * (len(columnsSpecs) + 1)
+	res = OrderedDict()
+	res[packedRowidColumn] = np.array(cols[0], dtype=np.int64)
+	for (name, (dtype, null)), col in zip(columnsSpecs.items(), cols[1:]):
+		res[name] = np.array(col, dtype=dtype)
+	return res
+
+
+def computeDriveOffsets(rowids, chunkSize: int = 1 << 22):
+	"""Returns sorted unique drive ids and offsets of their first rows, with the count of rows appended, so the rows of `driveIds[i]` are `offsets[i]:offsets[i + 1]`. Computed chunk-wise not to materialize the drive ids of all the rows."""
+	driveIds = []
+	offsets = []
+	prev = None
+	for i in range(0, len(rowids), chunkSize):
+		chunk = np.asarray(rowids[i : i + chunkSize]) >> bitsPerDate
+		starts = np.flatnonzero(np.diff(chunk)) + 1
+		if prev is None or chunk[0] != prev:
+			starts = np.concatenate(([0], starts))
+		driveIds.append(chunk[starts])
+		offsets.append(starts + i)
+		prev = chunk[-1]
+	driveIds = np.concatenate(driveIds) if driveIds else np.zeros(0, dtype=np.int64)
+	offsets = np.concatenate([*offsets, [len(rowids)]]) if offsets else np.zeros(1, dtype=np.int64)
+	return driveIds.astype(np.int64), offsets.astype(np.int64)
+
+
+class ColumnStore:
+	"""Opens a column store. Columns are memory-mapped read-only on the first access."""
+
+	def __init__(self, path: Path):
+		self.path = Path(path)
+		self.meta = json.loads((self.path / metaFileName).read_text())
+		self.columnsSpecs = OrderedDict((c["name"], (np.dtype(c["dtype"]), c["null"])) for c in self.meta["columns"])
+		self.mmaps = {}
+		self.driveIds = np.load(self.path / driveIdsFileName)
+		self.driveOffsets = np.load(self.path / driveOffsetsFileName)
+
+	def __len__(self):
+		return self.meta["rows"]
+
+	def column(self, name: str):
+		res = self.mmaps.get(name)
+		if res is None:
+			res = self.mmaps[name] = np.load(self.path / (name + ".npy"), mmap_mode="r")
+		return res
+
+	@property
+	def rowids(self):
+		return self.column(packedRowidColumn)
+
+	@property
+	def lastRowid(self):
+		"""The packed rowid of the last record in the store, `None` if it is empty"""
+		if not len(self):
+			return None
+		return int(self.rowids[-1])
+
+	def isUpToDate(self, db: sqlite3.Connection):
+		"""Checks that the store has the same columns and the same last record as `drive_stats`. An import of daily files normally changes the last one, since the newest drives get the records too."""
+		if [name for name, declaredType in getStatsColumns(db)] != list(self.columnsSpecs):
+			return False
+		return next(db.execute("select max(`" + packedRowidColumn + "`) from " + tablesNames["smart"] + ";"))[0] == self.lastRowid
+
+	def nullOf(self, name: str):
+		return self.columnsSpecs[name][1] if name in self.columnsSpecs else None
+
+	def driveSlice(self, driveId: int):
+		"""The slice of rows of a drive, an empty one if the drive is not present"""
+		i = np.searchsorted(self.driveIds, driveId)
+		if i >= len(self.driveIds) or self.driveIds[i] != driveId:
+			return slice(0, 0)
+		return slice(int(self.driveOffsets[i]), int(self.driveOffsets[i + 1]))
+
+	def history(self, driveId: int, columns=None):
+		"""Returns a dict of zero-copy slices of the columns for the rows of a drive, with `ord` (days since 2012-01-01, like in the DB) in it"""
+		if columns is None:
+			columns = self.columnsSpecs.keys()
+		s = self.driveSlice(driveId)
+		res = OrderedDict()
+		res["ord"] = self.rowids[s] & maxOrd
+		for c in columns:
+			res[c] = self.column(c)[s]
+		return res
+
+	def drivesStats(self):
+		"""Computes first and last ordinals of records and ordinals of the first failure of each drive, like `DBAnalyser.computeStatsForDrives` does with SQLite. Returns a dict of arrays."""
+		rowids = self.rowids
+		firsts = self.driveOffsets[:-1]
+		lasts = self.driveOffsets[1:] - 1
+		failureDates = np.full(len(self.driveIds), -1, dtype=np.int64)
+		failureRows = np.flatnonzero(self.column("failure"))
+		if len(failureRows):
+			owners = np.searchsorted(self.driveOffsets, failureRows, side="right") - 1
+			uniqOwners, firstFailures = np.unique(owners, return_index=True)
+			failureDates[uniqOwners] = rowids[failureRows[firstFailures]] & maxOrd
+		return {
+			"id": self.driveIds,
+			"first_date": rowids[firsts] & maxOrd,
+			"last_date": rowids[lasts] & maxOrd,
+			"failure_date": failureDates,
+		}
+
+	def updateDriveRecordsWithStats(self, drivesToComputeStats):
+		"""The same as `DBAnalyser.computeStatsForDrives`, but using the store"""
+		rowids = self.rowids
+		for d in drivesToComputeStats:
+			d = dict(d)
+			s = self.driveSlice(d["id"])
+			res = {"failure_date": None}
+			res.update(d)
+			if s.stop > s.start:
+				res["first_date"] = int(rowids[s.start] & maxOrd)
+				res["last_date"] = int(rowids[s.stop - 1] & maxOrd)
+			else:
+				res["first_date"] = res["last_date"] = None
+			yield res
+
+	def lastValues(self, columns):
+		"""Values of the columns in the last record of each drive, i.e. for feature extraction. Returns a dict of arrays aligned with `driveIds`."""
+		lasts = self.driveOffsets[1:] - 1
+		res = OrderedDict()
+		res["id"] = self.driveIds
+		for c in columns:
+			res[c] = self.column(c)[lasts]
+		return res
+
+
+def writeMeta(path: Path, columnsSpecs, rows: int):
+	meta = OrderedDict()
+	meta["version"] = metaVersion
+	meta["rows"] = rows
+	meta["columns"] = [{"name": name, "dtype": dtype.str, "null": null} for name, (dtype, null) in columnsSpecs.items()]
+	(path / metaFileName).write_text(json.dumps(meta, indent="\t"))
+
+
+def writeDriveOffsets(path: Path):
+	rowids = np.load(path / (packedRowidColumn + ".npy"), mmap_mode="r")
+	driveIds, offsets = computeDriveOffsets(rowids)
+	np.save(path / driveIdsFileName, driveIds)
+	np.save(path / driveOffsetsFileName, offsets)
+
+
+def buildColumnStore(db: sqlite3.Connection, path: Path, batchSize: int = 100000, progress=None):
+	"""Builds a store from scratch, streaming `drive_stats` in rowid order into preallocated memory-mapped `.npy` files"""
+	path = Path(path)
+	if (path / metaFileName).exists():
+		raise FileExistsError(path / metaFileName)
+	path.mkdir(parents=True, exist_ok=True)
+
+	columnsSpecs = OrderedDict((name, getColumnDType(name, declaredType)) for name, declaredType in getStatsColumns(db))
+	rows = next(db.execute("select count(*) from " + tablesNames["smart"] + ";"))[0]
+	files = OrderedDict()
+	files[packedRowidColumn] = np.lib.format.open_memmap(path / (packedRowidColumn + ".npy"), mode="w+", dtype=np.int64, shape=(rows,))
+	for name, (dtype, null) in columnsSpecs.items():
+		files[name] = np.lib.format.open_memmap(path / (name + ".npy"), mode="w+", dtype=dtype, shape=(rows,))
+
+	cur = db.execute(genSelectQuery(columnsSpecs))
+	pos = 0
+	while True:
+		batch = cur.fetchmany(batchSize)
+		if not batch:
+			break
+		if pos + len(batch) > rows:
+			raise RuntimeError("`drive_stats` has grown during the build, rebuild the store")
+		for name, arr in rowsToArrays(batch, columnsSpecs).items():
+			files[name][pos : pos + len(batch)] = arr
+		pos += len(batch)
+		if progress is not None:
+			progress(len(batch))
+	cur.close()
+	for f in files.values():
+		f.flush()
+	del files
+
+	writeDriveOffsets(path)
+	writeMeta(path, columnsSpecs, rows)
+	return ColumnStore(path)
+
+
+def fetchNewRows(db: sqlite3.Connection, store: ColumnStore, columnsSpecs):
+	"""Fetches the records of each drive newer than its last record in the store, using rowid ranges"""
+	rowids = store.rowids
+	q = genSelectQuery(columnsSpecs, sqlThisDrive(":drive", oid="`" + packedRowidColumn + "`", minOrd=":minOrd"))
+	res = []
+	for (driveId,) in db.execute("select `id` from " + tablesNames["drives"] + " order by `id`;").fetchall():
+		s = store.driveSlice(driveId)
+		minOrd = int(rowids[s.stop - 1] & maxOrd) + 1 if s.stop > s.start else 0
+		if minOrd > maxOrd:
+			continue
+		res.extend(db.execute(q, {"drive": driveId, "minOrd": minOrd}))
+	return res
+
+
+def mergeColumn(path: Path, name: str, newValues: np.ndarray, positions: np.ndarray, chunkSize: int = 1 << 22):
+	"""Inserts the new values before the `positions` of the old column, like `np.insert` does, but without loading the old column into memory"""
+	fn = path / (name + ".npy")
+	tmpFn = path / (name + ".npy.tmp")
+	old = np.load(fn, mmap_mode="r")
+	dst = np.lib.format.open_memmap(tmpFn, mode="w+", dtype=old.dtype, shape=(len(old) + len(newValues),))
+	dst[positions + np.arange(len(positions))] = newValues
+	for i in range(0, len(old), chunkSize):
+		idx = np.arange(i, min(i + chunkSize, len(old)))
+		dst[idx + np.searchsorted(positions, idx, side="right")] = old[i : i + chunkSize]
+	dst.flush()
+	del dst, old
+	os.replace(tmpFn, fn)
+
+
+def updateColumnStore(db: sqlite3.Connection, path: Path):
+	"""Adds the records appeared in `drive_stats` since the last build or update. Only the records newer than the last record of their drive in the store are picked, which is the case for the normal import of daily files. Returns the count of added records."""
+	path = Path(path)
+	store = ColumnStore(path)
+	columnsSpecs = store.columnsSpecs
+	actualColumns = [name for name, declaredType in getStatsColumns(db)]
+	if actualColumns != list(columnsSpecs):
+		raise ValueError("The columns of `drive_stats` have changed since the store was built, rebuild it")
+
+	newRows = fetchNewRows(db, store, columnsSpecs)
+	if not newRows:
+		return 0
+	newRows.sort(key=lambda r: r[0])
+	arrays = rowsToArrays(newRows, columnsSpecs)
+	positions = np.searchsorted(store.rowids, arrays[packedRowidColumn])
+	rows = len(store) + len(newRows)
+	del store
+	for name, arr in arrays.items():
+		mergeColumn(path, name, arr, positions)
+	writeDriveOffsets(path)
+	writeMeta(path, columnsSpecs, rows)
+	print("Added", len(newRows), "records into the column store", file=sys.stderr)
+	return len(newRows)
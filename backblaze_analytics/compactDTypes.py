@@ -0,0 +1,91 @@
+"""A policy of compact dtypes for the analysis frames derived from `datasetDescription.spec`. pandas gives `int64`, `float64` and `object` columns by default, which takes several times more memory than needed and limits the fraction of the dataset XGBoost can be fitted on.
+
+* ids and other integer columns get the smallest of `int16` and `int32` fitting their values;
+* binary attrs become `bool`, or `float32` with NaNs for the missing values;
+* categorical attrs become `pandas.Categorical`;
+* numerical attrs become floats, since the aggregators and fitters expect them;
+* floats become `float32` if all their values round-trip exactly."""
+
+__all__ = ("compactFrame", "compactColumn", "frameMemory")
+
+from lazily import numpy as np
+from lazily import pandas
+
+from .datasetDescription import spec as defaultSpec
+
+intTypes = ("int16", "int32")
+
+
+def frameMemory(pds):
+	"""Memory taken by a frame in bytes, including the contents of objects"""
+	return int(pds.memory_usage(deep=True).sum())
+
+
+def toFloat32IfExact(col):
+	"""`float32` if it represents all the values exactly, otherwise `float64`"""
+	values = col.to_numpy(dtype=np.float64, na_value=np.nan)
+	res = values.astype(np.float32)
+	if np.array_equal(res, values, equal_nan=True):
+		return pandas.Series(res, index=col.index)
+	return pandas.Series(values, index=col.index)
+
+
+def toSmallestInt(col):
+	if col.empty:
+		return col.astype(intTypes[0])
+	lo, hi = col.min(), col.max()
+	for t in intTypes:
+		info = np.iinfo(t)
+		if info.min <= lo and hi <= info.max:
+			return col.astype(t)
+	return col
+
+
+def compactColumn(col, kind: str = None):
+	"""Returns the column converted according to the policy, `kind` is its kind in `datasetDescription.spec` or `None`"""
+	dtype = col.dtype
+	if isinstance(dtype, pandas.CategoricalDtype):
+		return col
+
+	if kind == "categorical":
+		try:
+			return col.astype("category")
+		except TypeError:  # unhashable values
+			return col
+
+	if kind == "binary":
+		if dtype == bool:
+			return col
+		try:
+			values = col.astype(np.float64)
+		except (TypeError, ValueError):
+			return col
+		if values.isna().any():
+			return toFloat32IfExact(values)
+		if values.isin((0.0, 1.0)).all():
+			return values.astype(bool)
+		return col
+
+	if dtype == bool or dtype == object:
+		return col
+
+	if kind == "numerical":
+		return toFloat32IfExact(col)
+	if pandas.api.types.is_integer_dtype(dtype):
+		return toSmallestInt(col)
+	if pandas.api.types.is_float_dtype(dtype):
+		return toFloat32IfExact(col)
+	return col
+
+
+def compactFrame(pds, spec=None):
+	"""Converts the columns of the frame in place. Returns the memory taken by the frame before and after, in bytes."""
+	if spec is None:
+		spec = defaultSpec
+	before = frameMemory(pds)
+	for name in pds.columns:
+		col = pds[name]
+		res = compactColumn(col, spec.get(name))
+		if res is not col:
+			pds[name] = res
+	return before, frameMemory(pds)
@@ -1,8 +1,8 @@
 import typing
 import warnings
 
-import numpy as np
-import pandas
+from lazily import numpy as np
+from lazily import pandas
 from lazily.scipy.stats import gmean
 
 
@@ -10,7 +10,19 @@ class AggregationException(Exception):
 	pass
 
 
-AggregatorFuncT = typing.Callable[[pandas.DataFrame, float], dict]
+AggregatorFuncT = typing.Callable[["pandas.DataFrame", float], dict]
+
+
+def fixZeroDurations(durations: "np.ndarray", laplaceEstimatorZeroFix: float = 0.25) -> "np.ndarray":
+	"""Returns a copy of the durations with zeros replaced by `laplaceEstimatorZeroFix`, the column of the frame must not be modified, it may be shared with other frames"""
+	return np.where(durations == 0.0, laplaceEstimatorZeroFix, durations)
+
+
+vectorizedReductions = {
+	# name: (a numpy function transforming the values before taking the mean of the group, the inverse one applied after), the names are resolved lazily not to import numpy
+	"mean": (None, None),
+	"gmean": ("log", "exp"),
+}
 
 
 class Aggregator:
@@ -18,9 +30,15 @@ class Aggregator:
 	columnsToAggregate = None
 	weightCol = "$aggregateWeight"
 	aggregationFunc = None
+	reductions = None  # {resultColumn: (sourceColumn, reductionName)}, the reductions from `vectorizedReductions` are computed for all the groups in a single pass instead of calling `aggregationFunc` for each one
+	batchedAggregationFunc = None  # (pds, groupIds, groupsCount, laplaceEstimatorZeroFix) -> ({resultColumn: array of values of the groups}, {groupId: reason of failure}), computes all the groups at once
 
 	@classmethod
-	def _aggregate(cls, pds: pandas.DataFrame, modelAggregator: AggregatorFuncT, laplaceEstimatorZeroFix: float = 0.25):
+	def warnSkipped(cls, groupKey: dict, reason):
+		warnings.warn("Item with group ID " + repr(groupKey) + " was not imported because " + str(reason))
+
+	@classmethod
+	def _aggregate(cls, pds: "pandas.DataFrame", modelAggregator: AggregatorFuncT, laplaceEstimatorZeroFix: float = 0.25):
 		def a(pds):
 			#print(len(pds))
 			try:
@@ -31,7 +49,7 @@ class Aggregator:
 				#print(res)
 				return res
 			except AggregationException as ex:
-				warnings.warn("Item with group ID " + repr(pds.loc[:, cls.columnsToGroupBy].iloc[0].to_dict()) + " was not imported because " + str(ex))
+				cls.warnSkipped(pds.loc[:, cls.columnsToGroupBy].iloc[0].to_dict(), ex)
 			#except Exception as ex:
 			#	print(len(pds))
 			#	print(pds.loc[:, cls.columnsToGroupBy])
@@ -42,12 +60,57 @@ class Aggregator:
 		assert set(pds.columns) & set(cls.columnsToGroupBy)
 		#print("cls.columnsToGroupBy 2", cls.columnsToGroupBy)
 		res = pds.groupby(cls.columnsToGroupBy).apply(a)
-		res = res.reset_index(-1, True)
+		res = res.reset_index(level=-1, drop=True)
 		res = res.reset_index()
 		return res
 
+	@classmethod
+	def _aggregateVectorized(cls, pds: "pandas.DataFrame", laplaceEstimatorZeroFix: float = 0.25):
+		"""The same as `_aggregate` with `aggregationFunc`, but computes `reductions` with a single `groupby().agg`"""
+		assert set(pds.columns) & set(cls.columnsToGroupBy)
+		transformed = {}
+		for resCol, (srcCol, reductionName) in cls.reductions.items():
+			transform = vectorizedReductions[reductionName][0]
+			values = fixZeroDurations(pds.loc[:, srcCol].to_numpy(dtype=np.float64), laplaceEstimatorZeroFix)
+			transformed[resCol] = getattr(np, transform)(values) if transform is not None else values
+		transformed = pandas.DataFrame(transformed, index=pds.index)
+		for col in cls.columnsToGroupBy:
+			transformed[col] = pds.loc[:, col]
+
+		groups = transformed.groupby(cls.columnsToGroupBy, sort=True, observed=True)
+		sizes = groups.size()
+		res = groups.sum().div(sizes, axis=0).where(groups.count().eq(sizes, axis=0))  # `groups.mean()` skips NaNs, but `np.mean` in `aggregationFunc` propagates them
+		for resCol, (srcCol, reductionName) in cls.reductions.items():
+			inverse = vectorizedReductions[reductionName][1]
+			if inverse is not None:
+				res[resCol] = getattr(np, inverse)(res.loc[:, resCol])
+		res[cls.weightCol] = sizes
+		return res.reset_index()
+
+	@classmethod
+	def _aggregateBatched(cls, pds: "pandas.DataFrame", batchedAggregationFunc, laplaceEstimatorZeroFix: float = 0.25):
+		"""The same as `_aggregate`, but `batchedAggregationFunc` gets the ids of the groups of the rows and computes the results of all the groups at once. The failed groups are skipped with a warning, like the ones raising `AggregationException` in `_aggregate`."""
+		assert set(pds.columns) & set(cls.columnsToGroupBy)
+		groups = pds.groupby(cls.columnsToGroupBy, sort=True, observed=True)
+		groupIds = groups.ngroup().to_numpy()
+		sizes = groups.size()  # in the order of the ids of the groups
+		resColumns, failures = batchedAggregationFunc(pds, groupIds, len(sizes), laplaceEstimatorZeroFix)
+
+		res = pandas.DataFrame(resColumns, index=sizes.index)
+		res[cls.weightCol] = sizes.to_numpy()
+		keys = res.index.to_frame(index=False)
+		for groupId, reason in sorted(failures.items()):
+			cls.warnSkipped(keys.iloc[groupId].to_dict(), reason)
+		ok = np.ones(len(res), dtype=bool)
+		ok[list(failures)] = False
+		return res.loc[ok].reset_index()
+
 	@classmethod
 	def aggregate(cls, pds, laplaceEstimatorZeroFix: float = 0.25):
+		if cls.reductions is not None:
+			return cls._aggregateVectorized(pds, laplaceEstimatorZeroFix)
+		if cls.batchedAggregationFunc is not None:
+			return cls._aggregateBatched(pds, cls.batchedAggregationFunc, laplaceEstimatorZeroFix)
 		assert cls.aggregationFunc is not None, cls.__name__ + " doesn't contain an `aggregationFunc`, use `_aggregate` instead"
 		return cls._aggregate(pds, cls.aggregationFunc, laplaceEstimatorZeroFix)
 
@@ -63,16 +126,18 @@ class ParametricAggregator(Aggregator):
 
 
 class MeanAggregator(StrataAggregator):
+	reductions = {"duration_worked": ("duration_worked", "mean")}
+
 	@staticmethod
 	def aggregationFunc(pds, laplaceEstimatorZeroFix):
-		durations = pds.loc[:, "duration_worked"].values
-		durations[durations == 0.0] = laplaceEstimatorZeroFix
+		durations = fixZeroDurations(pds.loc[:, "duration_worked"].to_numpy(dtype=np.float64), laplaceEstimatorZeroFix)
 		return {"duration_worked": np.mean(durations)}
 
 
 class GMeanAggregator(StrataAggregator):
+	reductions = {"duration_worked": ("duration_worked", "gmean")}
+
 	@staticmethod
 	def aggregationFunc(pds, laplaceEstimatorZeroFix):
-		durations = pds.loc[:, "duration_worked"].values
-		durations[durations == 0.0] = laplaceEstimatorZeroFix
+		durations = fixZeroDurations(pds.loc[:, "duration_worked"].to_numpy(dtype=np.float64), laplaceEstimatorZeroFix)
 		return {"duration_worked": gmean(durations)}
@@ -1,12 +1,16 @@
-__all__ = ("DB", "DBNormalizer", "DBAnalyser", "databaseDefaultFileName")
+__all__ = ("DB", "DBNormalizer", "DBAnalyser", "ReadOnlyConnectionPool", "databaseDefaultFileName")
+import csv
 import itertools
 import json
 import os
 import platform
+import queue
 import re
 import sqlite3
 import sys
+import threading
 from collections import OrderedDict
+from contextlib import contextmanager
 from functools import lru_cache
 from pathlib import Path
 
@@ -20,7 +24,8 @@ tablesNames = {
 	"brands": "brands",
 	"models": "models",
 	"drives": "drives",
-	"smart": "drive_stats"
+	"smart": "drive_stats",
+	"modelsAttrs": "models_attrs"
 }
 tablesNames["csvImportTemp"] = tablesNames["smart"] + "_1"
 tablesNames = {k: ("`" + v + "`") for k, v in tablesNames.items()}
@@ -86,12 +91,16 @@ def dateToISO(date="`date`"):
 
 
 def createQueryWrapper(query):
-	def wrapper(self):
-		cur = self.db.cursor()
-		cur.row_factory = lambda *r: dict(sqlite3.Row(*r))
+	def wrapper(self, tuples: bool = False, params=()):
+		"""If `tuples`, returns `(columnsNames, rows)` with rows as tuples, it is much cheaper than a `dict` per row for large results. `params` are bound to the placeholders of the query."""
+		cur = self.readDB.cursor()
+		if not tuples:
+			cur.row_factory = lambda *r: dict(sqlite3.Row(*r))
 		#print(query)
-		cur.execute(query)
+		cur.execute(query, params)
 		res = list(cur)
+		if tuples:
+			res = ([d[0] for d in cur.description], res)
 		cur.close()
 		return res
 
@@ -164,8 +173,7 @@ class StatsTableSpec(DrivesStatsTableSpec):
 		yield (("packed_rowid", "INTEGER NOT NULL PRIMARY KEY"),)
 		yield from super().genSpecs()
 
-	def genModifiers(self):
-		return "FOREIGN KEY('drive_id') REFERENCES drives('id')"
+	# no FOREIGN KEY('drive_id') here: drive id is packed into rowid, there is no such a column, SQLite refuses to create a table with a FK on a missing column
 
 
 class TempStatsTableSpec(DrivesStatsTableSpec):
@@ -177,7 +185,16 @@ class TempStatsTableSpec(DrivesStatsTableSpec):
 
 tablesSchemas = {
 	"csvImportTemp": TempStatsTableSpec(tablesNames["csvImportTemp"], smartAttrIDs, smartAttrsResolvers.basic),
-	"smart": StatsTableSpec(tablesNames["smart"], hddAttrsIDs, smartAttrsResolvers.pretty)
+	"smart": StatsTableSpec(tablesNames["smart"], hddAttrsIDs, smartAttrsResolvers.pretty),
+	"modelsAttrs": TableSpec(
+		tablesNames["modelsAttrs"],
+		(
+			(("model_id", "INTEGER NOT NULL"), ("augmenter", "TEXT NOT NULL")),
+			(("version", "TEXT NOT NULL"), ("model_name", "TEXT NOT NULL")),
+			(("found", "INTEGER (1) NOT NULL"), ("attrs", "TEXT")),
+		),
+		"\t\tPRIMARY KEY(`model_id`, `augmenter`) ON CONFLICT REPLACE,\n\t\tFOREIGN KEY(`model_id`) REFERENCES models(`id`)"
+	)
 }
 
 fictiveSpecRepresentingTheAttrsNeededToBeMovedFromTempRecordsTableToPermanentOne = DrivesStatsTableSpec(tablesNames["csvImportTemp"], tablesSchemas["smart"].smartAttrIDs, tablesSchemas["csvImportTemp"].resolver)
@@ -220,12 +237,14 @@ class DB:
 
 	regexpWrapper = SQLiteRegexpWrapper()
 
-	def __init__(self, fileName: Path = None):
+	def __init__(self, fileName: Path = None, sharedBetweenThreads: bool = False):
+		"""If `sharedBetweenThreads`, the own connection may be used from any thread, the writes are serialized with `writeLock`"""
 		if fileName is None:
 			fileName = databaseDefaultFileName
 		fileName = Path(fileName)
 
-		self.db = sqlite3.connect(str(fileName), 0, True)
+		self.db = sqlite3.connect(str(fileName), 0, True, check_same_thread=not sharedBetweenThreads)
+		self.writeLock = threading.RLock()
 		__class__.regexpWrapper.attach(self.db)
 
 		for sq in __class__.genSetupQueries(fileName):
@@ -233,6 +252,11 @@ class DB:
 
 		os.environ.update(getTempDirEnvDict())
 
+	@property
+	def readDB(self):
+		"""The connection to run the read queries on"""
+		return self.db
+
 	def executescript(self, query, *args, **kwargs):
 		print(query, *args, kwargs, file=sys.stderr)
 		return self.db.executescript(query, *args, **kwargs)
@@ -241,7 +265,13 @@ class DB:
 		print(query, *args, kwargs, file=sys.stderr)
 		return self.db.execute(query, *args, **kwargs)
 
-	getAttachedDatabases = createQueryWrapper("PRAGMA database_list;")
+	def getAttachedDatabases(self):
+		"""The DBs attached to the own connection, not to the ones of a read pool, `ATTACH` is always done on it"""
+		cur = self.db.execute("PRAGMA database_list;")
+		names = [d[0] for d in cur.description]
+		res = [dict(zip(names, r)) for r in cur]
+		cur.close()
+		return res
 
 	@property
 	def attachedDatabases(self):
@@ -258,12 +288,23 @@ class DB:
 		qw = createQueryWrapper("PRAGMA table_info(" + str(tableName) + ");")
 		return qw(self)
 
-	def createTables(self):
+	def attachAnalyticsDB(self, analyticsDBFileName: Path = None):
+		"""Attaches the DB with analytics if it is not attached yet"""
+		if analysisDBName in self.attachedDatabases:
+			return
+		if not analyticsDBFileName:
+			analyticsDBFileName = analysisDatabaseDefaultFileName
+		analyticsDBFileName = Path(analyticsDBFileName)
+		self.db.execute("ATTACH DATABASE ? AS ?;", (str(analyticsDBFileName), analysisDBName))
+
+	def createTables(self, analyticsDBFileName: Path = None):
 		with (sqlFilesDir / "create.sql").open("rt", encoding="utf-8") as f:
 			query = f.read()
+		self.attachAnalyticsDB(analyticsDBFileName)
 		self.executescript(query)
 		self.executescript(tablesSchemas["csvImportTemp"]())
 		self.executescript(tablesSchemas["smart"]())
+		self.executescript(tablesSchemas["modelsAttrs"]())
 		self.db.commit()
 
 	def genSetupQueries(fileName: Path = None):
@@ -289,6 +330,24 @@ class DB:
 	getModels = dumbSelect(tablesNames["models"])
 	getVendors = dumbSelect(tablesNames["vendors"])
 	getDrives = dumbSelect(tablesNames["drives"])
+
+	def createModelsAttrsTableIfNeeded(self):
+		"""The table of the attrs added by augmenters was introduced after the DBs had been created, so it is created on demand"""
+		if TableName.fromStr(tablesNames["modelsAttrs"]) not in set(self.getTables()):
+			self.executescript(tablesSchemas["modelsAttrs"]())
+			self.db.commit()
+
+	def getModelsAttrs(self):
+		"""Returns the stored results of augmenters (see `augment.augmentDataset`) keyed by `(model_id, augmenter)`, or an empty dict if there is no table for them. `attrs` are JSON (see `augment.serializeAttrs`)."""
+		if TableName.fromStr(tablesNames["modelsAttrs"]) not in set(self.getTables()):
+			return {}
+		return {(r["model_id"], r["augmenter"]): r for r in dumbSelect(tablesNames["modelsAttrs"])(self)}
+
+	def saveModelsAttrs(self, records):
+		self.createModelsAttrsTableIfNeeded()
+		self.db.executemany("insert into " + tablesNames["modelsAttrs"] + " (`model_id`, `augmenter`, `version`, `model_name`, `found`, `attrs`) values (:model_id, :augmenter, :version, :model_name, :found, :attrs);", records)
+		self.db.commit()
+
 	getDrivesWithUnknownModel = createQueryWrapper("select * from " + tablesNames["drives"] + " d join " + tablesNames["models"] + " m on d.`model_id`=m.`id` where m.`brand_id` = 0;")
 
 	def exportTablesIntoExternalDBQueriesGen(tableNames, dstDbId):
@@ -319,26 +378,101 @@ class DB:
 				tmpDb.execute(q)
 			tmpDb.commit()
 
-	def cloneTables(self, tableNames, dstDbId):
+	def cloneTables(self, tableNames, dstDbId, vacuum: bool = False):
+		"""Copies the tables row by row. The destination is usually a new DB, the inserted rows are packed densely, so VACUUM, doubling the I/O, is not done by default."""
 		tableNames = list(tableNames)
 		self.cloneTablesSchema(tableNames, dstDbId)
 		self.exportTablesIntoExternalDB(tableNames, dstDbId)
 		self.db.commit()  # othervise we get OperationalError: database is locked
 		#self.execute("VACUUM " + dstDbId + ";")  # strange - too long if do it from main connection
 
-		with sqlite3.connect(str(self.attachedDatabases[dstDbId]["file"]), 0, True) as tmpDb:
-			tmpDb.execute("VACUUM;")
+		if vacuum:
+			with sqlite3.connect(str(self.attachedDatabases[dstDbId]["file"]), 0, True) as tmpDb:
+				tmpDb.execute("VACUUM;")
 
 	def cloneTablesIntoForeignDB(self, tableNames, dbFileName: Path, dbID):
 		self.db.execute("ATTACH DATABASE ? AS ?;", (str(dbFileName), dbID))
 		self.cloneTables(tableNames, dbID)
 		self.db.execute("DETACH DATABASE ?;", (dbID,))
 
-	def exportSomeTables(self, dbFileName: Path = "./drives.sqlite", what=None):
+	def backupInto(self, dbFileName: Path, dbID: str = "main", progress=None, pagesPerStep: int = 4096):
+		"""Copies a whole DB page by page with the online backup API. `progress(status, remaining, total)` is called after each step."""
+		with sqlite3.connect(str(dbFileName), 0, True) as dst:
+			self.db.backup(dst, pages=pagesPerStep, progress=progress, name=dbID)
+		dst.close()
+
+	def vacuumInto(self, dbFileName: Path, dbID: str = "main"):
+		"""Writes a compacted copy of a whole DB"""
+		self.execute("VACUUM " + dbID + " INTO ?;", (str(dbFileName),))
+
+	def copyDB(self, dbFileName: Path, dbID: str = "main", progress=None, maxFreeFraction: float = 0.25):
+		"""Copies a whole DB. If a large fraction of its pages is free, it is cheaper to write a compacted copy with `VACUUM INTO`, otherwise the pages are copied as is with the backup API, which reports progress."""
+		dbFileName = Path(dbFileName)
+		if dbFileName.exists():
+			raise FileExistsError(dbFileName)
+		freePages = next(self.db.execute("PRAGMA " + dbID + ".freelist_count;"))[0]
+		pages = next(self.db.execute("PRAGMA " + dbID + ".page_count;"))[0]
+		if sqlite3.sqlite_version_info >= (3, 27, 0) and freePages > pages * maxFreeFraction:
+			self.vacuumInto(dbFileName, dbID)
+		else:
+			self.backupInto(dbFileName, dbID, progress)
+
+	def chooseExportStrategy(self, tableNames, dbID: str = "main"):
+		"""Copying pages of the whole DB and dropping the unwanted tables is cheaper than copying rows, unless a large table is unwanted. Measuring the sizes of tables requires reading all their pages, so the tables of records are considered the large ones."""
+		unwanted = set(self.getTables(dbID)) - set(tableNames)
+		for tableId in ("smart", "csvImportTemp"):
+			tn = TableName.fromStr(tablesNames[tableId])
+			tn.dbID = dbID
+			if tn in unwanted and next(self.db.execute("select exists(select 1 from " + str(tn) + ");"))[0]:
+				return "insert"
+		return "backup"
+
+	def exportTables(self, tableNames, dbFileName: Path, progress=None, strategy: str = None):
+		"""Exports tables of a single DB into a new DB either by copying the whole DB and dropping the unwanted tables (`backup`) or by copying the rows (`insert`). The strategy is chosen by `chooseExportStrategy` if not set."""
+		tableNames = [TableName.fromStr(tn) if isinstance(tn, str) else tn for tn in tableNames]
+		dbIDs = {tn.dbID for tn in tableNames}
+		if len(dbIDs) != 1:
+			raise ValueError("The tables must be in the same DB", dbIDs)
+		dbID = next(iter(dbIDs))
+		dbFileName = Path(dbFileName)
+
+		if strategy is None:
+			strategy = self.chooseExportStrategy(tableNames, dbID)
+		print("Exporting", ", ".join(tn.name for tn in tableNames), "with", strategy, file=sys.stderr)
+
+		if strategy == "insert":
+			self.cloneTablesIntoForeignDB([str(tn) for tn in tableNames], dbFileName, "exportDb")
+			return
+
+		self.copyDB(dbFileName, dbID, progress)
+		wanted = {tn.name for tn in tableNames}
+		with sqlite3.connect(str(dbFileName), 0, True) as dst:
+			unwanted = [r[0] for r in dst.execute("select `name` from `sqlite_master` where `type` = 'table' and `name` not like 'sqlite_%';") if r[0] not in wanted]
+			for tn in unwanted:
+				dst.execute("DROP TABLE `" + tn + "`;")
+			dst.commit()
+			freePages = next(dst.execute("PRAGMA freelist_count;"))[0]
+			pages = next(dst.execute("PRAGMA page_count;"))[0]
+			if freePages * 4 > pages:
+				dst.execute("VACUUM;")
+		dst.close()
+
+	def exportSomeTables(self, dbFileName: Path = "./drives.sqlite", what=None, progress=None):
 		dbFileName = Path(dbFileName)
 		if not what:
 			what = ("vendors", "brands", "models", "drives")
-		self.cloneTablesIntoForeignDB([tablesNames[tn] for tn in what], dbFileName, "drivesDb")
+		self.exportTables([tablesNames[tn] for tn in what], dbFileName, progress)
+
+	def genToySMARTSelectQuery(mainTableSMARTName: TableName = None):
+		"""Generates a SQL query selecting the records of every `?`-th drive for a toy DB"""
+		if mainTableSMARTName is None:
+			mainTableSMARTName = TableName.fromStr(tablesNames["smart"])
+		return (
+			"select ds.* from " + str(mainTableSMARTName) + " ds "
+			+ "join " + tablesNames["drives"] + " dr on" +
+			sqlThisDrive(driveId="dr.`id`", oid="ds.`oid`")
+			+ " where (dr.`oid` % ?)==0;"
+		)
 
 	def exportToyDB(self, dbFileName=None, size=2 * 1024 * 1024):
 		if not dbFileName:
@@ -369,12 +503,7 @@ class DB:
 		mainTableSMARTName = TableName.fromStr(tablesNames["smart"])
 		print(repr(invertPart), type(invertPart))
 		self.execute("CREATE TABLE " + str(toyTableSMARTName) + " AS select * from " + str(mainTableSMARTName) + " where 0;")
-		self.execute(
-			"insert into " + str(toyTableSMARTName) +
-			"select ds.* from " + str(mainTableSMARTName) + " ds "
-			+ "join " + tablesNames["drives"] + " dr on" +
-			sqlThisDrive(driveId="dr.`id`", oid="ds.`oid`")
-			+ " where (dr.`oid` % ?)==0;", (invertPart,))
+		self.execute("insert into " + str(toyTableSMARTName) + " " + __class__.genToySMARTSelectQuery(mainTableSMARTName), (invertPart,))
 		self.db.commit()
 		self.db.execute("DETACH DATABASE ?;", (dbID,))
 		self.db.commit()
@@ -416,6 +545,25 @@ class DBNormalizer(DB):
 		self.executescript(query)
 		self.db.commit()
 
+	def importCSV(self, fileName: Path, batchSize: int = 10000):
+		"""Imports a CSV file of the dataset into csvImportTemp the same way `.import` of `sqlite3` CLI does it (empty fields are imported as empty strings). Returns the count of imported records."""
+		fileName = Path(fileName)
+		count = 0
+		with fileName.open("rt", encoding="utf-8", newline="") as f:
+			rdr = csv.reader(f)
+			header = next(rdr)
+			q = "insert into " + tablesNames["csvImportTemp"] + " (" + ", ".join("`" + c + "`" for c in header) + ") values (" + ", ".join("?" * len(header)) + ");"
+			cur = self.db.cursor()
+			while True:
+				batch = list(itertools.islice(rdr, batchSize))
+				if not batch:
+					break
+				cur.executemany(q, batch)
+				count += len(batch)
+			cur.close()
+		self.db.commit()
+		return count
+
 	def getLastDenormalizedRow(self):
 		return next(self.db.execute("select `OID`, " + dateToOrdinal("`date`") + " AS `day`, * from " + tablesNames["csvImportTemp"] + " where unlikely(`oid` = (select max(`oid`) from " + tablesNames["csvImportTemp"] + "))"))
 
@@ -486,9 +634,30 @@ class DBNormalizer(DB):
 		return (size, generatorOfProgress(constraint))
 
 
-@lru_cache(maxsize=4, typed=True)
-def genDriveStatsDenormQuery(failed=True, reduced=False):
-	"""Generates a sql query to get precomputed stats for the drives in a form convenient for analysis"""
+packedRowidColumn = "packed_rowid"
+
+
+def getStatsColumns(db: sqlite3.Connection):
+	"""Returns a list of `(name, declaredType)` of the columns of `drive_stats`, the packed rowid excluded. The actual columns are used, not the ones in `tablesSchemas`, since the DB may have been created before new columns have been added."""
+	return [(r[1], r[2]) for r in db.execute("PRAGMA table_info(" + tablesNames["smart"] + ");") if r[1] != packedRowidColumn]
+
+
+def genFailedAndDurationColumns(failed=True, reduced=False):
+	"""`failed` and `duration_worked` of a drive, the target of survival analysis. The time to failure comes from S.M.A.R.T. if it is available, otherwise from the dates in the dataset."""
+	if reduced:
+		failureExpr = "(a.`failure_date` - a.`first_date`)"
+		totalExpr = "(a.`last_date` - a.`first_date`)"
+	else:
+		failureExpr = "fa.`power_on_hours_raw`/24"
+		totalExpr = "la.`power_on_hours_raw`/24"
+	if failed:
+		return "(" + failureExpr + " is not null) as `failed`, ifnull(" + failureExpr + ", " + totalExpr + ") as `duration_worked`"
+	return "0 as `failed`, " + totalExpr + " as `duration_worked`"
+
+
+@lru_cache(maxsize=8, typed=True)
+def genDriveStatsDenormQuery(failed=True, reduced=False, condition=None):
+	"""Generates a sql query to get precomputed stats for the drives in a form convenient for analysis. `condition` on the drives analytics table `a` is added to the `where` clause."""
 	return (
 		"select\n"
 		+ ("(a.`failure_date` - a.`first_date`)" if failed else "null")
@@ -505,7 +674,7 @@ def genDriveStatsDenormQuery(failed=True, reduced=False):
 			)
 			if not reduced else ""
 		)
-		+ r"""a.*
+		+ "a.*, " + genFailedAndDurationColumns(failed, reduced) + r"""
 		from """ + tablesNames["drivesAnalytics"] + " a "
 		+ (
 			(
@@ -521,15 +690,16 @@ def genDriveStatsDenormQuery(failed=True, reduced=False):
 			if failed else
 			"where likely(a.`failure_date` is NULL)"
 		)
+		+ (" and " + condition if condition else "")
 	)
 
 
-@lru_cache(maxsize=2, typed=True)
-def genDriveStatsDenormQueryUnioned(reduced=False):
+@lru_cache(maxsize=4, typed=True)
+def genDriveStatsDenormQueryUnioned(reduced=False, condition=None):
 	return (
-		genDriveStatsDenormQuery(failed=True, reduced=reduced)
+		genDriveStatsDenormQuery(failed=True, reduced=reduced, condition=condition)
 		+ "\nUNION\n"
-		+ genDriveStatsDenormQuery(failed=False, reduced=reduced)
+		+ genDriveStatsDenormQuery(failed=False, reduced=reduced, condition=condition)
 	)
 
 
@@ -540,18 +710,175 @@ def genAnomaliesExclusionWrapperQuery(queryText):
 	)
 
 
-class DBAnalyser(DB):
-	"""Contains the functions dealing with computing statistics and removing anomalies"""
+def genDriveIdHashExpr(driveId="a.`id`", seed=":seed"):
+	"""A pseudorandom permutation of 32-bit drive ids (Knuth's multiplicative hash of the id xored with the seed). SQLite has neither xor nor a hash function."""
+	return "((((" + driveId + " | " + seed + ") - (" + driveId + " & " + seed + ")) * 2654435761) & 4294967295)"
+
+
+def genDriveStatsDenormSampledQuery(reduced=False):
+	"""The same as `genAnomaliesExclusionWrapperQuery(genDriveStatsDenormQueryUnioned(reduced))`, but only for a deterministic stratified sample of drives: `:failedFraction` of the failed and `:censoredFraction` of the censored drives of each model, but not less than `:minPerStratum` drives of a stratum if its fraction is non-zero. Drives are ranked within their stratum by `genDriveIdHashExpr`, so the sample depends only on `:seed` and the larger fractions give supersets of the smaller ones. The sample is drawn from the small tables of drives and their analytics and restricts the joins with `drive_stats`, so the records of the unsampled drives are never read."""
+	return ("with anomDrives AS (select `id` from `anomalies`),\n" +
+		"strata AS (\n" +
+		"select a.`id`, (a.`failure_date` is not NULL) as `failed`,\n" +
+		"row_number() over (partition by (a.`failure_date` is not NULL), d.`model_id` order by " + genDriveIdHashExpr() + ") as `rank`,\n" +
+		"count(*) over (partition by (a.`failure_date` is not NULL), d.`model_id`) as `size`\n" +
+		"from " + tablesNames["drivesAnalytics"] + " a join " + tablesNames["drives"] + " d on d.`id` = a.`id`\n" +
+		"where likely(a.`id` not in anomDrives)\n" +
+		"),\n" +
+		"sampledDrives AS (select `id` from (select `id`, `rank`, `size`, (case when `failed` then :failedFraction else :censoredFraction end) as `fraction` from strata) where `fraction` > 0 and `rank` <= max(:minPerStratum, round(`size` * `fraction`)))\n" +
+		genDriveStatsDenormQueryUnioned(reduced, "a.`id` in sampledDrives") + ";"
+	)
+
+
+def genReadOnlyURI(fileName: Path, immutable: bool = False):
+	"""Generates a URI to open a DB read-only. `immutable` makes SQLite skip locking and change detection completely, use it only for the files nobody modifies, like frozen exports."""
+	return Path(fileName).absolute().as_uri() + "?mode=ro" + ("&immutable=1" if immutable else "")
+
 
-	def __init__(self, fileName: Path = None, analyticsDBFileName=None):
-		super().__init__(fileName)
+class ReadOnlyConnectionPool:
+	"""A pool of read-only connections to a DB with the DB with analytics attached, having the same UDFs and pragmas as `DB`. A connection is used by a single thread at a time: either the one bound to the current thread (`connection`) or the one borrowed for a task (`borrow`). The DB with analytics is attached only if it exists, since read-only mode cannot create it. Use it as a context manager."""
+
+	def __init__(self, fileName: Path = None, analyticsDBFileName: Path = None, immutable: bool = False):
+		if fileName is None:
+			fileName = databaseDefaultFileName
+		if not analyticsDBFileName:
+			analyticsDBFileName = analysisDatabaseDefaultFileName
+		self.fileName = Path(fileName)
+		self.analyticsDBFileName = Path(analyticsDBFileName)
+		self.immutable = immutable
+
+		self.local = threading.local()
+		self.idle = queue.SimpleQueue()
+		self.lock = threading.Lock()
+		self.connections = []
+
+	def genSetupQueries(self):
+		yield "PRAGMA query_only=1;"
+		yield "PRAGMA main.mmap_size=" + str(getDBMmapSize(self.fileName, 1024 * 1024 * 1024)) + ";"
+		if self.analyticsDBFileName.exists():
+			yield "PRAGMA " + analysisDBName + ".mmap_size=" + str(getDBMmapSize(self.analyticsDBFileName, 12 * 1024 * 1024)) + ";"
+
+	def connect(self):
+		"""Opens a new connection. Prefer `connection` and `borrow`, they reuse the connections."""
+		db = sqlite3.connect(genReadOnlyURI(self.fileName, self.immutable), 0, True, check_same_thread=False, uri=True)
+		DB.regexpWrapper.attach(db)
+		if self.analyticsDBFileName.exists():
+			db.execute("ATTACH DATABASE ? AS ?;", (genReadOnlyURI(self.analyticsDBFileName, self.immutable), analysisDBName))
+		for sq in self.genSetupQueries():
+			db.execute(sq)
+		with self.lock:
+			self.connections.append(db)
+		return db
+
+	@property
+	def connection(self):
+		"""The connection bound to the current thread"""
+		db = getattr(self.local, "db", None)
+		if db is None:
+			db = self.local.db = self.connect()
+		return db
+
+	@contextmanager
+	def borrow(self):
+		"""Lends an idle connection for a task, for the cases the threads are not long-living, i.e. an executor"""
+		try:
+			db = self.idle.get_nowait()
+		except queue.Empty:
+			db = self.connect()
+		try:
+			yield db
+		finally:
+			self.idle.put(db)
+
+	def close(self):
+		with self.lock:
+			for db in self.connections:
+				db.close()
+			self.connections = []
+		self.local = threading.local()
+		self.idle = queue.SimpleQueue()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args, **kwargs):
+		self.close()
+
+
+class DBAnalyser(DB):
+	"""Contains the functions dealing with computing statistics and removing anomalies. If `readPool` is passed, the read queries are run on its connection bound to the current thread, so the analyser can be used from multiple threads: the writes are done on the own connection serialized with `writeLock`. If `columnStore` (see `columnStore.py`, either a `ColumnStore` or a path to it) is passed, the stats, histories and last values of drives are read from it instead of `drive_stats`. A store lagging behind `drive_stats` is updated on opening, and rejected if it is still not up to date after that."""
+
+	def __init__(self, fileName: Path = None, analyticsDBFileName=None, readPool: ReadOnlyConnectionPool = None, columnStore=None):
+		if readPool is not None:
+			if fileName is None:
+				fileName = readPool.fileName
+			if not analyticsDBFileName:
+				analyticsDBFileName = readPool.analyticsDBFileName
+		super().__init__(fileName, sharedBetweenThreads=readPool is not None)
 		if not analyticsDBFileName:
 			analyticsDBFileName = analysisDatabaseDefaultFileName
 		analyticsDBFileName = Path(analyticsDBFileName)
+		self.readPool = readPool
+		self.columnStore = self.openColumnStore(columnStore) if columnStore is not None else None
 
 		self.db.execute("ATTACH DATABASE ? AS ?;", (str(analyticsDBFileName), analysisDBName))
 		self.db.execute("PRAGMA " + analysisDBName + ".mmap_size=" + str(getDBMmapSize(analyticsDBFileName, 12 * 1024 * 1024)) + ";")
 
+	@property
+	def readDB(self):
+		if self.readPool is not None:
+			return self.readPool.connection
+		return self.db
+
+	def openColumnStore(self, store):
+		"""Opens the column store if a path is given and brings it up to date with `drive_stats`"""
+		from .columnStore import ColumnStore, updateColumnStore
+
+		if not isinstance(store, ColumnStore):
+			store = ColumnStore(store)
+		if store.isUpToDate(self.readDB):
+			return store
+		updateColumnStore(self.readDB, store.path)
+		store = ColumnStore(store.path)
+		if not store.isUpToDate(self.readDB):
+			raise ValueError("The column store " + str(store.path) + " doesn't match `drive_stats` even after the update, rebuild it")
+		return store
+
+	def getDriveHistory(self, driveId: int, columns=None):
+		"""Returns a dict of arrays of the columns for the records of a drive, with `ord` (days since 2012-01-01) in it. NULLs are replaced with the sentinels of `columnStore.py` in both cases, so the result doesn't depend on whether the column store is used."""
+		if self.columnStore is not None:
+			return self.columnStore.history(driveId, columns)
+
+		from .columnStore import genSelectQuery, getColumnDType, rowsToArrays
+
+		specs = OrderedDict((name, getColumnDType(name, declaredType)) for name, declaredType in getStatsColumns(self.readDB))
+		columnsSpecs = specs if columns is None else OrderedDict((c, specs[c]) for c in columns)
+		rows = self.readDB.execute(genSelectQuery(columnsSpecs, sqlThisDrive(":drive", oid="`" + packedRowidColumn + "`")), {"drive": driveId}).fetchall()
+		arrays = rowsToArrays(rows, columnsSpecs)
+		res = OrderedDict()
+		res["ord"] = arrays.pop(packedRowidColumn) & maxOrd
+		res.update(arrays)
+		return res
+
+	def getLastValues(self, columns):
+		"""Values of the columns in the last record of each drive having records, i.e. for feature extraction. Returns a dict of arrays with `id` in it, sorted by it."""
+		if self.columnStore is not None:
+			return self.columnStore.lastValues(columns)
+
+		from .columnStore import genSelectQuery, getColumnDType, rowsToArrays
+
+		specs = {name: getColumnDType(name, declaredType) for name, declaredType in getStatsColumns(self.readDB)}
+		columnsSpecs = OrderedDict((c, specs[c]) for c in columns)
+		q = genSelectQuery(columnsSpecs, "`" + packedRowidColumn + "` = (select max(`" + packedRowidColumn + "`) from " + tablesNames["smart"] + " where " + sqlThisDrive(":drive", oid="`" + packedRowidColumn + "`") + ")")
+		rows = []
+		for (driveId,) in self.readDB.execute("select `id` from " + tablesNames["drives"] + " order by `id`;").fetchall():
+			rows.extend(self.readDB.execute(q, {"drive": driveId}))
+		arrays = rowsToArrays(rows, columnsSpecs)
+		res = OrderedDict()
+		res["id"] = arrays.pop(packedRowidColumn) >> bitsPerDate
+		res.update(arrays)
+		return res
+
 	def genArgQuery(func, minOrd=0, driveId=":id", date=None, ordinal="`ord`", oid="`oid`"):
 		"""generates a SQL query to get info from the rowid to which a function is applied"""
 		return "select " + sqlFromOid(oid=func + "(" + oid + ")", driveId="id", date=date, ordinal=ordinal) + r" from " + tablesNames["smart"] + " where " + sqlThisDrive(driveId, minOrd=minOrd, oid=oid)
@@ -578,7 +905,7 @@ class DBAnalyser(DB):
 		return __class__.genArgQuery("max", minOrd=sqlDateToOrd(":last_date"), ordinal="`last_date`")
 
 	def updateDriveRecordsWithStats(self, drivesToComputeStats, query):
-		cur = self.db.cursor()
+		cur = self.readDB.cursor()
 		cur.row_factory = lambda *r: dict(sqlite3.Row(*r))
 
 		protoToCreateTheOnesWhichMayBeNotPresent = {k: None for k in ("failure_date",)}
@@ -595,6 +922,9 @@ class DBAnalyser(DB):
 
 	def computeStatsForDrives(self, drivesToComputeStats):
 		"""finds first and last dates the drivesToComputeStats have in dataset, augment the records, returns augmented records"""
+		if self.columnStore is not None:
+			yield from self.columnStore.updateDriveRecordsWithStats(drivesToComputeStats)
+			return
 		yield from self.updateDriveRecordsWithStats(drivesToComputeStats, __class__.genComputeStatsForDrivesQuery())
 
 	def recomputeStatsForDrives(self, drivesToComputeStats):
@@ -605,21 +935,22 @@ class DBAnalyser(DB):
 		"""saves the computed stats into a DB"""
 		stats = iter(stats)
 		items0 = next(stats)
-		cur = self.db.cursor()
 		keys = items0.keys()
 		q = (
 			"INSERT INTO " + tablesNames["drivesAnalytics"] + " (" + ", ".join(("`" + k + "`" for k in keys)) + ") " +
 			"VALUES (" + ", ".join((":" + k for k in keys)) + ");"
 		)
-		cur.execute(q, items0)
-		cur.executemany(q, stats)
-		#for s in stats:
-		#	cur.execute(q, s)
-		#	self.db.commit()
-		self.db.commit()
+		with self.writeLock:
+			cur = self.db.cursor()
+			cur.execute(q, items0)
+			cur.executemany(q, stats)
+			#for s in stats:
+			#	cur.execute(q, s)
+			#	self.db.commit()
+			self.db.commit()
 
 	def findLastOrdinalInAnalytics(self):
-		return next(self.db.execute("select max(`last_date`) from " + tablesNames["drivesAnalytics"] + ";"))[0]
+		return next(self.readDB.execute("select max(`last_date`) from " + tablesNames["drivesAnalytics"] + ";"))[0]
 
 	def findLastDateTimeInAnalytics(self):
 		return dateTimeFromOrd(self.findLastOrdinalInAnalytics())
@@ -638,13 +969,18 @@ class DBAnalyser(DB):
 
 	findFailureRecords = createQueryWrapper(genFindFailureRecordsQuery())
 
-	getKnownFailedDrivesDates = createQueryWrapper("select " + sqlFromOid("`id`", date=None, ordinal="`failure_date`", oid="st.`oid`") + ", st.`failure`" " from " + tablesNames["smart"] + " st" + " join " + tablesNames["drivesAnalytics"] + " an on (" + sqlThisDrive(driveId="an.`id`", oid="st.`oid`", minOrd="an.`first_date`", maxOrd="an.`last_date`") + ") where unlikely(an.`failure_date` is not NULL);")  # we have to do this shit and then filter manually because SQLITE query optimizer is too dumb and eliminates our rowid hacks
+	def genKnownFailedDrivesDatesQuery(onlyFailureRecords=False):
+		"""generates a SQL query to get the records of the drives known to be failed"""
+		return (
+			"select " + sqlFromOid("`id`", date=None, ordinal="`failure_date`", oid="st.`oid`") + ("" if onlyFailureRecords else ", st.`failure`") +
+			" from " + tablesNames["smart"] + " st" +
+			" join " + tablesNames["drivesAnalytics"] + " an on (" + sqlThisDrive(driveId="an.`id`", oid="st.`oid`", minOrd="an.`first_date`", maxOrd="an.`last_date`") + ") where unlikely(an.`failure_date` is not NULL)" +
+			(" and unlikely(st.`failure` = 1)" if onlyFailureRecords else "") + ";"
+		)
 
-	getKnownFailedDrivesFailureRecords = createQueryWrapper(
-		"select " + sqlFromOid("`id`", date=None, ordinal="`failure_date`", oid="st.`oid`") +
-		" from " + tablesNames["smart"] + " st" +
-		" join " + tablesNames["drivesAnalytics"] + " an on (" + sqlThisDrive(driveId="an.`id`", oid="st.`oid`", minOrd="an.`first_date`", maxOrd="an.`last_date`") + ") where unlikely(an.`failure_date` is not NULL) and unlikely(st.`failure` = 1);"
-	)  # doesn't work any better than findFailureRecords, creates a covering index
+	getKnownFailedDrivesDates = createQueryWrapper(genKnownFailedDrivesDatesQuery())  # we have to do this shit and then filter manually because SQLITE query optimizer is too dumb and eliminates our rowid hacks
+
+	getKnownFailedDrivesFailureRecords = createQueryWrapper(genKnownFailedDrivesDatesQuery(onlyFailureRecords=True))  # doesn't work any better than findFailureRecords, creates a covering index
 
 	findNonevaluatedDrives = createQueryWrapper("select `id` from " + tablesNames["drives"] + " where `id` not in (select `id` from " + tablesNames["drivesAnalytics"] + ");")
 
@@ -657,6 +993,12 @@ class DBAnalyser(DB):
 	getNonFailedDrivesStatsDenorm = createQueryWrapper(genAnomaliesExclusionWrapperQuery(genDriveStatsDenormQuery(failed=False)))
 
 	getDrivesStatsDenormReduced = createQueryWrapper(genAnomaliesExclusionWrapperQuery(genDriveStatsDenormQueryUnioned(reduced=True)))
+
+	# pass the params of `genDriveStatsDenormSampledQuery` as `params`
+	getDrivesStatsDenormSampled = createQueryWrapper(genDriveStatsDenormSampledQuery())
+	getDrivesStatsDenormSampledReduced = createQueryWrapper(genDriveStatsDenormSampledQuery(reduced=True))
+
+	getFailedAndCensoredCounts = createQueryWrapper("select count(`failure_date`) as `failed`, count(*) - count(`failure_date`) as `censored` from " + tablesNames["drivesAnalytics"] + " where likely(`id` not in (select `id` from `anomalies`));")
 	getFailedDrivesStatsDenormReduced = createQueryWrapper(genAnomaliesExclusionWrapperQuery(genDriveStatsDenormQuery(failed=True, reduced=True)))
 	getNonFailedDrivesStatsDenormReduced = createQueryWrapper(genAnomaliesExclusionWrapperQuery(genDriveStatsDenormQuery(failed=False, reduced=True)))
 
@@ -668,7 +1010,8 @@ class DBAnalyser(DB):
 
 	def saveAnomalies(self, anomaliesItems):
 		"""Saves anomalied drives into DB to exclude from analysis"""
-		cur = self.db.cursor()
-		cur.executemany("insert into " + tablesNames["anomalies"] + " values (:id, :info);", ({"id": k, "info": json.dumps(v)} for k, v in anomaliesItems))
-		cur.close()
-		self.db.commit()
+		with self.writeLock:
+			cur = self.db.cursor()
+			cur.executemany("insert into " + tablesNames["anomalies"] + " values (:id, :info);", ({"id": k, "info": json.dumps(v)} for k, v in anomaliesItems))
+			cur.close()
+			self.db.commit()
@@ -1,10 +1,11 @@
+import sqlite3
 from collections import OrderedDict
 
 import more_itertools
 
 from . import database
-from .augment import augment
-from .utils import export
+from .drivesIndex import DrivesIndex
+from .utils import detectFormat, export, exportStream, streamingFormats
 from .utils.custom_lists import *
 from .utils.mtqdm import mtqdm
 
@@ -29,34 +30,72 @@ def normalizeModelName(vendor, model):
 	return max(tokens, key=len)
 
 
+def normalizeNameInModelDict(brands, m):
+	m["name"] = normalizeModelName(
+		brands[
+			m["brand_id"]
+		]["name"],
+		m["name"]
+	).upper()
+	return m
+
+
 class Dataset:
 	indexes = ("drives", "models", "brands", "vendors")
 
 	def normalizeNameInModelDict(self, m):
-		m["name"] = normalizeModelName(
-			self.brands[
-				m["brand_id"]
-			]["name"],
-			m["name"]
-		).upper()
-		return m
+		return normalizeNameInModelDict(self.brands, m)
 
 	def __init__(self, dbPath=None):
+		self.dbPath = dbPath
 		with database.DB(dbPath) as db:
-			(self.vendors, self.vendorsByName) = createIndexArrayForDB(db.getVendors())
+			(self.vendors, self.vendorsByName) = createIndexArrayForDB(db.getVendors(), ZeroBasedList)  # ids of vendors start from 0, the `Unknown` one
 			(self.brands, self.brandsByName) = createIndexArrayForDB(db.getBrands())
-			(self.drives, self.drivesBySerial) = createIndexArrayForDB(db.getDrives(), nameColumn="serial_number")
+			self.drives = DrivesIndex.fromDB(db.readDB)
 			(self.models, self.modelsByName) = createIndexArrayForDB(map(self.normalizeNameInModelDict, db.getModels()))
 			self.reduced = __class__._isReduced(db)
 
-	def augment(self):
-		augment(self)
+	@property
+	def drivesBySerial(self):
+		return self.drives.bySerial
+
+	def augment(self, useStored: bool = True):
+		"""Adds the attrs from the augmenters to the models. Unless `useStored` is `False`, the results of the augmenters stored in the `models_attrs` table of the DB are used and only the missing and outdated ones are computed and stored."""
+		from .augment import augment  # the augmenters are heavy to import
+
+		if not useStored:
+			return augment(self)
+		with database.DB(self.dbPath) as db:
+			return augment(self, db)
 
 	def getAvailableAttrs(self):
 		return {k for k in more_itertools.flatten((m.keys() for m in self.models))}
 
-	def export(self, fileName=None, format=None, what=("vendors", "brands", "models", "drives")):
-		return export(OrderedDict(  ( (propName, getattr(self, propName)) for propName in what)  ), fileName, format)
+	def export(self, fileName=None, format=None, what=("vendors", "brands", "models", "drives"), compression=None):
+		"""Streaming formats (see `utils.streamingFormats`) are written row by row and can be compressed, the rest are dumped as a single document"""
+		if (format or (detectFormat(fileName)[0] if fileName is not None else None)) in streamingFormats:
+			return exportStream(((propName, getattr(self, propName)) for propName in what), fileName, format, compression)
+		if compression is not None:
+			raise ValueError("Compression is supported only for the streaming formats: " + ", ".join(streamingFormats))
+		return export(OrderedDict(  ( (propName, self.drives.toRecords() if propName == "drives" else getattr(self, propName)) for propName in what)  ), fileName, format)
+
+	@staticmethod
+	def exportStreamFromDB(dbPath=None, fileName=None, format=None, what=("vendors", "brands", "models", "drives"), compression=None):
+		"""The same as `export` into a streaming format, but the rows are read from DB cursors, so the tables are never loaded into memory"""
+		with database.DB(dbPath) as db:
+			brands = createIndexArrayForDB(db.getBrands())[0]
+
+			def genRows(propName):
+				cur = db.readDB.cursor()
+				cur.row_factory = lambda *r: dict(sqlite3.Row(*r))
+				cur.execute("select * from " + database.tablesNames[propName] + ";")
+				if propName == "models":
+					yield from (normalizeNameInModelDict(brands, m) for m in cur)
+				else:
+					yield from cur
+				cur.close()
+
+			return exportStream(((propName, genRows(propName)) for propName in what), fileName, format, compression)
 
 	@staticmethod
 	def _isReduced(db):
@@ -68,12 +107,24 @@ class Dataset:
 			return _isReduced(db)
 
 	@staticmethod
-	def stats(dbPath=None, reduced=None):
-		with database.DBAnalyser(dbPath) as db:
+	def stats(dbPath=None, reduced=None, analyticsDBPath=None, tuples: bool = False, sampling: dict = None):
+		"""If `sampling` is passed, returns only the stats of a stratified sample of drives drawn by the DB, it is a dict of the params of `database.genDriveStatsDenormSampledQuery`"""
+		with database.DBAnalyser(dbPath, analyticsDBPath) as db:
 			if reduced is None:
 				reduced = __class__._isReduced(db)
-			if reduced:
-				res = db.getDrivesStatsDenormReduced()
+			if sampling is not None:
+				if reduced:
+					res = db.getDrivesStatsDenormSampledReduced(tuples, sampling)
+				else:
+					res = db.getDrivesStatsDenormSampled(tuples, sampling)
+			elif reduced:
+				res = db.getDrivesStatsDenormReduced(tuples)
 			else:
-				res = db.getDrivesStatsDenorm()  # damn slow
+				res = db.getDrivesStatsDenorm(tuples)  # damn slow
 		return res
+
+	@staticmethod
+	def countFailedAndCensored(dbPath=None, analyticsDBPath=None):
+		"""Counts of the failed and censored drives having stats, the anomalous ones excluded"""
+		with database.DBAnalyser(dbPath, analyticsDBPath) as db:
+			return db.getFailedAndCensoredCounts()[0]
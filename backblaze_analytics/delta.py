@@ -0,0 +1,181 @@
+"""Incremental delta packages for the consumers of prepared DBs. A package is an xz-compressed SQLite DB with the records of `drive_stats` newer than a watermark (an ordinal of a date), the drives having them, the whole small tables of vendors, brands and models, and the analytics that could have changed. It is applied transactionally, records are inserted in rowid order, so they are appended to the b-tree of each drive.
+
+The tables of drives and models have no timestamps, so the ones of the drives with new records and all the models are shipped. Analytics are recomputed over the whole dataset, so `drives_analytics` rows with `last_date` after the watermark are shipped, and `anomalies` and `censored_drives`, which are small, are replaced entirely."""
+
+__all__ = ("exportDelta", "importDelta", "getRecordsWatermark", "readDeltaMeta")
+
+import json
+import lzma
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+from .database import DBAnalyser, TableName, getStatsColumns, packedRowidColumn, tablesNames
+from .rowidHacks import dateTimeFromOrd, maxOrd, sqlOrdFromOid, sqlThisDrive
+from .subset import copyAll, copyRuns, createDestDB, genIdsRuns, hasTable
+
+deltaFormatVersion = 1
+deltaDBName = "delta"
+metaTableName = "delta_meta"
+drivesInfoTables = ("vendors", "brands", "models")
+wholeAnalyticsTables = ("anomalies", "censoredDrives")
+
+
+def getRecordsWatermark(db: DBAnalyser):
+	"""The ordinal of the last date of records in the DB. Taken from the analytics if they are present, otherwise `drive_stats` is fully scanned."""
+	if hasTable(db, "drivesAnalytics"):
+		res = db.findLastOrdinalInAnalytics()
+		if res is not None:
+			return res
+	print("No analytics, scanning all the records to find the last date", file=sys.stderr)
+	res = next(db.readDB.execute("select max(" + sqlOrdFromOid(None, "`" + packedRowidColumn + "`") + ") from " + tablesNames["smart"] + ";"))[0]
+	return -1 if res is None else res
+
+
+def localName(tableId: str):
+	return "`" + TableName.fromStr(tablesNames[tableId]).name + "`"
+
+
+def copyNewRecords(src: sqlite3.Connection, dst: sqlite3.Connection, since: int, batchSize: int = 10000, progress=None):
+	"""Copies the records newer than `since` drive by drive using rowid ranges. Returns the ids of the drives having them and the max ordinal of the copied records."""
+	columns = ["`" + packedRowidColumn + "`"] + ["`" + name + "`" for name, declaredType in getStatsColumns(src)]
+	q = "select " + ", ".join(columns) + " from " + tablesNames["smart"] + " where " + sqlThisDrive(":drive", oid="`" + packedRowidColumn + "`", minOrd=":minOrd") + " order by `" + packedRowidColumn + "`;"
+	ins = "insert into " + localName("smart") + " (" + ", ".join(columns) + ") values (" + ", ".join("?" * len(columns)) + ");"
+	touched = []
+	until = since
+	for (driveId,) in src.execute("select `id` from " + tablesNames["drives"] + " order by `id`;").fetchall():
+		cur = src.execute(q, {"drive": driveId, "minOrd": since + 1})
+		while True:
+			batch = cur.fetchmany(batchSize)
+			if not batch:
+				break
+			if not touched or touched[-1] != driveId:
+				touched.append(driveId)
+			dst.executemany(ins, batch)
+			until = max(until, batch[-1][0] & maxOrd)
+		if progress is not None:
+			progress(1)
+	return touched, until
+
+
+def writeMeta(dst: sqlite3.Connection, meta):
+	dst.execute("create table `" + metaTableName + "` (`key` TEXT PRIMARY KEY, `value` TEXT);")
+	dst.executemany("insert into `" + metaTableName + "` values (?, ?);", ((k, json.dumps(v)) for k, v in meta.items()))
+
+
+def compressFile(src: Path, dst: Path, preset: int = 6):
+	with src.open("rb") as fi, lzma.open(dst, "wb", preset=preset) as fo:
+		shutil.copyfileobj(fi, fo, 1 << 20)
+
+
+def exportDelta(db: DBAnalyser, fileName: Path, since: int, preset: int = 6, batchSize: int = 10000, progress=None):
+	"""Writes the package of the changes made after the ordinal `since` into an xz-compressed file. `progress(1)` is called after each drive is processed. Returns the meta of the package."""
+	fileName = Path(fileName)
+	if fileName.exists():
+		raise FileExistsError(fileName)
+	src = db.readDB
+	tmpFileName = fileName.parent / (fileName.name + ".tmp.sqlite")
+	if tmpFileName.exists():
+		tmpFileName.unlink()
+
+	counts = OrderedDict()
+	try:
+		with createDestDB(tmpFileName) as dst:
+			for tableId in (*drivesInfoTables, "drives", "smart"):
+				dst.execute(db.getTableCreationQuery(tablesNames[tableId]))
+			for tableId in drivesInfoTables:
+				counts[tableId] = copyAll(src, dst, tablesNames[tableId], localName(tableId))
+
+			touched, until = copyNewRecords(src, dst, since, batchSize, progress)
+			counts["smart"] = next(dst.execute("select count(*) from " + localName("smart") + ";"))[0]
+			counts["drives"] = copyRuns(src, dst, tablesNames["drives"], localName("drives"), "`id`", genIdsRuns(touched), batchSize=batchSize)
+
+			analyticsTables = []
+			if hasTable(db, "drivesAnalytics"):
+				analyticsTables.append("drivesAnalytics")
+				dst.execute(db.getTableCreationQuery(tablesNames["drivesAnalytics"]))
+				cur = src.execute("select * from " + tablesNames["drivesAnalytics"] + " where `last_date` > ? order by `id`;", (since,))
+				dst.executemany("insert into " + localName("drivesAnalytics") + " values (" + ", ".join("?" * len(cur.description)) + ");", cur)
+				counts["drivesAnalytics"] = next(dst.execute("select count(*) from " + localName("drivesAnalytics") + ";"))[0]
+			for tableId in wholeAnalyticsTables:
+				if hasTable(db, tableId):
+					analyticsTables.append(tableId)
+					dst.execute(db.getTableCreationQuery(tablesNames[tableId]))
+					counts[tableId] = copyAll(src, dst, tablesNames[tableId], localName(tableId))
+
+			meta = OrderedDict()
+			meta["version"] = deltaFormatVersion
+			meta["since"] = since
+			meta["until"] = until
+			meta["columns"] = [name for name, declaredType in getStatsColumns(src)]
+			meta["analytics"] = analyticsTables
+			meta["counts"] = counts
+			writeMeta(dst, meta)
+			dst.commit()
+		dst.close()
+		compressFile(tmpFileName, fileName, preset)
+	finally:
+		if tmpFileName.exists():
+			tmpFileName.unlink()
+	print("Packed", counts["smart"], "records of", counts["drives"], "drives from", dateTimeFromOrd(since + 1).date(), "to", dateTimeFromOrd(until).date(), file=sys.stderr)
+	return meta
+
+
+def readDeltaMeta(db: sqlite3.Connection, dbID: str = deltaDBName):
+	return {k: json.loads(v) for k, v in db.execute("select `key`, `value` from " + dbID + ".`" + metaTableName + "`;")}
+
+
+def checkDeltaApplicable(db: DBAnalyser, meta, force: bool = False):
+	if meta["version"] != deltaFormatVersion:
+		raise ValueError("Unsupported version of the delta package", meta["version"], deltaFormatVersion)
+	columns = {name for name, declaredType in getStatsColumns(db.db)}
+	missing = [c for c in meta["columns"] if c not in columns]
+	if missing:
+		raise ValueError("The DB lacks the columns of `drive_stats` present in the package, upgrade its schema first", missing)
+	if force:
+		return
+	watermark = getRecordsWatermark(db)
+	if watermark < meta["since"]:
+		raise ValueError("The DB has records till " + str(dateTimeFromOrd(watermark).date()) + ", but the package has them since " + str(dateTimeFromOrd(meta["since"] + 1).date()) + ", apply the missing packages first")
+
+
+def applyDelta(db: DBAnalyser, meta):
+	"""Applies the attached package in a single transaction. Rows of the tables keyed by id are replaced. Returns a dict with counts of applied rows."""
+	res = OrderedDict()
+	src = deltaDBName + "."
+	columns = ", ".join("`" + c + "`" for c in [packedRowidColumn, *meta["columns"]])
+	with db.db:
+		for tableId in (*drivesInfoTables, "drives"):
+			res[tableId] = db.db.execute("insert or replace into " + tablesNames[tableId] + " select * from " + src + localName(tableId) + " order by `id`;").rowcount
+		res["smart"] = db.db.execute("insert or replace into " + tablesNames["smart"] + " (" + columns + ") select " + columns + " from " + src + localName("smart") + " order by `" + packedRowidColumn + "`;").rowcount
+		for tableId in meta["analytics"]:
+			if tableId in wholeAnalyticsTables:
+				db.db.execute("delete from " + tablesNames[tableId] + ";")
+			res[tableId] = db.db.execute("insert or replace into " + tablesNames[tableId] + " select * from " + src + localName(tableId) + " order by `id`;").rowcount
+	return res
+
+
+def importDelta(db: DBAnalyser, fileName: Path, force: bool = False, tmpDir: Path = None):
+	"""Applies a package created by `exportDelta`. It is decompressed into a temporary file in `tmpDir` (the dir of the DB by default). Unless `force` is set, refuses to apply the package if the DB lacks the records before it. Returns a dict with counts of applied rows."""
+	if tmpDir is None:
+		tmpDir = db.attachedDatabases["main"]["file"].parent
+	fd, tmpFileName = tempfile.mkstemp(suffix=".sqlite", dir=str(tmpDir))
+	tmpFileName = Path(tmpFileName)
+	try:
+		with lzma.open(fileName, "rb") as fi, os.fdopen(fd, "wb") as fo:
+			shutil.copyfileobj(fi, fo, 1 << 20)
+		db.db.execute("ATTACH DATABASE ? AS ?;", (str(tmpFileName), deltaDBName))
+		try:
+			meta = readDeltaMeta(db.db)
+			checkDeltaApplicable(db, meta, force)
+			res = applyDelta(db, meta)
+		finally:
+			db.db.execute("DETACH DATABASE ?;", (deltaDBName,))
+	finally:
+		tmpFileName.unlink()
+	print("Applied the records from", dateTimeFromOrd(meta["since"] + 1).date(), "to", dateTimeFromOrd(meta["until"]).date(), file=sys.stderr)
+	return res
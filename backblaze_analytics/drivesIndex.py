@@ -0,0 +1,156 @@
+"""A compact columnar index of drives: sorted NumPy arrays of ids, model ids and serial numbers instead of a `dict` per drive. Rows are accessed through lightweight read-only views, so `ds.drives[id]["model_id"]` keeps working, and vectorized code takes the arrays directly."""
+
+__all__ = ("DrivesIndex", "DriveView")
+
+import sqlite3
+from collections.abc import Mapping
+
+import numpy as np
+
+from .database import tablesNames
+from .utils.custom_lists import CustomBaseList
+
+driveColumns = ("id", "model_id", "serial_number")
+nullModelId = -1
+
+
+class DriveView(Mapping):
+	"""A read-only dict-like view of a row of `DrivesIndex`"""
+
+	__slots__ = ("index", "row")
+
+	def __init__(self, index: "DrivesIndex", row: int):
+		self.index = index
+		self.row = row
+
+	def __getitem__(self, key: str):
+		if key == "id":
+			return int(self.index.ids[self.row])
+		if key == "model_id":
+			res = int(self.index.modelIds[self.row])
+			return None if res == nullModelId else res
+		if key == "serial_number":
+			return self.index.serials[self.row].decode("utf-8")
+		raise KeyError(key)
+
+	def __iter__(self):
+		return iter(driveColumns)
+
+	def __len__(self):
+		return len(driveColumns)
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + repr(dict(self)) + ")"
+
+
+class SerialsIndex(Mapping):
+	"""Maps serial numbers to the views of drives using binary search over the sorted serials"""
+
+	__slots__ = ("index", "order", "sortedSerials")
+
+	def __init__(self, index: "DrivesIndex"):
+		self.index = index
+		self.order = np.argsort(index.serials, kind="stable")
+		self.sortedSerials = index.serials[self.order]
+
+	def __getitem__(self, serial: str):
+		key = serial.encode("utf-8")
+		i = int(np.searchsorted(self.sortedSerials, key))
+		if i >= len(self.sortedSerials) or self.sortedSerials[i] != key:
+			raise KeyError(serial)
+		return DriveView(self.index, int(self.order[i]))
+
+	def __iter__(self):
+		return (s.decode("utf-8") for s in self.sortedSerials)
+
+	def __len__(self):
+		return len(self.sortedSerials)
+
+
+class DrivesIndex:
+	"""`ids` are sorted, `modelIds` has -1 for unknown models, `serials` are UTF-8 bytes. Indexing by a drive id returns a `DriveView` or `None` for an absent drive, like the list it replaces."""
+
+	__slots__ = ("ids", "modelIds", "serials", "rowOfId", "_bySerial")
+
+	def __init__(self, ids: np.ndarray, modelIds: np.ndarray, serials: np.ndarray):
+		order = np.argsort(ids, kind="stable")
+		self.ids = np.asarray(ids, dtype=np.int64)[order]
+		self.modelIds = np.asarray(modelIds, dtype=np.int32)[order]
+		self.serials = np.asarray(serials, dtype=np.bytes_)[order]
+		self.rowOfId = np.full(int(self.ids[-1]) + 1 if len(self.ids) else 0, -1, dtype=np.int32)
+		self.rowOfId[self.ids] = np.arange(len(self.ids), dtype=np.int32)
+		self._bySerial = None
+
+	@classmethod
+	def fromDB(cls, db: sqlite3.Connection, batchSize: int = 100000):
+		"""Reads the table of drives in batches, no `dict`s are created"""
+		ids, modelIds, serials = [], [], []
+		cur = db.execute("select `id`, ifnull(`model_id`, " + str(nullModelId) + "), `serial_number` from " + tablesNames["drives"] + " order by `id`;")
+		while True:
+			batch = cur.fetchmany(batchSize)
+			if not batch:
+				break
+			i, m, s = zip(*batch)
+			ids.append(np.array(i, dtype=np.int64))
+			modelIds.append(np.array(m, dtype=np.int32))
+			serials.append(np.array([x.encode("utf-8") for x in s], dtype=np.bytes_))
+		cur.close()
+		if not ids:
+			return cls(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype="S1"))
+		return cls(np.concatenate(ids), np.concatenate(modelIds), np.concatenate(serials))
+
+	def __getstate__(self):
+		return (self.ids, self.modelIds, self.serials, self.rowOfId)
+
+	def __setstate__(self, state):
+		self.ids, self.modelIds, self.serials, self.rowOfId = state
+		self._bySerial = None
+
+	def __len__(self):
+		return len(self.ids)
+
+	def __iter__(self):
+		return (DriveView(self, i) for i in range(len(self.ids)))
+
+	def __contains__(self, driveId: int):
+		return self.rowOf(driveId) >= 0
+
+	def rowOf(self, driveId: int):
+		if 0 <= driveId < len(self.rowOfId):
+			return int(self.rowOfId[driveId])
+		return -1
+
+	def __getitem__(self, driveId: int):
+		row = self.rowOf(driveId)
+		if row < 0:
+			return None
+		return DriveView(self, row)
+
+	@property
+	def bySerial(self):
+		if self._bySerial is None:
+			self._bySerial = SerialsIndex(self)
+		return self._bySerial
+
+	def rowsOf(self, driveIds: np.ndarray):
+		"""Vectorized `rowOf`, -1 for absent drives"""
+		driveIds = np.asarray(driveIds, dtype=np.int64)
+		res = np.full(len(driveIds), -1, dtype=np.int32)
+		inRange = (driveIds >= 0) & (driveIds < len(self.rowOfId))
+		res[inRange] = self.rowOfId[driveIds[inRange]]
+		return res
+
+	def modelIdsOf(self, driveIds: np.ndarray):
+		"""Model ids of the drives, -1 for absent drives and unknown models"""
+		rows = self.rowsOf(driveIds)
+		res = np.full(len(rows), nullModelId, dtype=np.int32)
+		present = rows >= 0
+		res[present] = self.modelIds[rows[present]]
+		return res
+
+	def toRecords(self):
+		"""Dicts of the drives in the list indexed by drive id the index replaces, with `None` for the absent ids, so the documents exported by `Dataset.export` keep their shape"""
+		res = CustomBaseList()
+		for d in self:
+			res[d["id"]] = dict(d)
+		return res
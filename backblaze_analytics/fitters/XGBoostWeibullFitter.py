@@ -40,7 +40,7 @@ from lifelines.utils import ConvergenceError
 from lifelines.utils.sklearn_adapter import LifelinesSKLearnAdapter
 from sklearn.model_selection import cross_validate
 
-from ..core.Aggregator import AggregationException, ParametricAggregator
+from ..core.Aggregator import AggregationException, ParametricAggregator, fixZeroDurations
 
 # Λ(x) = (T/λ)**ρ
 # λ(x) = (T/λ)**(ρ−1)*(ρ/λ)
@@ -153,6 +153,48 @@ def WeibullKLGradHess_lambda(lambdas, lambdas_true, rhos_true):
 	return klreg_lambdas, klreg_lambdalambda
 
 
+def fitWeibullBatched(durations: np.ndarray, events: np.ndarray, groupIds: np.ndarray, groupsCount: int, maxIters: int = 100, tolerance: float = 1e-10):
+	"""The MLE of right-censored Weibull distributions (the same parametrization as `lifelines.WeibullFitter`) of all the groups at once. λ is profiled out: for a fixed ρ the MLE is λ**ρ = ΣT**ρ / ΣE, so Newton iterations are done over log ρ only, the profile score of a group
+		ΣT**ρ·log T / ΣT**ρ − 1/ρ − ΣE·log T / ΣE
+	is increasing and has a single root if the group has failures. All the sums are segment reductions over `groupIds` with `np.bincount`. Returns `(lambdas, rhos, converged)`, the groups without failures have no MLE and never converge."""
+	durations = np.asarray(durations, dtype=np.float64)
+	events = np.asarray(events, dtype=np.float64)
+
+	def segmentSum(values):
+		return np.bincount(groupIds, weights=values, minlength=groupsCount)
+
+	logDurations = np.log(durations)
+	logMaxDurations = np.full(groupsCount, -np.inf)
+	np.maximum.at(logMaxDurations, groupIds, logDurations)
+	logScaled = logDurations - logMaxDurations[groupIds]  # <= 0, so T**ρ doesn't overflow; the score doesn't depend on the scale
+
+	with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+		eventsCounts = segmentSum(events)
+		meanEventLog = segmentSum(events * logScaled) / eventsCounts
+		logRhos = np.zeros(groupsCount)
+		step = np.full(groupsCount, np.inf)
+		for i in range(maxIters):
+			rhos = np.exp(logRhos)
+			weights = np.exp(rhos[groupIds] * logScaled)
+			s0 = segmentSum(weights)
+			weights *= logScaled
+			m1 = segmentSum(weights) / s0
+			weights *= logScaled
+			m2 = segmentSum(weights) / s0
+			score = m1 - 1.0 / rhos - meanEventLog
+			scoreDerivative = (m2 - m1 * m1 + 1.0 / (rhos * rhos)) * rhos  # by log ρ
+			step = np.clip(score / scoreDerivative, -1.0, 1.0)  # the score is flat far from the root
+			logRhos -= step
+			if not (np.abs(step) > tolerance).any():  # nans are the groups without failures
+				break
+
+		rhos = np.exp(logRhos)
+		s0 = segmentSum(np.exp(rhos[groupIds] * logScaled))
+		lambdas = np.exp(logMaxDurations + np.log(s0 / eventsCounts) / rhos)
+	converged = (np.abs(step) <= tolerance) & np.isfinite(lambdas) & np.isfinite(rhos)
+	return lambdas, rhos, converged
+
+
 class WeibullFitterWithMean(WeibullFitter):
 	def predict_expectation(self):
 		return weibullExpectation(self._lambda, self._rho)
@@ -172,8 +214,7 @@ def getWeibulAggregator():
 			durationColName = cls.columnsToAggregate[0]
 			eventColName = cls.columnsToAggregate[1]
 
-			durations = pds.loc[:, durationColName].values
-			durations[durations == 0.0] = laplaceEstimatorZeroFix
+			durations = fixZeroDurations(pds.loc[:, durationColName].to_numpy(dtype=np.float64), laplaceEstimatorZeroFix)
 
 			if len(durations) > 2:
 				try:
@@ -187,6 +228,30 @@ def getWeibulAggregator():
 			else:
 				raise AggregationException("less than 2 drives histories are available, which is unsuitable for Weibull fitter")
 
+		@classmethod
+		def batchedAggregationFunc(cls, pds, groupIds, groupsCount, laplaceEstimatorZeroFix):
+			"""The same as `aggregationFunc`, but fits all the groups at once with `fitWeibullBatched`"""
+			durationColName = cls.columnsToAggregate[0]
+			eventColName = cls.columnsToAggregate[1]
+
+			durations = fixZeroDurations(pds.loc[:, durationColName].to_numpy(dtype=np.float64), laplaceEstimatorZeroFix)
+			events = pds.loc[:, eventColName].to_numpy(dtype=np.float64)
+			lambdas, rhos, converged = fitWeibullBatched(durations, events, groupIds, groupsCount)
+
+			sizes = np.bincount(groupIds, minlength=groupsCount)
+			eventsCounts = np.bincount(groupIds, weights=events, minlength=groupsCount)
+			failures = {}
+			for groupId in range(groupsCount):
+				if sizes[groupId] <= 2:
+					failures[groupId] = "less than 2 drives histories are available, which is unsuitable for Weibull fitter"
+				elif not eventsCounts[groupId]:
+					failures[groupId] = "no drives have failed, the likelihood has no maximum"
+				elif not converged[groupId]:
+					failures[groupId] = "the fitter has not converged"
+				elif rhos[groupId] < 1.0e-2:
+					failures[groupId] = "rho < than 1.e-2, expectation is infinite"
+			return {defaultRhoColName: rhos, defaultLambdaColName: lambdas}, failures
+
 	return WeibullAggregator
 
 
@@ -0,0 +1,209 @@
+"""Exports `drive_stats` into Parquet files partitioned by time or by ranges of drive ids, with packed rowids decoded into `drive_id` and `day` columns, for scanning with columnar engines with predicate pushdown instead of querying the SQLite DB row by row. Requires `pyarrow`."""
+
+__all__ = ("partitionSchemes", "exportParquet")
+
+import datetime
+import json
+import sqlite3
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from .database import getStatsColumns, packedRowidColumn, tablesNames
+from .rowidHacks import bitsPerDate, dayOffset, maxOrd
+
+manifestFileName = "_manifest.json"  # pyarrow datasets skip the files starting with `_`
+manifestVersion = 1
+
+
+def importPyArrow():
+	try:
+		import pyarrow
+		import pyarrow.parquet
+	except ImportError as ex:
+		raise ImportError("Parquet export requires `pyarrow`, install it with `pip install pyarrow`") from ex
+	return pyarrow
+
+
+def getArrowType(pa, name: str, declaredType: str):
+	"""`INTEGER (1)` columns are normalized S.M.A.R.T. values, they fit into a byte"""
+	if name == "failure":
+		return pa.bool_()
+	if declaredType.replace(" ", "").upper().startswith("INTEGER(1)"):
+		return pa.uint8()
+	return pa.int64()
+
+
+def createArrowSchema(pa, columns):
+	fields = [pa.field("drive_id", pa.uint32(), nullable=False), pa.field("day", pa.date32(), nullable=False)]
+	fields.extend(pa.field(name, getArrowType(pa, name, declaredType)) for name, declaredType in columns)
+	return pa.schema(fields)
+
+
+def decodePackedRowids(oids: np.ndarray):
+	"""Vectorized `rowidHacks.decode`, gives drive ids and days since UNIX epoch"""
+	return (oids >> bitsPerDate).astype(np.uint32), ((oids & maxOrd) + dayOffset).astype(np.int32)
+
+
+class PartitionScheme:
+	"""Maps the rows to partitions. `labels` gets the arrays of drive ids and days and returns the names of the dirs of the partitions and the array of indexes of the names for each row."""
+
+	__slots__ = ("name", "labels")
+
+	def __init__(self, name: str, labels):
+		self.name = name
+		self.labels = labels
+
+
+def timeLabels(unit: str, fmt):
+	def labels(driveIds: np.ndarray, days: np.ndarray):
+		periods = days.astype("datetime64[D]").astype("datetime64[" + unit + "]")
+		uniq, inverse = np.unique(periods, return_inverse=True)
+		return [fmt(p) for p in uniq.tolist()], inverse
+
+	return labels
+
+
+def quarterLabel(d: datetime.date):
+	return "quarter=" + str(d.year) + "Q" + str((d.month - 1) // 3 + 1)
+
+
+def drivesRangeLabels(drivesPerPartition: int):
+	"""The dirs are named `drives=...`, not `drive_id=...`, not to clash with the column on hive-style partitioning discovery"""
+
+	def labels(driveIds: np.ndarray, days: np.ndarray):
+		starts = driveIds // drivesPerPartition * drivesPerPartition
+		uniq, inverse = np.unique(starts, return_inverse=True)
+		return ["drives=" + str(s) + "-" + str(s + drivesPerPartition - 1) for s in uniq.tolist()], inverse
+
+	return labels
+
+
+def partitionSchemes(drivesPerPartition: int = 10000):
+	return {
+		"year": PartitionScheme("year", timeLabels("Y", lambda d: "year=" + str(d.year))),
+		"quarter": PartitionScheme("quarter", timeLabels("M", quarterLabel)),
+		"month": PartitionScheme("month", timeLabels("M", lambda d: "month=" + d.strftime("%Y-%m"))),
+		"drive": PartitionScheme("drive", drivesRangeLabels(drivesPerPartition)),
+	}
+
+
+class PartitionWriter:
+	"""Buffers the record batches of a partition and writes them into its file as row groups"""
+
+	__slots__ = ("path", "writer", "buffer", "buffered", "rows", "minDriveId", "maxDriveId", "minDay", "maxDay")
+
+	def __init__(self, path: Path):
+		self.path = path
+		self.writer = None
+		self.buffer = []
+		self.buffered = 0
+		self.rows = 0
+		self.minDriveId = self.maxDriveId = self.minDay = self.maxDay = None
+
+	def append(self, batch, driveIds: np.ndarray, days: np.ndarray):
+		self.buffer.append(batch)
+		self.buffered += len(batch)
+		self.rows += len(batch)
+		self.minDriveId = int(driveIds.min()) if self.minDriveId is None else min(self.minDriveId, int(driveIds.min()))
+		self.maxDriveId = int(driveIds.max()) if self.maxDriveId is None else max(self.maxDriveId, int(driveIds.max()))
+		self.minDay = int(days.min()) if self.minDay is None else min(self.minDay, int(days.min()))
+		self.maxDay = int(days.max()) if self.maxDay is None else max(self.maxDay, int(days.max()))
+
+	def flush(self, pa, schema, compression: str):
+		if not self.buffer:
+			return
+		if self.writer is None:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			self.writer = pa.parquet.ParquetWriter(str(self.path), schema, compression=compression)
+		self.writer.write_table(pa.Table.from_batches(self.buffer, schema))
+		self.buffer = []
+		self.buffered = 0
+
+	def close(self, pa, schema, compression: str):
+		self.flush(pa, schema, compression)
+		if self.writer is not None:
+			self.writer.close()
+
+	def toManifestRecord(self, destDir: Path):
+		return {
+			"path": self.path.relative_to(destDir).as_posix(),
+			"rows": self.rows,
+			"bytes": self.path.stat().st_size,
+			"drive_id": [self.minDriveId, self.maxDriveId],
+			"day": [(datetime.date(1970, 1, 1) + datetime.timedelta(days=d)).isoformat() for d in (self.minDay, self.maxDay)],
+		}
+
+
+def createRecordBatch(pa, schema, columns, rows):
+	"""Transposes the rows fetched from SQLite into a record batch, the first column of rows is the packed rowid"""
+	cols = list(zip(*rows))
+	oids = np.array(cols[0], dtype=np.int64)
+	driveIds, days = decodePackedRowids(oids)
+	arrays = [pa.array(driveIds, pa.uint32()), pa.array(days, pa.int32()).cast(pa.date32())]
+	for (name, declaredType), col in zip(columns, cols[1:]):
+		arrays.append(pa.array(col, pa.int64()).cast(schema.field(name).type))  # the cast checks the values fit
+	return pa.RecordBatch.from_arrays(arrays, schema=schema), driveIds, days
+
+
+def exportParquet(db: sqlite3.Connection, destDir: Path, partitionBy: str = "drive", drivesPerPartition: int = 10000, compression: str = "zstd", rowGroupSize: int = 1000000, batchSize: int = 100000, progress=None):
+	"""Streams `drive_stats` in rowid order into `<destDir>/<partition>/part-0.parquet` files and writes `_manifest.json`. Rows are in `(drive_id, day)` order within a file. Partitioning by drive gives one open file at a time and full row groups; partitioning by time keeps a file per period open, and the buffers are flushed when there are more than `4 * rowGroupSize` rows buffered in total, so row groups are smaller. Returns the manifest."""
+	pa = importPyArrow()
+	destDir = Path(destDir)
+	if (destDir / manifestFileName).exists():
+		raise FileExistsError(destDir / manifestFileName)
+
+	scheme = partitionSchemes(drivesPerPartition)[partitionBy]
+	columns = getStatsColumns(db)
+	schema = createArrowSchema(pa, columns)
+	maxBuffered = 4 * rowGroupSize
+
+	writers = OrderedDict()
+	buffered = 0
+	cur = db.execute("select `" + packedRowidColumn + "`, " + ", ".join("`" + name + "`" for name, declaredType in columns) + " from " + tablesNames["smart"] + " order by `" + packedRowidColumn + "`;")
+	try:
+		while True:
+			rows = cur.fetchmany(batchSize)
+			if not rows:
+				break
+			batch, driveIds, days = createRecordBatch(pa, schema, columns, rows)
+			labels, inverse = scheme.labels(driveIds, days)
+			if len(labels) > 1 and np.any(inverse[1:] < inverse[:-1]):
+				order = np.argsort(inverse, kind="stable")
+				batch, driveIds, days, inverse = batch.take(pa.array(order)), driveIds[order], days[order], inverse[order]
+			bounds = np.searchsorted(inverse, np.arange(len(labels) + 1))
+			for label, start, stop in zip(labels, bounds[:-1].tolist(), bounds[1:].tolist()):
+				w = writers.get(label)
+				if w is None:
+					w = writers[label] = PartitionWriter(destDir / label / "part-0.parquet")
+				w.append(batch.slice(start, stop - start), driveIds[start:stop], days[start:stop])
+				buffered += stop - start
+				if w.buffered >= rowGroupSize:
+					buffered -= w.buffered
+					w.flush(pa, schema, compression)
+			if buffered > maxBuffered:
+				for w in writers.values():
+					w.flush(pa, schema, compression)
+				buffered = 0
+			if progress is not None:
+				progress(len(rows))
+	finally:
+		cur.close()
+		for w in writers.values():
+			w.close(pa, schema, compression)
+
+	manifest = OrderedDict()
+	manifest["version"] = manifestVersion
+	manifest["sqlite"] = sqlite3.sqlite_version
+	manifest["pyarrow"] = pa.__version__
+	manifest["partitioning"] = {"by": partitionBy, **({"drivesPerPartition": drivesPerPartition} if partitionBy == "drive" else {})}
+	manifest["compression"] = compression
+	manifest["schema"] = OrderedDict((f.name, str(f.type)) for f in schema)
+	manifest["rows"] = sum(w.rows for w in writers.values())
+	manifest["files"] = sorted((w.toManifestRecord(destDir) for w in writers.values()), key=lambda r: r["path"])
+	destDir.mkdir(parents=True, exist_ok=True)
+	(destDir / manifestFileName).write_text(json.dumps(manifest, indent="\t"))
+	print("Exported", manifest["rows"], "records into", len(writers), "partitions", file=sys.stderr)
+	return manifest
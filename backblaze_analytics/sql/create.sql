@@ -48,8 +48,6 @@ CREATE TABLE "drives" (
 	FOREIGN KEY('model_id') REFERENCES models('id')
 );
 
-ATTACH database "./analytics.sqlite" as analytics;
-
 CREATE TABLE analytics."anomalies"(
 	id INTEGER,
 	info TEXT,
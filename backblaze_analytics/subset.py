@@ -0,0 +1,142 @@
+"""Extracts a subset of drives into a small consistent set of DBs (`db.sqlite`, `analytics.sqlite`, `drives.sqlite`), i.e. for tests and experiments. The records of `drive_stats` of a drive are contiguous in rowid space, so the sorted drive ids are merged into runs of consecutive ids and each run is copied with a single rowid range read and bulk inserts appending to the end of the destination b-tree."""
+
+__all__ = ("strataColumns", "getDrivesStrata", "sampleDrives", "genIdsRuns", "extractSubset")
+
+import random
+import sqlite3
+import sys
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+from more_itertools import consecutive_groups
+
+from .database import DBAnalyser, TableName, tablesNames
+from .rowidHacks import maxOrd, sqlToOidUnoffsetted
+
+strataColumns = {
+	"model": "d.`model_id`",
+	"vendor": "b.`vendor_id`",
+	"failed": "an.`failure_date` is not NULL",
+}
+
+drivesDBTables = ("vendors", "brands", "models", "drives")
+analyticsDBTables = ("drivesAnalytics", "anomalies", "censoredDrives")
+
+
+def hasTable(db: DBAnalyser, tableId: str):
+	tn = TableName.fromStr(tablesNames[tableId])
+	return tn in set(db.getTables(tn.dbID))
+
+
+def getDrivesStrata(db: DBAnalyser, strata=("model",)):
+	"""Returns a dict `{stratumKey: [driveId, ...]}`, where `stratumKey` is a tuple of values of the `strata` attrs (see `strataColumns`)"""
+	columns = [strataColumns[s] for s in strata]
+	q = "select d.`id`" + "".join(", " + c for c in columns) + " from " + tablesNames["drives"] + " d join " + tablesNames["models"] + " m on d.`model_id` = m.`id` join " + tablesNames["brands"] + " b on m.`brand_id` = b.`id`"
+	if "failed" in strata:
+		if not hasTable(db, "drivesAnalytics"):
+			raise ValueError("Stratification by `failed` requires the DB with analytics, preprocess the DB first")
+		q += " left join " + tablesNames["drivesAnalytics"] + " an on an.`id` = d.`id`"
+	res = defaultdict(list)
+	for r in db.readDB.execute(q + ";"):
+		res[tuple(r[1:])].append(r[0])
+	return res
+
+
+def sampleDrives(db: DBAnalyser, fraction: float, strata=("model",), seed: int = 0, minPerStratum: int = 1):
+	"""Samples `fraction` of drives from each stratum, but not less than `minPerStratum`, so rare models and failed drives are not lost. Returns sorted ids."""
+	rng = random.Random(seed)
+	res = []
+	groups = getDrivesStrata(db, strata)
+	for key in sorted(groups, key=repr):
+		ids = groups[key]
+		count = min(len(ids), max(minPerStratum, round(len(ids) * fraction)))
+		res.extend(rng.sample(ids, count))
+	return sorted(res)
+
+
+def genIdsRuns(driveIds):
+	"""Merges sorted ids into `(first, last)` runs of consecutive ids"""
+	for g in consecutive_groups(driveIds):
+		g = list(g)
+		yield g[0], g[-1]
+
+
+def genRangeCondition(column: str, oidRange: bool):
+	if oidRange:
+		return column + " >= (" + sqlToOidUnoffsetted(":first", 0) + ") and " + column + " <= (" + sqlToOidUnoffsetted(":last", maxOrd) + ")"
+	return column + " between :first and :last"
+
+
+def copyRuns(src: sqlite3.Connection, dst: sqlite3.Connection, srcTable: str, dstTable: str, idColumn: str, runs, oidRange: bool = False, batchSize: int = 10000):
+	"""Copies the rows with ids within the runs, returns the count of rows"""
+	q = "select * from " + srcTable + " where " + genRangeCondition(idColumn, oidRange) + " order by " + idColumn + ";"
+	count = 0
+	for first, last in runs:
+		cur = src.execute(q, {"first": first, "last": last})
+		ins = "insert into " + dstTable + " values (" + ", ".join("?" * len(cur.description)) + ");"
+		while True:
+			batch = cur.fetchmany(batchSize)
+			if not batch:
+				break
+			dst.executemany(ins, batch)
+			count += len(batch)
+	return count
+
+
+def copyAll(src: sqlite3.Connection, dst: sqlite3.Connection, srcTable: str, dstTable: str):
+	cur = src.execute("select * from " + srcTable + ";")
+	rows = cur.fetchall()
+	dst.executemany("insert into " + dstTable + " values (" + ", ".join("?" * len(cur.description)) + ");", rows)
+	return len(rows)
+
+
+def createDestDB(fileName: Path):
+	"""The destination DBs are new files, so if something fails they are just recreated. No need in journal and fsyncs."""
+	dst = sqlite3.connect(str(fileName), 0, True)
+	dst.execute("PRAGMA journal_mode=OFF;")
+	dst.execute("PRAGMA synchronous=OFF;")
+	return dst
+
+
+def fillDestDB(db: DBAnalyser, fileName: Path, tablesIds, runs, batchSize: int):
+	"""Creates the tables in a new DB and copies the rows of the drives within the runs into them. Returns a dict with counts of copied rows."""
+	src = db.readDB
+	res = OrderedDict()
+	with createDestDB(fileName) as dst:
+		for tableId in tablesIds:
+			srcTable = tablesNames[tableId]
+			dstTable = "`" + TableName.fromStr(srcTable).name + "`"
+			dst.execute(db.getTableCreationQuery(srcTable))
+			if tableId in ("vendors", "brands", "models"):
+				res[tableId] = copyAll(src, dst, srcTable, dstTable)
+			elif tableId == "smart":
+				res[tableId] = copyRuns(src, dst, srcTable, dstTable, "`oid`", runs, oidRange=True, batchSize=batchSize)
+			else:
+				res[tableId] = copyRuns(src, dst, srcTable, dstTable, "`id`", runs, batchSize=batchSize)
+		dst.commit()
+	dst.close()
+	return res
+
+
+def extractSubset(db: DBAnalyser, driveIds, destDir: Path, batchSize: int = 10000):
+	"""Writes `db.sqlite` with the records of the drives, `analytics.sqlite` with their analytics (if the source has it) and `drives.sqlite` with the info on them, like `export drives` does. Returns a dict `{fileName: {table: count}}`."""
+	driveIds = sorted(set(driveIds))
+	runs = list(genIdsRuns(driveIds))
+	destDir = Path(destDir)
+	destDir.mkdir(parents=True, exist_ok=True)
+
+	plan = OrderedDict()
+	plan["db.sqlite"] = [*drivesDBTables, *(("smart",) if hasTable(db, "smart") else ())]
+	plan["analytics.sqlite"] = [t for t in analyticsDBTables if hasTable(db, t)]
+	plan["drives.sqlite"] = list(drivesDBTables)
+
+	for fn in plan:
+		if (destDir / fn).exists():
+			raise FileExistsError(destDir / fn)
+
+	print("Extracting", len(driveIds), "drives in", len(runs), "runs of consecutive ids", file=sys.stderr)
+	res = OrderedDict()
+	for fn, tablesIds in plan.items():
+		if tablesIds:
+			res[fn] = fillDestDB(db, destDir / fn, tablesIds, runs, batchSize)
+	return res
@@ -0,0 +1,257 @@
+"""Generates a synthetic dataset resembling the Backblaze one: daily CSV files with the same columns layout, zip archives of them grouped by quarters, and ready-made normalized DBs. Useful for benchmarking and CI on machines having neither the dataset nor network access."""
+
+__all__ = ("SyntheticModel", "SyntheticDatasetConfig", "SyntheticDataset", "defaultModels")
+
+import csv
+import datetime
+import io
+import random
+import zipfile
+import zlib
+from pathlib import Path
+
+from . import database
+from .database import DrivesParamsTableSpec
+from .datasetDescription import smartAttrIDs, smartAttrsResolvers
+
+csvFixedColumns = ("date", "serial_number", "model", "capacity_bytes", "failure")
+
+
+class SyntheticModel:
+	"""A drive model present in the synthetic dataset. `afr` is the annualized failure rate, `share` is the relative count of drives of this model in the fleet"""
+
+	__slots__ = ("name", "capacity", "afr", "share")
+
+	def __init__(self, name: str, capacity: int, afr: float, share: float = 1.0):
+		self.name = name
+		self.capacity = capacity
+		self.afr = afr
+		self.share = share
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + ", ".join(repr(getattr(self, k)) for k in self.__class__.__slots__) + ")"
+
+
+# the names must be matched by `model_name_regex` of the brands in create.sql
+defaultModels = (
+	SyntheticModel("ST4000DM000", 4000787030016, 0.03, 4.0),
+	SyntheticModel("ST8000NM0055", 8001563222016, 0.01, 2.0),
+	SyntheticModel("HGST HMS5C4040ALE640", 4000787030016, 0.005, 2.0),
+	SyntheticModel("WDC WD30EFRX", 3000592982016, 0.02, 1.0),
+	SyntheticModel("TOSHIBA MD04ABA400V", 4000787030016, 0.015, 1.0),
+)
+
+
+class SyntheticDatasetConfig:
+	"""Parameters of a synthetic dataset.
+
+	`schemaChanges` is a sequence of `(dayIndex, smartAttrIDs)` pairs: starting from the `dayIndex`-th day the CSV files contain the columns for the attrs with these IDs only, like Backblaze adding columns in newer files.
+	Anomalies fractions:
+		* `postFailureUse` - of the failed drives keep being reported after the failure
+		* `multipleFailures` - of the drives used after a failure fail once more
+		* `missingSerials` - of the drives of the first model have no serial number in some records. Only one model is affected, otherwise the records with the empty serial would belong to different models, which `normalizeModels` cannot handle.
+	"""
+
+	__slots__ = ("drivesCount", "daysCount", "startDate", "models", "failureRateMultiplier", "installedFraction", "retireRate", "schemaChanges", "postFailureUse", "multipleFailures", "missingSerials", "seed")
+
+	def __init__(self, drivesCount: int = 1000, daysCount: int = 90, startDate: datetime.date = datetime.date(2016, 1, 1), models=defaultModels, failureRateMultiplier: float = 1.0, installedFraction: float = 0.8, retireRate: float = 0.05, schemaChanges=None, postFailureUse: float = 0.1, multipleFailures: float = 0.3, missingSerials: float = 0.002, seed: int = 0):
+		self.drivesCount = drivesCount
+		self.daysCount = daysCount
+		self.startDate = startDate
+		self.models = tuple(models)
+		self.failureRateMultiplier = failureRateMultiplier
+		self.installedFraction = installedFraction
+		self.retireRate = retireRate
+		if schemaChanges is None:
+			schemaChanges = ((0, smartAttrIDs[:-8]), (daysCount // 2, smartAttrIDs))
+		self.schemaChanges = tuple(sorted(schemaChanges, key=lambda c: c[0]))
+		self.postFailureUse = postFailureUse
+		self.multipleFailures = multipleFailures
+		self.missingSerials = missingSerials
+		self.seed = seed
+
+	@property
+	def startOrdinal(self):
+		"""Count of days since UNIX epoch of the first day"""
+		return (self.startDate - datetime.date(1970, 1, 1)).days
+
+
+def genCSVHeader(attrIDs):
+	header = list(csvFixedColumns)
+	for pair in DrivesParamsTableSpec.genTableColumnNamePairForASMARTParam(smartAttrsResolvers.basic(attrIDs)):
+		header.extend(name for name, colType in pair)
+	return header
+
+
+class SyntheticDrive:
+	__slots__ = ("serial", "model", "firstDay", "lastDay", "failureDays", "initialHours", "missingSerial")
+
+	def __init__(self, serial: str, model: SyntheticModel, firstDay: int, lastDay: int, failureDays, initialHours: int, missingSerial: bool):
+		self.serial = serial
+		self.model = model
+		self.firstDay = firstDay
+		self.lastDay = lastDay
+		self.failureDays = failureDays
+		self.initialHours = initialHours
+		self.missingSerial = missingSerial
+
+
+class SyntheticDataset:
+	"""Generates records of a synthetic dataset. Everything is determined by the config, including the seed, so the same config always gives the same dataset."""
+
+	def __init__(self, config: SyntheticDatasetConfig = None):
+		if config is None:
+			config = SyntheticDatasetConfig()
+		self.config = config
+		self.drives = list(self.genDrives())
+
+	def genDrives(self):
+		c = self.config
+		rng = random.Random(c.seed)
+		weights = [m.share for m in c.models]
+		for i in range(c.drivesCount):
+			model = rng.choices(c.models, weights)[0]
+			if rng.random() < c.installedFraction:
+				firstDay = 0
+				initialHours = rng.randrange(0, 5 * 365 * 24)
+			else:
+				firstDay = rng.randrange(0, c.daysCount)
+				initialHours = rng.randrange(0, 48)
+
+			dailyHazard = model.afr * c.failureRateMultiplier / 365
+			failureDays = []
+			lastDay = c.daysCount - 1
+			if dailyHazard > 0:
+				failureDay = firstDay + int(rng.expovariate(dailyHazard))
+				if failureDay <= lastDay:
+					failureDays.append(failureDay)
+					lastDay = failureDay
+					if rng.random() < c.postFailureUse:
+						lastDay = min(c.daysCount - 1, failureDay + rng.randrange(1, 30))
+						if rng.random() < c.multipleFailures and lastDay > failureDay + 1:
+							lastDay = rng.randrange(failureDay + 1, lastDay + 1)
+							failureDays.append(lastDay)
+			if not failureDays and c.retireRate > 0:
+				retireDay = firstDay + int(rng.expovariate(c.retireRate / 365))
+				lastDay = min(lastDay, retireDay)
+
+			missingSerial = rng.random() < c.missingSerials and model is c.models[0]
+			yield SyntheticDrive("SYN" + format(i, "08X"), model, firstDay, lastDay, tuple(failureDays), initialHours, missingSerial)
+
+	def attrIDsForDay(self, dayIndex: int):
+		res = self.config.schemaChanges[0][1]
+		for changeDay, attrIDs in self.config.schemaChanges:
+			if changeDay > dayIndex:
+				break
+			res = attrIDs
+		return res
+
+	def genSMART(self, drive: SyntheticDrive, dayIndex: int, attrIDs):
+		"""Generates S.M.A.R.T. values as a dict `{attrID: (normalized, raw)}`. Only a few attrs are meaningful, the rest are constant."""
+		hours = drive.initialHours + 24 * (dayIndex - drive.firstDay)
+		dying = any(0 <= f - dayIndex < 14 for f in drive.failureDays)
+		res = {}
+		for a in attrIDs:
+			if a == 9:
+				res[a] = (max(1, 100 - hours // 1000), hours)
+			elif a == 12:
+				res[a] = (100, 1 + hours // 2000)
+			elif a == 194:
+				t = 25 + (zlib.crc32(drive.serial.encode("ascii")) + dayIndex) % 15
+				res[a] = (t * 2, t)
+			elif a in (5, 187, 197, 198):
+				r = (len(drive.serial) * (dayIndex - drive.firstDay)) % 97 if dying else 0
+				res[a] = (100 - min(r, 99), r)
+			elif a in (241, 242):
+				res[a] = (100, hours * 3600 * 100)
+			else:
+				res[a] = (100, 0)
+		return res
+
+	def genDayRecords(self, dayIndex: int):
+		"""Yields the records of a day as lists in the order of `genCSVHeader(self.attrIDsForDay(dayIndex))`"""
+		attrIDs = self.attrIDsForDay(dayIndex)
+		date = (self.config.startDate + datetime.timedelta(days=dayIndex)).isoformat()
+		for d in self.drives:
+			if not (d.firstDay <= dayIndex <= d.lastDay):
+				continue
+			serial = "" if d.missingSerial and dayIndex % 7 == 0 else d.serial
+			rec = [date, serial, d.model.name, d.model.capacity, int(dayIndex in d.failureDays)]
+			smart = self.genSMART(d, dayIndex, attrIDs)
+			for a in attrIDs:
+				rec.extend(smart[a])
+			yield rec
+
+	def writeCSV(self, dayIndex: int, file):
+		w = csv.writer(file, lineterminator="\n")
+		w.writerow(genCSVHeader(self.attrIDsForDay(dayIndex)))
+		w.writerows(self.genDayRecords(dayIndex))
+
+	def dayFileName(self, dayIndex: int):
+		return (self.config.startDate + datetime.timedelta(days=dayIndex)).isoformat() + ".csv"
+
+	def writeCSVs(self, destDir: Path):
+		"""Writes a CSV file per day, returns the paths of the files"""
+		destDir = Path(destDir)
+		destDir.mkdir(parents=True, exist_ok=True)
+		res = []
+		for i in range(self.config.daysCount):
+			fn = destDir / self.dayFileName(i)
+			with fn.open("wt", encoding="utf-8", newline="") as f:
+				self.writeCSV(i, f)
+			res.append(fn)
+		return res
+
+	def quarterName(self, dayIndex: int):
+		d = self.config.startDate + datetime.timedelta(days=dayIndex)
+		return "data_Q" + str((d.month - 1) // 3 + 1) + "_" + str(d.year)
+
+	def writeZips(self, destDir: Path):
+		"""Writes the CSV files into zip archives named and structured like the ones from Backblaze website (`data_Q1_2016.zip/data_Q1_2016/2016-01-01.csv`), returns the paths of the archives"""
+		destDir = Path(destDir)
+		destDir.mkdir(parents=True, exist_ok=True)
+		archives = {}
+		try:
+			for i in range(self.config.daysCount):
+				qn = self.quarterName(i)
+				if qn not in archives:
+					archives[qn] = zipfile.ZipFile(destDir / (qn + ".zip"), "w", compression=zipfile.ZIP_DEFLATED)
+				buf = io.StringIO()
+				self.writeCSV(i, buf)
+				archives[qn].writestr(qn + "/" + self.dayFileName(i), buf.getvalue())
+		finally:
+			for z in archives.values():
+				z.close()
+		return [destDir / (qn + ".zip") for qn in archives]
+
+	def importIntoDB(self, db: database.DBNormalizer):
+		"""Inserts the records into the table for CSV import, like `.import` done by the import script does"""
+		cur = db.db.cursor()
+		for i in range(self.config.daysCount):
+			header = genCSVHeader(self.attrIDsForDay(i))
+			q = "insert into " + database.tablesNames["csvImportTemp"] + " (" + ", ".join("`" + c + "`" for c in header) + ") values (" + ", ".join("?" * len(header)) + ");"
+			cur.executemany(q, self.genDayRecords(i))
+		cur.close()
+		db.db.commit()
+
+	def createDBs(self, dbFileName: Path, analyticsDBFileName: Path = None, batchSize: int = 10000, preprocess: bool = True):
+		"""Creates a normalized DB and a DB with analytics, doing the same steps as the import pipeline does"""
+		from .tools.preprocess import preprocess as preprocessDB
+
+		dbFileName = Path(dbFileName)
+		if analyticsDBFileName is None:
+			analyticsDBFileName = dbFileName.parent / "analytics.sqlite"
+		analyticsDBFileName = Path(analyticsDBFileName)
+
+		with database.DBNormalizer(dbFileName) as db:
+			db.createTables(analyticsDBFileName)
+			self.importIntoDB(db)
+			db.normalizeModels()
+			size, progress = db.normalizeRecords(batchSize=batchSize)
+			for p in progress:
+				pass
+
+		if preprocess:
+			with database.DBAnalyser(dbFileName, analyticsDBFileName) as db:
+				preprocessDB(db)
+		return dbFileName, analyticsDBFileName
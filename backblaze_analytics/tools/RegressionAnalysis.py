@@ -2,7 +2,6 @@ import math
 import typing
 import warnings
 from collections import OrderedDict
-from gc import collect
 from pathlib import Path
 
 import lazily.lifelines.utils
@@ -13,6 +12,7 @@ from NoSuspend import NoSuspend
 
 from .. import augment, database
 from ..analysis import Analysis, LearningTask
+from ..dataset import Dataset
 from ..datasetDescription import spec
 from ..fitters.XGBoostCoxPHFitter import XGBoostCoxPHFitter
 from ..fitters.XGBoostWeibullFitter import XGBoostWeibullFitter
@@ -45,10 +45,11 @@ class RegressionAnalysis(Analysis):
 
 	fitterClass = XGBoostCoxPHFitter
 
-	def smartSample(self, frac: float) -> LearningTask:
+	def smartSample(self, frac: float, seed: int = 0) -> LearningTask:
 		"""XGBoost may fail if all the records are used, presumably because of memory or overflow. Here we try to sample the rows in the way keep the most informative samples:
 			* the one that have failed.
-			* ~~the one having the longest life~~ (No, this way we can miss the info about medium-lived drives)"""
+			* ~~the one having the longest life~~ (No, this way we can miss the info about medium-lived drives)
+		The sample is drawn by the DB and stratified by model (see `database.genDriveStatsDenormSampledQuery`), so the stats of the unsampled drives are never loaded. It is deterministic for the same `seed`."""
 		assert frac <= 1.0 and frac > 0.0
 
 		if frac == 1.0:
@@ -56,43 +57,43 @@ class RegressionAnalysis(Analysis):
 			len(self.task.pds)  # to trigger unlazing and unwrapping. TODO: Should we use __wrapped__ here?
 			return self.task
 
-		failedSelector = self.task.pds.loc[:, "failed"]
-		pdsFailed = self.task.pds.loc[failedSelector]
-		pdsAlive = self.task.pds.loc[~failedSelector]
-
-		totalCount = len(self.task.pds)
+		counts = Dataset.countFailedAndCensored(self.dbPath, self.analyticsDBPath)
+		failedCount, aliveCount = counts["failed"], counts["censored"]
+		totalCount = failedCount + aliveCount
 		drivesToKeep = int(np.floor(totalCount * frac))
-		failedCount = len(pdsFailed)
+		if drivesToKeep < 1:  # it also guarantees `failedCount > 0` when not all the failed drives fit
+			raise ValueError("frac=" + str(frac) + " of " + str(totalCount) + " drives having stats keeps no drives, increase it")
 		aliveDrivesToKeep = drivesToKeep - failedCount
 
 		if aliveDrivesToKeep > 0:
-			print("All the failed drives (", failedCount / totalCount, " of the dataset) fit into the frac, using", aliveDrivesToKeep / len(pdsAlive), "of censored drives")
-			keptAliveDrives = pdsAlive.sample(n=aliveDrivesToKeep)
-			pds = pandas.concat([pdsFailed, keptAliveDrives], axis=0)
+			print("All the failed drives (", failedCount / totalCount, " of the dataset) fit into the frac, using", aliveDrivesToKeep / aliveCount, "of censored drives")
+			sampling = {"failedFraction": 1.0, "censoredFraction": aliveDrivesToKeep / aliveCount}
 		else:
-			print("Not all the failed drives (", failedCount / totalCount, " of the dataset) fit into the frac, using", (aliveDrivesToKeep - failedCount) / failedCount, " of failed drives")
-			pds = pdsFailed.sample(n=failedCount + aliveDrivesToKeep, axis=0)
-		return LearningTask(pds, self.task.learnedVars)
+			print("Not all the failed drives (", failedCount / totalCount, " of the dataset) fit into the frac, using", drivesToKeep / failedCount, " of failed drives")
+			sampling = {"failedFraction": drivesToKeep / failedCount, "censoredFraction": 0.0}
+		sampling.update(seed=seed, minPerStratum=1)
+		return self.createSampledTask(sampling, self.__class__.taskName[: -len("Task")])
 
 	taskName = "unaggregatedTask"
 
 	@property
 	def task(self):
-		"""To save memory we remove the non-preprocessed data and replace them with the preprocessed ones. Raw data we evict from memory."""
-		if self.pch is not None:  # if not evicted
-			return getattr(self.pch, self.__class__.taskName)
-		else:
-			return self._task  # if evicted
+		"""To save memory we remove the non-preprocessed data and replace them with the preprocessed ones. Raw data we evict from memory, it is reloaded from the cache on access to `pch`."""
+		if self._task is not None:
+			return self._task
+		return getattr(self.pch, self.__class__.taskName)
 
-	def __init__(self, dbFilePath: Path, frac: float = 1.0, prefix="./Survival_XGBoost_Models"):
+	def __init__(self, dbFilePath: Path, frac: float = 1.0, prefix="./Survival_XGBoost_Models", analyticsDBFilePath: Path = None):
 		self.spec = None
-		super().__init__(dbFilePath)
-		self._task = self.smartSample(frac)
-		#self.pch = None  # to conserve memory
+		self._task = None
+		super().__init__(dbFilePath, analyticsDBFilePath)
+		sample = self.smartSample(frac)
+		if sample is not getattr(self.pch, self.__class__.taskName):
+			self._task = sample
+			self.pch.memoryManager.evict(self.pch, self.__class__.taskName)
 
 		self.engineerFeatures(self.task)
 
-		collect()
 		self.f = self.__class__.fitterClass(self.spec, prefix=prefix)
 
 	def engineerFeatures(self, task):
@@ -111,7 +112,6 @@ class RegressionAnalysis(Analysis):
 
 		#task.pds.loc[:, "platter_linear_speed"] = task.pds.loc[:, ["form_factor_width", "form_factor_depth"]].min(axis=1) / 2 * task.pds.loc[:, "rpm"] ** 2
 		#task.pds.loc[:, "platter_separation"] = task.pds.loc[:, "form_factor_height"] / task.pds.loc[:, "platters"] ** 2
-		collect()
 		#task.pds.loc[:, "form_factor_volume"] = task.pds.loc[:, ["form_factor_width", "form_factor_height", "form_factor_depth"]].product(1)
 		#task.pds.loc[:, "form_factor_crossection_front"] = task.pds.loc[:, ["form_factor_width", "form_factor_height"]].product(1)
 		#task.pds.loc[:, "form_factor_crossection_side"] = task.pds.loc[:, ["form_factor_height", "form_factor_depth"]].product(1)
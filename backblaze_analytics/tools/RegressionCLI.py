@@ -45,10 +45,15 @@ class AnalysisCLI(cli.Application):
 class FittingCLI(AnalysisCLI):
 	reduced = cli.Flag(("r", "reduced"), help="do not use the info from S.M.A.R.T.. The numbers of days may be LESS ACCURATE since the time before appearing in the dataset is not counted (but it's available in S.M.A.R.T.).", default=True)
 	dbPath = cli.SwitchAttr("--db-path", cli.ExistingFile, default=None, help="Path to the SQLite database")
-	#dsFrac = cli.SwitchAttr("--ds-frac", float, default=1.0, help="Fraction of the dataset used to train the XGBoost model. XGBoost may eat all the memory in the system and crash, if all the dataset is used, if this happens, reduce the fraction.")
-	dsFrac = cli.SwitchAttr("--ds-frac", float, default=0.2, help="Fraction of the dataset used to train the XGBoost model. XGBoost may eat all the memory in the system and crash, if all the dataset is used, if this happens, reduce the fraction.")
+	dsFrac = cli.SwitchAttr("--ds-frac", float, default=1.0, help="Fraction of the dataset used to train the XGBoost model. The failed drives are kept and the censored ones are sampled per model by the DB, so the stats of the rest are never loaded. The frames use compact dtypes (see `compactDTypes`), but XGBoost may still eat all the memory in the system and crash on a huge dataset, if this happens, reduce the fraction.")
 	modelFormat = cli.SwitchAttr("--modelFormat", str, default="binary", help="which format of XGBoost models to use")  # currently pyxgboost doesn't support survival:cox
 
+	@cli.switch("--memory-budget", float, help="Max RSS of the process in GiB, the least recently loaded cached frames are evicted from memory above it and reloaded from the on-disk cache on access. By default 3/4 of the physical memory.")
+	def memoryBudget(self, gib):
+		from ..utils.memoryManager import memoryManager
+
+		memoryManager.budget = int(gib * (1 << 30))
+
 
 optimizeHyperparamsCommandName = "optimize-hyperparams"
 
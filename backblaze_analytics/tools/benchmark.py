@@ -0,0 +1,22 @@
+from plumbum import cli
+
+
+class Benchmark(cli.Application):
+	"""Tools to check and measure the performance"""
+
+	pass
+
+
+subcommands = {
+	"queryPlans": "queryPlans.QueryPlansChecker",
+	"synthesize": "synthesize.SyntheticDatasetGenerator",
+	"pipeline": "pipelineBenchmark.PipelineBenchmark",
+	"layouts": "layoutsBenchmark.LayoutsBenchmark",
+	"importTime": "importTime.ImportTimeChecker",
+}
+
+for name, path in subcommands.items():
+	Benchmark.subcommand(name, __package__ + "." + path)
+
+if __name__ == "__main__":
+	Benchmark.run()
@@ -1,10 +1,13 @@
+import datetime
+from contextlib import contextmanager
 from pathlib import Path
 
 from plumbum import cli
 
-from ..database import DB
+from .. import database
+from ..database import DB, DBAnalyser, ReadOnlyConnectionPool
 from ..dataset import Dataset
-from ..utils import getExt
+from ..utils import compressors, detectFormat, streamingFormats
 from .CommandsGenerator import *
 from .DatabaseCommand import DatabaseCommand
 from .NeedingOutputDirCommand import NeedingOutputDirCommand
@@ -17,6 +20,28 @@ class DatasetExporter(cli.Application):
 	pass
 
 
+@contextmanager
+def backupProgress(desc: str = "Copying pages"):
+	"""Yields a callback for the SQLite backup API updating a progress bar. The bar is created on the first call, so it is not shown when the pages are not copied with the backup API, i.e. the rows are inserted or the DB is vacuumed into the file."""
+	from ..utils.mtqdm import mtqdm
+
+	pb = None
+
+	def progress(status, remaining, total):
+		nonlocal pb
+		if pb is None:
+			pb = mtqdm(desc=desc, unit="pages", total=total)
+		pb.total = total
+		pb.n = total - remaining
+		pb.refresh()
+
+	try:
+		yield progress
+	finally:
+		if pb is not None:
+			pb.close()
+
+
 @DatasetExporter.subcommand("dataset")
 class DatasetArchiver(DatabaseCommand, SevenZipCommand, NeedingOutputDirCommand):
 	"""Creates a script to archive the processed dataset"""
@@ -27,6 +52,24 @@ class DatasetArchiver(DatabaseCommand, SevenZipCommand, NeedingOutputDirCommand)
 		print(commandGen.wrapNoSuspend(commandGen.pack7z(self.sevenZipPath, dbfn, str(dbfn) + ".xz")))
 
 
+@DatasetExporter.subcommand("archive")
+class ChunkedArchiver(DatabaseCommand):
+	"""Archives the main DB into a seekable file: the records are compressed in parallel in independent chunks of whole drives with an index, so the records of some drives can be extracted without decompressing the rest. Restore with `import archive`."""
+
+	chunkRows = cli.SwitchAttr("--chunk-rows", int, default=1 << 20, help="Approximate count of records in a chunk")
+	preset = cli.SwitchAttr("--preset", cli.Range(0, 9), default=6, help="xz compression preset")
+	workers = cli.SwitchAttr("--workers", int, default=None, help="Count of compressing threads, the count of CPUs by default")
+	batchSize = cli.SwitchAttr("--batch-size", int, default=100000, help="Count of records fetched from the DB at once")
+
+	def main(self, outputFilePath: Path = "./db.bbarc"):
+		from ..chunkedArchive import writeArchive
+		from ..utils.mtqdm import mtqdm
+
+		with ReadOnlyConnectionPool(self.dbPath) as pool:
+			with mtqdm(desc="Archiving records", unit="records") as pb:
+				writeArchive(pool.connection, Path(outputFilePath), self.chunkRows, self.preset, self.workers, self.batchSize, progress=pb.update)
+
+
 @DatasetExporter.subcommand("toy")
 class ToyExporter(DatabaseCommand):
 	"""Exports subset of dataset to test this scripts on fast"""
@@ -38,32 +81,143 @@ class ToyExporter(DatabaseCommand):
 			db.exportToyDB(outputFilePath)
 
 
+@DatasetExporter.subcommand("subset")
+class SubsetExporter(DatabaseCommand, NeedingOutputDirCommand):
+	"""Extracts a subset of drives into `db.sqlite`, `analytics.sqlite` and `drives.sqlite` in the output dir. Drives are either listed explicitly or sampled from each stratum."""
+
+	analyticsDBPath = cli.SwitchAttr("--analytics-db-path", cli.ExistingFile, default=database.analysisDatabaseDefaultFileName, help="Path to the SQLite database with analytics")
+	fraction = cli.SwitchAttr("--fraction", float, default=0.01, help="Fraction of drives to sample from each stratum")
+	strata = cli.SwitchAttr("--strata", str, default="model,failed", help="Comma-separated attrs to stratify by: " + ", ".join(("model", "vendor", "failed")))
+	seed = cli.SwitchAttr("--seed", int, default=0, help="Seed of the sampling")
+	ids = cli.SwitchAttr("--ids", str, default=None, help="Comma-separated ids of drives to extract instead of sampling")
+	idsFile = cli.SwitchAttr("--ids-file", cli.ExistingFile, default=None, help="A file with whitespace-separated ids of drives to extract instead of sampling")
+	batchSize = cli.SwitchAttr("--batch-size", int, default=10000, help="Count of records in a bulk insert")
+
+	def main(self):
+		from ..subset import extractSubset, sampleDrives
+
+		with DBAnalyser(self.dbPath, self.analyticsDBPath) as db:
+			if self.ids is not None:
+				driveIds = [int(i) for i in self.ids.split(",")]
+			elif self.idsFile is not None:
+				driveIds = [int(i) for i in Path(self.idsFile).read_text().split()]
+			else:
+				driveIds = sampleDrives(db, self.fraction, [s.strip() for s in self.strata.split(",")], self.seed)
+			res = extractSubset(db, driveIds, self.destFolder, self.batchSize)
+		for fn, counts in res.items():
+			print(fn, *(k + ": " + str(v) for k, v in counts.items()), sep="\t")
+
+
+@DatasetExporter.subcommand("parquet")
+class ParquetExporter(DatabaseCommand, NeedingOutputDirCommand):
+	"""Exports `drive_stats` into Parquet files partitioned by time or by drive id ranges, with `drive_id` and `day` columns decoded from the packed rowids, and a `_manifest.json` describing them. Requires `pyarrow`."""
+
+	partitionBy = cli.SwitchAttr("--partition-by", cli.Set("year", "quarter", "month", "drive"), default="drive", help="Partition the records by periods of time or by drive id ranges")
+	drivesPerPartition = cli.SwitchAttr("--drives-per-partition", int, default=10000, help="Size of a drive id range for `--partition-by drive`")
+	compression = cli.SwitchAttr("--compression", str, default="zstd", help="Parquet compression codec")
+	rowGroupSize = cli.SwitchAttr("--row-group-size", int, default=1000000, help="Count of records in a Parquet row group")
+	batchSize = cli.SwitchAttr("--batch-size", int, default=100000, help="Count of records fetched from the DB at once")
+	immutable = cli.Flag("--immutable", help="Open the DB with `immutable=1`. Only for the DBs nobody modifies during the export.")
+
+	def main(self):
+		from ..parquetExport import exportParquet
+		from ..utils.mtqdm import mtqdm
+
+		with ReadOnlyConnectionPool(self.dbPath, immutable=self.immutable) as pool:
+			with mtqdm(desc="Exporting records", unit="records") as pb:
+				exportParquet(pool.connection, self.destFolder, self.partitionBy, self.drivesPerPartition, self.compression, self.rowGroupSize, self.batchSize, progress=pb.update)
+
+
+@DatasetExporter.subcommand("columnStore")
+class ColumnStoreExporter(DatabaseCommand):
+	"""Builds a memory-mapped column store mirroring `drive_stats`, a `.npy` file per column, or adds the new records into an existing one"""
+
+	batchSize = cli.SwitchAttr("--batch-size", int, default=100000, help="Count of records fetched from the DB at once")
+
+	def main(self, storePath: Path = "./columnStore"):
+		from ..columnStore import buildColumnStore, metaFileName, updateColumnStore
+		from ..utils.mtqdm import mtqdm
+
+		storePath = Path(storePath)
+		with ReadOnlyConnectionPool(self.dbPath) as pool:
+			if (storePath / metaFileName).exists():
+				updateColumnStore(pool.connection, storePath)
+			else:
+				with mtqdm(desc="Building the column store", unit="records") as pb:
+					buildColumnStore(pool.connection, storePath, self.batchSize, progress=pb.update)
+
+
+@DatasetExporter.subcommand("delta")
+class DeltaExporter(DatabaseCommand):
+	"""Packs the records after a date, the drives having them, models and the changed analytics into an xz-compressed file to be applied with `import delta`"""
+
+	analyticsDBPath = cli.SwitchAttr("--analytics-db-path", cli.ExistingFile, default=database.analysisDatabaseDefaultFileName, help="Path to the SQLite database with analytics")
+	since = cli.SwitchAttr("--since", datetime.date.fromisoformat, mandatory=True, help="The last date of records the consumers already have, YYYY-MM-DD")
+	preset = cli.SwitchAttr("--preset", cli.Range(0, 9), default=6, help="xz compression preset")
+	batchSize = cli.SwitchAttr("--batch-size", int, default=10000, help="Count of records in a bulk insert")
+
+	def main(self, outputFilePath: Path):
+		from ..delta import exportDelta
+		from ..rowidHacks import offset
+		from ..utils.mtqdm import mtqdm
+
+		since = (self.since - offset.date()).days
+		with DBAnalyser(self.dbPath, self.analyticsDBPath) as db, mtqdm(desc="Packing records of drives", unit="drives") as pb:
+			exportDelta(db, Path(outputFilePath), since, self.preset, self.batchSize, progress=pb.update)
+
+
+@DatasetExporter.subcommand("analytics")
+class AnalyticsExporter(cli.Application):
+	"""Copies the DB with analytics with the backup API, or with `VACUUM INTO` if it has many free pages"""
+
+	analyticsDBPath = cli.SwitchAttr("--analytics-db-path", cli.ExistingFile, default=database.analysisDatabaseDefaultFileName, help="Path to the SQLite database with analytics")
+
+	def main(self, outputFilePath: Path):
+		with DB(self.analyticsDBPath) as db, backupProgress() as progress:
+			db.copyDB(Path(outputFilePath), progress=progress)
+
+
 @DatasetExporter.subcommand("drives")
 class DrivesExporter(DatabaseCommand):
 	"""Exports info about vendors, brands and models into a separate file. Useful when wanna use preprocessed dataset only."""
 
 	augment = cli.Flag(("A", "augment"), help="Augment the data before exporting")
+	format = cli.SwitchAttr("--format", str, default=None, help="Output format, detected from the file extension by default, `jsonl` for stdout. Streaming ones: " + ", ".join(streamingFormats))
+	compression = cli.SwitchAttr("--compression", cli.Set(*compressors), default=None, help="Compress the streaming formats output, detected from the file extension by default")
 
 	def main(self, outputFilePath: Path = "./drives.sqlite", *what):
-		format = None
-		if outputFilePath == "-":
+		format = self.format
+		compression = self.compression
+		if str(outputFilePath) == "-":
 			outputFilePath = None
+			if format is None:
+				format = "jsonl"
 		else:
 			outputFilePath = Path(outputFilePath)
-			format = getExt(outputFilePath)
+			detectedFormat, detectedCompression = detectFormat(outputFilePath)
+			format = format or detectedFormat
+			compression = compression or detectedCompression
 
 		if format == "sqlite":
 			if self.augment:
-				print("For now we cannot export augmented data into a DB")
-			with DB(self.dbPath) as db:
-				db.exportSomeTables(outputFilePath, what)
+				Dataset(self.dbPath).augment()
+				what = (*(what or ("vendors", "brands", "models", "drives")), "modelsAttrs")
+			with DB(self.dbPath) as db, backupProgress() as progress:
+				db.exportSomeTables(outputFilePath, what, progress)
 		else:
 			if not what:
 				what = ("vendors", "brands", "models")
+			if format in streamingFormats and not self.augment:
+				Dataset.exportStreamFromDB(self.dbPath, outputFilePath, format, what, compression)
+				return
+			if compression is not None and format not in streamingFormats:
+				raise ValueError("Compression is supported only for the streaming formats: " + ", ".join(streamingFormats))  # checked before loading the dataset
 			ds = Dataset(self.dbPath)
 			if self.augment:
 				ds.augment()
-			ds.export(outputFilePath, what=what)
+			res = ds.export(outputFilePath, format, what=what, compression=compression)
+			if outputFilePath is None and format not in streamingFormats:
+				print(res)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+"""Startup of the CLI is dominated by imports: pandas, lifelines, xgboost, matplotlib and the augmenters cost seconds, and a careless top-level import makes every subcommand pay for them. Here we run the subcommands with `python -X importtime` and check the total import time and the set of imported modules against a budget."""
+
+import re
+import subprocess
+import sys
+
+from plumbum import cli
+
+importTimeRx = re.compile("^import time:\\s+(\\d+)\\s+\\|\\s+(\\d+)\\s+\\|(\\s*)(\\S+)$")
+
+# the subcommands which must start fast, they don't need the heavy dependencies to show their help
+defaultCommands = ("import", "preprocess", "retrieve", "export", "benchmark", "export drives", "import delta", "benchmark queryPlans")
+defaultForbiddenModules = ("pandas", "lifelines", "xgboost", "matplotlib", "sklearn", "HDDModelDecoder", "bs4")
+
+
+class ImportRecord:
+	"""A line of `-X importtime` output, times are in microseconds"""
+
+	__slots__ = ("name", "self", "cumulative", "level")
+
+	def __init__(self, name: str, self_: int, cumulative: int, level: int):
+		self.name = name
+		self.self = self_
+		self.cumulative = cumulative
+		self.level = level
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + ", ".join((repr(self.name), repr(self.self), repr(self.cumulative), repr(self.level))) + ")"
+
+
+def parseImportTime(output: str):
+	"""Parses the output of `python -X importtime`, yields `ImportRecord`s"""
+	for l in output.splitlines():
+		m = importTimeRx.match(l)
+		if m:
+			yield ImportRecord(m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2)
+
+
+def measureImportTime(command, python: str = None):
+	"""Runs `python -X importtime -m backblaze_analytics <command> --help` and returns the list of `ImportRecord`s"""
+	if python is None:
+		python = sys.executable
+	args = [python, "-X", "importtime", "-m", __package__.split(".")[0], *command, "--help"]
+	res = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+	records = list(parseImportTime(res.stderr))
+	if res.returncode:
+		raise RuntimeError("`" + " ".join(args) + "` has failed", res.stderr[-2000:])
+	return records
+
+
+def totalTime(records):
+	"""The sum of the cumulative times of the top-level imports, in microseconds"""
+	return sum(r.cumulative for r in records if r.level == 0)
+
+
+def topLevelPackages(records):
+	return {r.name.split(".")[0] for r in records}
+
+
+def checkImportTime(records, budget: float, forbiddenModules=()):
+	"""Returns a list of problems: exceeding the budget (in seconds) and importing the forbidden modules. An empty list means the command starts fast."""
+	problems = []
+	total = totalTime(records) / 1e6
+	if total > budget:
+		problems.append("imports take " + format(total, ".3f") + " s, the budget is " + format(budget, ".3f") + " s")
+	imported = topLevelPackages(records)
+	for m in forbiddenModules:
+		if m in imported:
+			problems.append("`" + m + "` is imported")
+	return problems
+
+
+def heaviestImports(records, count: int = 10):
+	"""The top-level imports sorted by their cumulative time"""
+	return sorted((r for r in records if r.level == 0), key=lambda r: r.cumulative, reverse=True)[:count]
+
+
+class ImportTimeChecker(cli.Application):
+	"""Runs the subcommands with `python -X importtime` and checks that their imports fit into the budget and don't pull the heavy dependencies. Returns non-zero if a subcommand has regressed."""
+
+	budget = cli.SwitchAttr("--budget", float, default=1.0, help="Max total import time of a subcommand, in seconds")
+	forbidden = cli.SwitchAttr("--forbidden", str, default=",".join(defaultForbiddenModules), help="Comma-separated top-level packages the subcommands must not import")
+	heaviest = cli.SwitchAttr("--heaviest", int, default=5, help="Count of the heaviest imports to print for each subcommand")
+
+	def main(self, *commands):
+		if not commands:
+			commands = defaultCommands
+		forbiddenModules = [m.strip() for m in self.forbidden.split(",") if m.strip()]
+		failed = 0
+		for command in commands:
+			try:
+				records = measureImportTime(command.split())
+			except RuntimeError as ex:
+				failed += 1
+				print("FAIL", command, file=sys.stderr)
+				print(ex.args[1], file=sys.stderr)
+				continue
+			problems = checkImportTime(records, self.budget, forbiddenModules)
+			if problems:
+				failed += 1
+			print("FAIL" if problems else "OK", command, format(totalTime(records) / 1e6, ".3f") + " s", file=sys.stderr)
+			for p in problems:
+				print("\t" + p, file=sys.stderr)
+			for r in heaviestImports(records, self.heaviest):
+				print("\t\t" + r.name, format(r.cumulative / 1e3, ".1f") + " ms", sep="\t", file=sys.stderr)
+		return int(bool(failed))
+
+
+if __name__ == "__main__":
+	ImportTimeChecker.run()
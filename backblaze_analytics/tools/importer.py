@@ -136,6 +136,44 @@ class SchemaUpgrader(DatabaseCommand):
 				db.upgradeSchema()
 
 
+@Importer.subcommand("delta")
+class DeltaImporter(DatabaseCommand):
+	"""Applies a package created with `export delta` in a single transaction"""
+
+	analyticsDBPath = cli.SwitchAttr("--analytics-db-path", cli.ExistingFile, default=database.analysisDatabaseDefaultFileName, help="Path to the SQLite database with analytics")
+	force = cli.Flag("--force", help="Apply even if the DB lacks the records before the ones in the package")
+	tempDir = cli.SwitchAttr("--tempDir", cli.ExistingDirectory, default=None, help="A dir to decompress the package into, the dir of the DB by default")
+
+	def main(self, deltaFilePath: cli.ExistingFile):
+		from ..delta import importDelta
+
+		with NoSuspend():
+			with DBAnalyser(self.dbPath, self.analyticsDBPath) as db:
+				res = importDelta(db, deltaFilePath, self.force, self.tempDir)
+		for k, v in res.items():
+			print(k, v, sep="\t")
+
+
+@Importer.subcommand("archive")
+class ArchiveRestorer(cli.Application):
+	"""Restores a DB from an archive created with `export archive`, entirely or only the records of a range of drives"""
+
+	drives = cli.SwitchAttr("--drives", str, default=None, help="A drive id or a range of them like `100-200` to restore only their records")
+
+	def main(self, archivePath: cli.ExistingFile, outputFilePath: Path = "./db.sqlite"):
+		from ..chunkedArchive import ChunkedArchive
+
+		firstDrive = lastDrive = None
+		if self.drives is not None:
+			firstDrive, _, lastDrive = self.drives.partition("-")
+			firstDrive = int(firstDrive)
+			lastDrive = int(lastDrive) if lastDrive else firstDrive
+		with ChunkedArchive(archivePath) as arch:
+			with mtqdm(total=None if firstDrive is not None else len(arch), desc="Restoring records", unit="records") as bar:
+				count = arch.restore(outputFilePath, firstDrive, lastDrive, progress=bar.update)
+		print("Restored", count, "records")
+
+
 Importer.subcommand("generateC++Schema")(CPPSchemaGen)
 
 if __name__ == "__main__":
@@ -9,9 +9,10 @@ from lazily import numpy as np
 from lazily import pandas
 from plumbum import cli
 
+from .. import database
 from ..dataset import *
 from ..datasetDescription import attrsSpec
-from ..utils.PickleCache import PickleCache
+from ..utils.PickleCache import PickleCache, codeFingerprint, dbFingerprint
 
 plt = lazyImport("matplotlib.pyplot")
 
@@ -51,8 +52,18 @@ params = {
 }
 
 
+def modelsCacheFingerprint(dataBaseFileName=None):
+	from ..augment import getAugmentersVersions
+
+	return {
+		"db": dbFingerprint(dataBaseFileName or database.databaseDefaultFileName),
+		"augmenters": getAugmentersVersions(),
+		"code": codeFingerprint(__name__, "backblaze_analytics.dataset", "backblaze_analytics.augment"),
+	}
+
+
 def makeImputer(dataBaseFileName):
-	pch = PickleCache({"pds": partial(prepareModelsForTrainingImputter, dataBaseFileName)}, "models")
+	pch = PickleCache({"pds": partial(prepareModelsForTrainingImputter, dataBaseFileName)}, "models", fingerprint=partial(modelsCacheFingerprint, dataBaseFileName))
 	ai = AutoXGBoost.AutoXGBoostImputer(features, pch.pds, params)
 	columns = set(ai.columns) - {"Caviar", "Scorpio", "GP", "name", "brand_id"}
 	return (ai, columns)
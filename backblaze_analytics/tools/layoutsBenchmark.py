@@ -0,0 +1,259 @@
+"""Compares the packed rowid layout of `drive_stats` with the layouts it was chosen over: a `WITHOUT ROWID` table with a compound primary key on `(drive_id, date)` and a rowid table with a secondary index on them. The same synthetic records are loaded into each layout, then insert throughput, file size and latencies of the typical queries are measured."""
+
+import json
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from plumbum import cli
+
+from ..database import DB, DrivesStatsTableSpec
+from ..datasetDescription import hddAttrsIDs, smartAttrsResolvers
+from ..rowidHacks import encode, sqlDateFromOid, sqlDriveIdFromOid, sqlThisDrive
+from ..synthetic import SyntheticDataset, SyntheticDatasetConfig
+from ..utils.perfMeasurement import measure
+
+tableName = "`drive_stats`"
+
+
+class StatsLayout:
+	"""A way to store `drive_stats`. `keySpecs` are the columns prepended to the ones of the stats, `keyFunc` maps `(driveId, day)`, where `day` is count of days since UNIX epoch like in `date` column, to the values of them. The queries use `:drive`, `:minDay` and `:maxDay` params."""
+
+	__slots__ = ("name", "keySpecs", "modifiers", "suffix", "extraQueries", "keyFunc", "queries")
+
+	def __init__(self, name: str, keySpecs, keyFunc, queries, modifiers=None, suffix="", extraQueries=()):
+		self.name = name
+		self.keySpecs = keySpecs
+		self.keyFunc = keyFunc
+		self.queries = queries
+		self.modifiers = modifiers
+		self.suffix = suffix
+		self.extraQueries = extraQueries
+
+	def genCreationQueries(self):
+		spec = DrivesStatsTableSpec(tableName, hddAttrsIDs, smartAttrsResolvers.pretty)
+		lines = list(DrivesStatsTableSpec.genTableColumnsSpecsLines([self.keySpecs, *spec.genSpecs()]))
+		yield "CREATE TABLE " + tableName + "(\n" + ",\n".join(lines) + ((",\n" + self.modifiers) if self.modifiers else "") + "\n)" + self.suffix + ";"
+		yield from self.extraQueries
+
+	def genInsertQuery(self):
+		columnsCount = len(self.keySpecs) + 2 + 2 * len(hddAttrsIDs)
+		return "insert into " + tableName + " values (" + ", ".join("?" * columnsCount) + ");"
+
+
+def packedRowidKey(driveId: int, day: int):
+	return (encode(driveId, day),)
+
+
+def separateColumnsKey(driveId: int, day: int):
+	return (driveId, day)
+
+
+def genDayRange(day="`date`"):
+	return day + " between :minDay and :maxDay"
+
+
+separateColumnsQueries = {
+	"driveFetch": "select * from " + tableName + " where `drive_id` = :drive order by `date`;",
+	"driveMinMax": "select min(`date`), max(`date`) from " + tableName + " where `drive_id` = :drive;",
+	"minMaxAll": "select `drive_id`, min(`date`), max(`date`) from " + tableName + " group by `drive_id`;",
+	"dateRange": "select count(*), sum(`failure`) from " + tableName + " where " + genDayRange() + ";",
+}
+
+packedDate = sqlDateFromOid(None, "`packed_rowid`")
+
+layouts = OrderedDict(
+	(l.name, l)
+	for l in (
+		StatsLayout(
+			"packedRowid",
+			(("packed_rowid", "INTEGER NOT NULL PRIMARY KEY"),),
+			packedRowidKey,
+			{
+				"driveFetch": "select * from " + tableName + " where " + sqlThisDrive(oid="`packed_rowid`") + " order by `packed_rowid`;",
+				"driveMinMax": "select " + sqlDateFromOid(None, "min(`packed_rowid`)") + ", " + sqlDateFromOid(None, "max(`packed_rowid`)") + " from " + tableName + " where " + sqlThisDrive(oid="`packed_rowid`") + ";",
+				"minMaxAll": "select " + sqlDriveIdFromOid(oid="`packed_rowid`") + ", min(" + packedDate + "), max(" + packedDate + ") from " + tableName + " group by `drive_id`;",
+				"dateRange": "select count(*), sum(`failure`) from " + tableName + " where " + genDayRange(packedDate) + ";",
+			},
+		),
+		StatsLayout(
+			"withoutRowid",
+			(("drive_id", "INTEGER NOT NULL"), ("date", "INTEGER NOT NULL")),
+			separateColumnsKey,
+			separateColumnsQueries,
+			modifiers="\t\tPRIMARY KEY(`drive_id`, `date`)",
+			suffix=" WITHOUT ROWID",
+		),
+		StatsLayout(
+			"rowidIndexed",
+			(("drive_id", "INTEGER NOT NULL"), ("date", "INTEGER NOT NULL")),
+			separateColumnsKey,
+			separateColumnsQueries,
+			extraQueries=("CREATE INDEX `drive_stats_drive_date` ON " + tableName + "(`drive_id`, `date`);",),
+		),
+	)
+)
+
+
+def genRecords(dataset: SyntheticDataset, dayIndex: int, keyFunc):
+	"""Yields the records of a day. The records are generated day by day, the same order the daily CSV files are imported in, so the inserts hit the layouts the way they are hit in production."""
+	day = dataset.config.startOrdinal + dayIndex
+	for driveId, d in enumerate(dataset.drives, 1):
+		if not (d.firstDay <= dayIndex <= d.lastDay):
+			continue
+		smart = dataset.genSMART(d, dayIndex, hddAttrsIDs)
+		rec = [*keyFunc(driveId, day), d.model.capacity, int(dayIndex in d.failureDays)]
+		for a in hddAttrsIDs:
+			rec.extend(smart[a])
+		yield rec
+
+
+def connect(dbFileName: Path):
+	db = sqlite3.connect(str(dbFileName), 0, True)
+	for sq in DB.genSetupQueries(dbFileName):
+		db.execute(sq)
+	return db
+
+
+def loadLayout(db, layout: StatsLayout, dataset: SyntheticDataset):
+	"""Creates the table and inserts the records a day per transaction, returns the count of records"""
+	for q in layout.genCreationQueries():
+		db.execute(q)
+	q = layout.genInsertQuery()
+	count = 0
+	for i in range(dataset.config.daysCount):
+		recs = list(genRecords(dataset, i, layout.keyFunc))
+		db.executemany(q, recs)
+		db.commit()
+		count += len(recs)
+	return count
+
+
+def timeQuery(db, query: str, paramsSeq):
+	"""Runs the query with each params, returns the latencies in seconds"""
+	res = []
+	for params in paramsSeq:
+		start = time.perf_counter()
+		db.execute(query, params).fetchall()
+		res.append(time.perf_counter() - start)
+	return res
+
+
+def summarize(latencies):
+	return {"count": len(latencies), "median": statistics.median(latencies), "mean": statistics.mean(latencies), "max": max(latencies)}
+
+
+def genQueriesParams(dataset: SyntheticDataset, sampleDrives: int, repeats: int, seed: int):
+	rng = random.Random(seed)
+	drivesIds = rng.sample(range(1, len(dataset.drives) + 1), min(sampleDrives, len(dataset.drives)))
+	midDay = dataset.config.startOrdinal + dataset.config.daysCount // 2
+	dateRange = {"drive": None, "minDay": midDay, "maxDay": midDay + 6}
+	perDrive = [{"drive": i, "minDay": None, "maxDay": None} for i in drivesIds]
+	return {
+		"driveFetch": perDrive,
+		"driveMinMax": perDrive,
+		"minMaxAll": [{}] * repeats,
+		"dateRange": [dateRange] * repeats,
+	}
+
+
+def benchmarkLayout(layout: StatsLayout, dataset: SyntheticDataset, workDir: Path, queriesParams):
+	dbFileName = workDir / (layout.name + ".sqlite")
+	res = OrderedDict()
+	db = connect(dbFileName)
+	try:
+		with measure() as m:
+			m.items = loadLayout(db, layout, dataset)
+		res["insert"] = m.toDict()
+		db.execute("ANALYZE;")
+		db.commit()
+		res["fileSize"] = dbFileName.stat().st_size
+		res["queries"] = OrderedDict()
+		res["plans"] = OrderedDict()
+		for name, query in layout.queries.items():
+			res["plans"][name] = [r[-1] for r in db.execute("EXPLAIN QUERY PLAN " + query, queriesParams[name][0])]
+			res["queries"][name] = summarize(timeQuery(db, query, queriesParams[name]))
+	finally:
+		db.close()
+	return res
+
+
+def runComparison(drivesCount: int, daysCount: int, layoutsNames=None, sampleDrives: int = 100, repeats: int = 5, seed: int = 0, workDir: Path = None):
+	if layoutsNames is None:
+		layoutsNames = layouts.keys()
+	dataset = SyntheticDataset(SyntheticDatasetConfig(drivesCount=drivesCount, daysCount=daysCount, seed=seed))
+	queriesParams = genQueriesParams(dataset, sampleDrives, repeats, seed)
+	res = OrderedDict()
+	res["meta"] = {"sqlite": sqlite3.sqlite_version, "drives": drivesCount, "days": daysCount, "sampleDrives": sampleDrives, "repeats": repeats, "seed": seed}
+	res["layouts"] = OrderedDict()
+	with tempfile.TemporaryDirectory(dir=workDir) as tempDir:
+		for name in layoutsNames:
+			print("Benchmarking layout", name, file=sys.stderr)
+			res["layouts"][name] = benchmarkLayout(layouts[name], dataset, Path(tempDir), queriesParams)
+	return res
+
+
+def genReportRows(res, reference: str = "packedRowid"):
+	"""Yields rows of the comparison table: metric, then a value for each layout, relative to the reference layout in parentheses"""
+	layoutsResults = res["layouts"]
+	metrics = OrderedDict()
+	metrics["insert, records/s"] = lambda r: r["insert"]["throughput"]
+	metrics["insert peak RSS, MiB"] = lambda r: r["insert"]["peakRSS"] / 2**20
+	metrics["file size, MiB"] = lambda r: r["fileSize"] / 2**20
+	for q in separateColumnsQueries:
+		metrics[q + " median, ms"] = lambda r, q=q: r["queries"][q]["median"] * 1000
+
+	yield ["metric", *layoutsResults]
+	for metricName, getter in metrics.items():
+		ref = getter(layoutsResults[reference]) if reference in layoutsResults else None
+		row = [metricName]
+		for r in layoutsResults.values():
+			v = getter(r)
+			cell = format(v, ".3f")
+			if ref:
+				cell += " (" + format(v / ref, ".2f") + "x)"
+			row.append(cell)
+		yield row
+
+
+def printReport(res, file=sys.stdout):
+	m = res["meta"]
+	print("SQLite " + m["sqlite"] + ", " + str(m["drives"]) + " drives x " + str(m["days"]) + " days", file=file)
+	for row in genReportRows(res):
+		print(*row, sep="\t", file=file)
+	print(file=file)
+	for layoutName, r in res["layouts"].items():
+		print(layoutName, file=file)
+		for q, plan in r["plans"].items():
+			print("\t" + q + ":", " | ".join(plan), file=file)
+
+
+class LayoutsBenchmark(cli.Application):
+	"""Loads the same synthetic records into the packed rowid layout of `drive_stats`, a `WITHOUT ROWID` table with compound primary key and a rowid table with a secondary index, and compares insert throughput, file size, per-drive fetches, min/max and date range queries."""
+
+	drivesCount = cli.SwitchAttr("--drives", int, default=3000, help="Count of drives in the synthetic fleet")
+	daysCount = cli.SwitchAttr("--days", int, default=90, help="Count of days in the synthetic dataset")
+	layoutsNames = cli.SwitchAttr("--layouts", str, default=None, help="Comma-separated names of the layouts to compare, all if not set. Available: " + ", ".join(layouts))
+	sampleDrives = cli.SwitchAttr("--sample-drives", int, default=100, help="Count of drives to run the per-drive queries for")
+	repeats = cli.SwitchAttr("--repeats", int, default=5, help="Count of runs of the whole-table queries")
+	seed = cli.SwitchAttr("--seed", int, default=0, help="Seed of the synthetic dataset and of the drives sample")
+	workDir = cli.SwitchAttr("--work-dir", cli.ExistingDirectory, default=None, help="A dir to create the temporary DBs in. Set it to a dir on the disk you want to measure, the system temp dir is used by default.")
+	output = cli.SwitchAttr("--output", str, default=None, help="Path to a JSON file to save the raw results")
+
+	def main(self):
+		layoutsNames = None
+		if self.layoutsNames:
+			layoutsNames = [l.strip() for l in self.layoutsNames.split(",")]
+		res = runComparison(self.drivesCount, self.daysCount, layoutsNames, self.sampleDrives, self.repeats, self.seed, self.workDir)
+		printReport(res)
+		if self.output:
+			Path(self.output).write_text(json.dumps(res, indent="\t"))
+
+
+if __name__ == "__main__":
+	LayoutsBenchmark.run()
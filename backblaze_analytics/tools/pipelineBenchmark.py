@@ -0,0 +1,310 @@
+"""Times the key stages of the pipeline on synthetic datasets of several scales, records throughput and peak RSS, compares them to a stored baseline."""
+
+import json
+import platform
+import sqlite3
+import sys
+import tempfile
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+
+from plumbum import cli
+
+from .. import database
+from ..synthetic import SyntheticDataset, SyntheticDatasetConfig
+from ..utils.perfMeasurement import measure
+from ..utils.PickleCache import useCacheDir
+
+
+class BenchmarkState:
+	"""Passes the artifacts produced by the stages to the following stages"""
+
+	def __init__(self, workDir: Path, dataset: SyntheticDataset, modelsPrefix: Path = None):
+		self.workDir = workDir
+		self.dataset = dataset
+		self.modelsPrefix = modelsPrefix
+		self.dbPath = workDir / "db.sqlite"
+		self.analyticsDBPath = workDir / "analytics.sqlite"
+		self.csvFiles = None
+		self.recordsCount = None
+		self.pds = None
+
+
+class StageSkipped(Exception):
+	pass
+
+
+class PipelineStage:
+	__slots__ = ("name", "func", "requires")
+
+	def __init__(self, name: str, func, requires=()):
+		self.name = name
+		self.func = func
+		self.requires = tuple(requires)
+
+
+stages = OrderedDict()
+
+
+def stage(name: str, requires=()):
+	"""Registers a stage. A stage is a func getting `BenchmarkState` and returning count of items processed."""
+
+	def decorator(func):
+		stages[name] = PipelineStage(name, func, requires)
+		return func
+
+	return decorator
+
+
+@stage("csvImport")
+def csvImportStage(st: BenchmarkState):
+	st.recordsCount = 0
+	with database.DBNormalizer(st.dbPath) as db:
+		db.createTables(st.analyticsDBPath)
+		for f in st.csvFiles:
+			st.recordsCount += db.importCSV(f)
+	return st.recordsCount
+
+
+@stage("normalizeModels", ("csvImport",))
+def normalizeModelsStage(st: BenchmarkState):
+	with database.DBNormalizer(st.dbPath) as db:
+		db.normalizeModels()
+	return st.recordsCount
+
+
+@stage("normalizeRecords", ("normalizeModels",))
+def normalizeRecordsStage(st: BenchmarkState):
+	with database.DBNormalizer(st.dbPath) as db:
+		size, progress = db.normalizeRecords(batchSize=10000)
+		for p in progress:
+			pass
+	return st.recordsCount
+
+
+@stage("preprocess", ("normalizeRecords",))
+def preprocessStage(st: BenchmarkState):
+	from .preprocess import preprocess
+
+	with database.DBAnalyser(st.dbPath, st.analyticsDBPath) as db:
+		preprocess(db)
+	return len(st.dataset.drives)
+
+
+@stage("datasetAugment", ("normalizeModels",))
+def datasetAugmentStage(st: BenchmarkState):
+	from ..dataset import Dataset
+
+	ds = Dataset(st.dbPath)
+	ds.augment()
+	return len(ds.drives)
+
+
+@stage("createDataFrame", ("preprocess",))
+def createDataFrameStage(st: BenchmarkState):
+	from ..analysis import Analysis
+
+	a = Analysis(st.dbPath, st.analyticsDBPath)
+	st.pds = a.createDataFrame(a.getAvailableKeys())
+	return len(st.pds)
+
+
+def makeAggregatorStage(aggregatorName: str):
+	@stage("aggregate" + aggregatorName, ("createDataFrame",))
+	def aggregatorStage(st: BenchmarkState):
+		if aggregatorName == "Weibull":
+			from ..fitters.XGBoostWeibullFitter import WeibullAggregator as aggregator
+		else:
+			from ..core import Aggregator
+
+			aggregator = getattr(Aggregator, aggregatorName + "Aggregator")
+
+		aggregator.aggregate(st.pds.copy())
+		return len(st.pds)
+
+	return aggregatorStage
+
+
+for aggregatorName in ("Mean", "GMean", "Weibull"):
+	makeAggregatorStage(aggregatorName)
+
+
+@stage("KMPlot", ("preprocess",))
+def KMPlotStage(st: BenchmarkState):
+	import matplotlib
+
+	matplotlib.use("Agg")
+	from .plotLifeLines import LifeLinesAnalysis
+
+	a = LifeLinesAnalysis(st.dbPath, st.analyticsDBPath)
+	a(attrs={"vendor"}, saveDir=st.workDir, imageExt="png")
+	return len(a.pds)
+
+
+@stage("predict", ("preprocess",))
+def predictStage(st: BenchmarkState):
+	if st.modelsPrefix is None:
+		raise StageSkipped("no fitted models are available, pass --models-prefix")
+
+	from .RegressionAnalysis import CoxAnalysis
+
+	a = CoxAnalysis(st.dbPath, 1.0, prefix=st.modelsPrefix, analyticsDBFilePath=st.analyticsDBPath)
+	a.loadModel()
+	modelsDescriptors = [{"name": m.name} for m in st.dataset.config.models] * 100
+	a.predictUnknownModelsSurvival(modelsDescriptors)
+	return len(modelsDescriptors)
+
+
+def runStages(st: BenchmarkState, stagesToRun=None):
+	if stagesToRun is None:
+		stagesToRun = stages.keys()
+
+	results = OrderedDict()
+	succeeded = set()
+	for name in stagesToRun:
+		s = stages[name]
+		missing = [r for r in s.requires if r not in succeeded]
+		if missing:
+			results[name] = {"skipped": "required stages have not succeeded: " + ", ".join(missing)}
+			continue
+
+		print("Running stage", name, file=sys.stderr)
+		try:
+			with measure() as m:
+				m.items = s.func(st)
+		except (ImportError, StageSkipped) as ex:
+			results[name] = {"skipped": str(ex)}
+			continue
+		except Exception as ex:
+			traceback.print_exc()
+			results[name] = {"error": repr(ex)}
+			continue
+		results[name] = m.toDict()
+		succeeded.add(name)
+	return results
+
+
+def scaleName(drivesCount: int, daysCount: int):
+	return str(drivesCount) + "x" + str(daysCount)
+
+
+def parseScales(scalesStr: str):
+	res = []
+	for s in scalesStr.split(","):
+		drivesCount, daysCount = s.strip().split("x")
+		res.append((int(drivesCount), int(daysCount)))
+	return res
+
+
+def runBenchmark(scales, stagesToRun=None, modelsPrefix: Path = None, seed: int = 0):
+	res = OrderedDict()
+	res["meta"] = {
+		"python": platform.python_version(),
+		"sqlite": sqlite3.sqlite_version,
+		"platform": platform.platform(),
+		"machine": platform.machine(),
+	}
+	res["results"] = OrderedDict()
+	if modelsPrefix is not None:
+		modelsPrefix = Path(modelsPrefix).absolute()
+
+	for drivesCount, daysCount in scales:
+		sn = scaleName(drivesCount, daysCount)
+		print("Scale", sn, file=sys.stderr)
+		with tempfile.TemporaryDirectory() as workDir:
+			workDir = Path(workDir)
+			with useCacheDir(workDir / "cache"):
+				ds = SyntheticDataset(SyntheticDatasetConfig(drivesCount=drivesCount, daysCount=daysCount, seed=seed))
+				st = BenchmarkState(workDir, ds, modelsPrefix)
+				st.csvFiles = ds.writeCSVs(workDir / "csv")
+				res["results"][sn] = runStages(st, stagesToRun)
+	return res
+
+
+def compareToBaseline(current, baseline, timeThreshold: float = 0.2, memThreshold: float = 0.2):
+	"""Returns a list of regressions. Time and peak RSS of a stage regress if they grow more than by the thresholds relatively to the baseline."""
+	regressions = []
+	for sn, stagesResults in current["results"].items():
+		baseStages = baseline["results"].get(sn)
+		if baseStages is None:
+			continue
+		for name, r in stagesResults.items():
+			b = baseStages.get(name)
+			if b is None or "seconds" not in b:
+				continue
+			if "seconds" not in r:
+				regressions.append((sn, name, "stage has not run: " + r.get("error", r.get("skipped", ""))))
+				continue
+			if r["seconds"] > b["seconds"] * (1 + timeThreshold):
+				regressions.append((sn, name, "time " + format(b["seconds"], ".3f") + " s -> " + format(r["seconds"], ".3f") + " s"))
+			if r["peakRSS"] > b["peakRSS"] * (1 + memThreshold):
+				regressions.append((sn, name, "peak RSS " + str(b["peakRSS"] // 2**20) + " MiB -> " + str(r["peakRSS"] // 2**20) + " MiB"))
+	return regressions
+
+
+def findFailedStages(res):
+	"""Returns a list of `(scale, stage, error)` of the stages which have raised. They are failures regardless of a baseline."""
+	return [(sn, name, r["error"]) for sn, stagesResults in res["results"].items() for name, r in stagesResults.items() if "error" in r]
+
+
+def printResults(res, file=sys.stderr):
+	for sn, stagesResults in res["results"].items():
+		print(sn, file=file)
+		for name, r in stagesResults.items():
+			if "seconds" in r:
+				tp = r["throughput"]
+				print("\t" + name, format(r["seconds"], ".3f") + " s", (format(tp, ".1f") + " items/s") if tp is not None else "", str(r["peakRSS"] // 2**20) + " MiB", sep="\t", file=file)
+			else:
+				print("\t" + name, *r.items(), sep="\t", file=file)
+
+
+class PipelineBenchmark(cli.Application):
+	"""Times the key stages of the pipeline (CSV import, normalization, preprocessing, augmentation, data frames creation, aggregation, KM plotting, prediction) on synthetic datasets. Returns non-zero if a stage has failed or a regression against the baseline is detected."""
+
+	scales = cli.SwitchAttr("--scales", str, default="300x30,3000x90", help="Comma-separated scales of synthetic datasets in the form `<drives>x<days>`")
+	stagesToRun = cli.SwitchAttr("--stages", str, default=None, help="Comma-separated names of the stages to run, all if not set. Available: " + ", ".join(stages))
+	output = cli.SwitchAttr("--output", str, default=None, help="Path to a JSON file to save the results")
+	baseline = cli.SwitchAttr("--baseline", str, default="./benchmarks/baseline.json", help="Path to a JSON file with the baseline results")
+	saveBaseline = cli.Flag("--save-baseline", help="Save the results as the baseline instead of comparing to it")
+	timeThreshold = cli.SwitchAttr("--time-threshold", float, default=0.2, help="Relative growth of time of a stage considered a regression")
+	memThreshold = cli.SwitchAttr("--mem-threshold", float, default=0.2, help="Relative growth of peak RSS of a stage considered a regression")
+	modelsPrefix = cli.SwitchAttr("--models-prefix", str, default=None, help="A dir with fitted Cox XGBoost models. `predict` stage is skipped without it.")
+	seed = cli.SwitchAttr("--seed", int, default=0, help="Seed of synthetic datasets")
+
+	def main(self):
+		stagesToRun = None
+		if self.stagesToRun:
+			stagesToRun = [s.strip() for s in self.stagesToRun.split(",")]
+
+		res = runBenchmark(parseScales(self.scales), stagesToRun, self.modelsPrefix, self.seed)
+		printResults(res)
+
+		if self.output:
+			Path(self.output).write_text(json.dumps(res, indent="\t"))
+
+		failedStages = findFailedStages(res)
+		for f in failedStages:
+			print("FAILED", *f, sep="\t", file=sys.stderr)
+
+		baselinePath = Path(self.baseline)
+		if self.saveBaseline:
+			if failedStages:
+				print("Some stages have failed, the baseline is not saved", file=sys.stderr)
+				return 1
+			baselinePath.parent.mkdir(parents=True, exist_ok=True)
+			baselinePath.write_text(json.dumps(res, indent="\t"))
+			return 0
+
+		if not baselinePath.exists():
+			print("No baseline in " + str(baselinePath) + ", nothing to compare with. Use --save-baseline to create it.", file=sys.stderr)
+			return int(bool(failedStages))
+
+		regressions = compareToBaseline(res, json.loads(baselinePath.read_text()), self.timeThreshold, self.memThreshold)
+		for r in regressions:
+			print("REGRESSION", *r, sep="\t", file=sys.stderr)
+		return int(bool(regressions or failedStages))
+
+
+if __name__ == "__main__":
+	PipelineBenchmark.run()
@@ -59,10 +59,14 @@ def refineHist(hist, bin_edges):
 class LifeLinesAnalysis(Analysis):
 	"""A class to make analysis. Call its methods in a Jupyter notebook"""
 
-	def __init__(self, dbFilePath: Path):
-		super().__init__(dbFilePath)
+	def __init__(self, dbFilePath: Path, analyticsDBFilePath: Path = None):
+		super().__init__(dbFilePath, analyticsDBFilePath)
 		self.kmf = lifelines.KaplanMeierFitter()
 
+	@property
+	def pds(self):
+		return self.pch.unaggregatedTask.pds
+
 	def plotDrivesSurvivalLine(self, cur, label: str, ax=None):
 		"""Plots lifelines for a subset of drives."""
 		if not cur.empty:
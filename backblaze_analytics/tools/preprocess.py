@@ -41,6 +41,54 @@ def detectAnomalies(db, failures):
 	return anomalies
 
 
+def preprocess(db, nonevaluated: bool = True, outdated: bool = True, failed: bool = True, anomalies: bool = True):
+	"""Finds first and last occurences and failures for every drive in dataset and saves them into analytics DB"""
+	if failed:
+		print("searching for failure records (both new and old ones)....")
+		failures = db.findFailureRecords()  # TODO: do it smart
+		print(len(failures), "records failed")
+		failures.sort(key=lambda x: x["id"])
+	elif anomalies:
+		print("searching for failure records of known failed drives....")
+		#failures = db.getKnownFailedDrivesFailureRecords()  # damn it, no better than the full scan
+		failures = list()
+		for r in db.getKnownFailedDrivesDates():
+			if r["failure"]:
+				del r["failure"]
+				failures.append(r)
+		print(len(failures), "records failed")
+		failures.sort(key=lambda x: x["id"])
+
+	if nonevaluated:
+		print("searching for nonevaluated drives....")
+		nonevaluatedDrives = db.findNonevaluatedDrives()
+		if failed:
+			failedIds = {f["id"] for f in failures}
+			nonevaluatedDrives = [d for d in nonevaluatedDrives if d["id"] not in failedIds]  # otherwise their records without `failure_date` would replace the ones with it
+		print(len(nonevaluatedDrives), "drives without stats")
+
+	if outdated:
+		print("searching for drives with outdated stats....")
+		outdatedDrives = db.findOutdatedCandidatesStatsRecords()  # TODO: do it smart
+		print(len(outdatedDrives), "drives with possibly outdated stats")
+
+	stats = []
+	if outdated:
+		stats.extend(db.recomputeStatsForDrives(mtqdm(outdatedDrives, desc="recomputing outdated")))
+	if failed:
+		stats.extend(db.computeStatsForDrives(mtqdm(failures, desc="computing failed")))
+	if nonevaluated:
+		stats.extend(db.computeStatsForDrives(mtqdm(nonevaluatedDrives, desc="computing nonevaluated")))
+
+	db.saveStatsForDrives(mtqdm(stats, desc="saving stats"))
+
+	if anomalies:
+		anomalousDrives = detectAnomalies(db, failures)
+		print(len(anomalousDrives), "anomalious drives")
+
+		db.saveAnomalies(mtqdm(anomalousDrives.items(), desc="saving anomalies"))
+
+
 class Preprocesser(DatabaseCommand):
 	"""find first and last occurences and failures for every drive in dataset"""
 
@@ -56,51 +104,12 @@ class Preprocesser(DatabaseCommand):
 		requires=["no-failed"],  # remember, in fact it is "failed", plumbum is shit and I have to do perversions, and it is definitely a bug
 		default=True,
 	)
+	columnStorePath = cli.SwitchAttr("--column-store", cli.ExistingDirectory, default=None, help="Path to a column store built with `export columnStore` to compute the stats of drives from. It is updated first if it lags behind the DB.")
 
 	def main(self):
 		with NoSuspend():
-			with database.DBAnalyser(self.dbPath) as db:
-				if self.failed:
-					print("searching for failure records (both new and old ones)....")
-					failures = db.findFailureRecords()  # TODO: do it smart
-					print(len(failures), "records failed")
-					failures.sort(key=lambda x: x["id"])
-				elif self.anomalies:
-					print("searching for failure records of known failed drives....")
-					#failures = db.getKnownFailedDrivesFailureRecords()  # damn it, no better than the full scan
-					failures = list()
-					for r in db.getKnownFailedDrivesDates():
-						if r["failure"]:
-							del r["failure"]
-							failures.append(r)
-					print(len(failures), "records failed")
-					failures.sort(key=lambda x: x["id"])
-
-				if self.nonevaluated:
-					print("searching for nonevaluated drives....")
-					nonevaluated = db.findNonevaluatedDrives()
-					print(len(nonevaluated), "drives without stats")
-
-				if self.outdated:
-					print("searching for drives with outdated stats....")
-					outdated = db.findOutdatedCandidatesStatsRecords()  # TODO: do it smart
-					print(len(outdated), "drives with possibly outdated stats")
-
-				stats = []
-				if self.outdated:
-					stats.extend(db.recomputeStatsForDrives(mtqdm(outdated, desc="recomputing outdated")))
-				if self.failed:
-					stats.extend(db.computeStatsForDrives(mtqdm(failures, desc="computing failed")))
-				if self.nonevaluated:
-					stats.extend(db.computeStatsForDrives(mtqdm(nonevaluated, desc="computing nonevaluated")))
-
-				db.saveStatsForDrives(mtqdm(stats, desc="saving stats"))
-
-				if self.anomalies:
-					anomalies = detectAnomalies(db, failures)
-					print(len(anomalies), "anomalious drives")
-
-					db.saveAnomalies(mtqdm(anomalies.items(), desc="saving anomalies"))
+			with database.DBAnalyser(self.dbPath, columnStore=self.columnStorePath) as db:
+				preprocess(db, nonevaluated=self.nonevaluated, outdated=self.outdated, failed=self.failed, anomalies=self.anomalies)
 
 
 if __name__ == "__main__":
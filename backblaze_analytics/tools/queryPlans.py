@@ -0,0 +1,139 @@
+"""The performance of this project relies on SQLite turning `sqlThisDrive` conditions and packed rowid equalities into rowid searches. A query edit or an SQLite upgrade may silently turn them into full scans of `drive_stats`, which costs days on the full dataset. Here we check the plans of the generated queries."""
+
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+from plumbum import cli
+
+from .. import database
+from ..database import DBAnalyser, genDriveStatsDenormQuery, genDriveStatsDenormSampledQuery, tablesNames
+from ..rowidHacks import dayFromOrd
+from ..synthetic import SyntheticDataset, SyntheticDatasetConfig
+
+rowidRange = "range"
+rowidEq = "eq"
+fullScan = "scan"
+automaticIndex = "autoIndex"
+
+# the kind of access and a regex of the constraint, the rest of the wording of the details differs between SQLite versions
+expectedPlans = {
+	rowidRange: ("SEARCH", re.compile("\\(rowid>\\? AND rowid<\\?\\)")),
+	rowidEq: ("SEARCH", re.compile("\\(rowid=\\?\\)")),
+	fullScan: ("SCAN", None),
+	automaticIndex: ("SEARCH", re.compile("AUTOMATIC .*INDEX \\(failure=\\?\\)")),
+}
+
+planAccessRx = re.compile("^(SEARCH|SCAN)(?: TABLE)? (\\S+)(?: AS (\\S+))?")  # SQLite < 3.36 writes `SEARCH TABLE <table> AS <alias>`
+smartTableName = database.TableName.fromStr(tablesNames["smart"]).name
+
+
+class CheckedQuery:
+	"""A query which plan is checked. `expectations` maps the aliases of `drive_stats` in the query to the kind of access expected."""
+
+	__slots__ = ("name", "query", "params", "expectations")
+
+	def __init__(self, name: str, query: str, params, expectations):
+		self.name = name
+		self.query = query
+		self.params = params
+		self.expectations = expectations
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + ", ".join((repr(self.name), repr(self.expectations))) + ")"
+
+
+def genCheckedQueries():
+	statsParams = {"id": 1}
+	yield CheckedQuery("computeStatsForDrives", DBAnalyser.genComputeStatsForDrivesQuery(), statsParams, {smartTableName: rowidRange})
+	yield CheckedQuery("recomputeStatsForDrives", DBAnalyser.genRecomputeStatsForDrivesQuery(), {"id": 1, "last_date": dayFromOrd(0)}, {smartTableName: rowidRange})
+	yield CheckedQuery("getKnownFailedDrivesDates", DBAnalyser.genKnownFailedDrivesDatesQuery(), (), {"st": rowidRange})
+	yield CheckedQuery("getKnownFailedDrivesFailureRecords", DBAnalyser.genKnownFailedDrivesDatesQuery(onlyFailureRecords=True), (), {"st": automaticIndex})  # the optimizer eliminates our rowid hacks here, that's why getKnownFailedDrivesDates is used instead
+	yield CheckedQuery("exportToyDB", DBAnalyser.genToySMARTSelectQuery(), (1,), {"ds": rowidRange})
+	yield CheckedQuery("findFailureRecords", DBAnalyser.genFindFailureRecordsQuery(), (), {smartTableName: fullScan})  # our rowid structure is optimized for selection by drive, so it is a scan by design
+	for failed in (True, False):
+		expectations = {"fi": rowidEq, "la": rowidEq}
+		if failed:
+			expectations["fa"] = rowidEq
+		yield CheckedQuery("genDriveStatsDenormQuery(failed=" + str(failed) + ")", genDriveStatsDenormQuery(failed=failed), (), expectations)
+	samplingParams = {"failedFraction": 1.0, "censoredFraction": 0.1, "seed": 0, "minPerStratum": 1}
+	yield CheckedQuery("genDriveStatsDenormSampledQuery", genDriveStatsDenormSampledQuery(), samplingParams, {"fi": rowidEq, "la": rowidEq, "fa": rowidEq})
+
+
+def explainQueryPlan(db, query: str, params=()):
+	"""Returns the details of the rows of `EXPLAIN QUERY PLAN` for the query"""
+	return [r[-1] for r in db.db.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+def checkQueryPlan(db, checkedQuery: CheckedQuery):
+	"""Returns a list of problems found in the plan of a query. An empty list means the plan is as expected."""
+	planDetails = explainQueryPlan(db, checkedQuery.query, checkedQuery.params)
+	problems = []
+	seen = set()
+	for detail in planDetails:
+		m = planAccessRx.match(detail)
+		if not m:
+			continue
+		access, alias = m.group(1), m.group(3) or m.group(2)
+		if alias not in checkedQuery.expectations:
+			if alias == smartTableName:
+				problems.append("unexpected access to " + smartTableName + ": " + detail)
+			continue
+		seen.add(alias)
+		expectedAccess, constraintRx = expectedPlans[checkedQuery.expectations[alias]]
+		if access != expectedAccess or (constraintRx is not None and not constraintRx.search(detail)):
+			problems.append("expected " + expectedAccess + " of `" + alias + "`" + ((" matching `" + constraintRx.pattern + "`") if constraintRx is not None else "") + ", got `" + detail + "`")
+	for alias in checkedQuery.expectations.keys() - seen:
+		problems.append("`" + alias + "` is not present in the plan: " + repr(planDetails))
+	return problems
+
+
+def checkQueryPlans(db, checkedQueries=None):
+	"""Checks the plans of the queries, yields (query, problems) pairs"""
+	if checkedQueries is None:
+		checkedQueries = genCheckedQueries()
+	for q in checkedQueries:
+		yield q, checkQueryPlan(db, q)
+
+
+def createTinyDB(dbFileName: Path, analyticsDBFileName: Path):
+	"""Creates a DB with a few records, just enough for the optimizer to see the tables non-empty"""
+	SyntheticDataset(SyntheticDatasetConfig(drivesCount=16, daysCount=8, failureRateMultiplier=100.0)).createDBs(dbFileName, analyticsDBFileName)
+
+
+class QueryPlansChecker(cli.Application):
+	"""Checks that the generated queries access `drive_stats` by rowid ranges rather than by full scans. Returns non-zero if any plan has regressed."""
+
+	dbPath = cli.SwitchAttr("--db-path", cli.ExistingFile, default=None, help="Path to the SQLite database to check the plans against. If not set, a tiny synthetic DB is created in a temp dir.")
+	analyticsDBPath = cli.SwitchAttr("--analytics-db-path", cli.ExistingFile, default=None, help="Path to the SQLite database with analytics")
+
+	def check(self, dbPath, analyticsDBPath):
+		failed = 0
+		with DBAnalyser(dbPath, analyticsDBPath) as db:
+			print("SQLite", database.sqlite3.sqlite_version, file=sys.stderr)
+			for q, problems in checkQueryPlans(db):
+				if problems:
+					failed += 1
+					print("FAIL", q.name, file=sys.stderr)
+					for p in problems:
+						print("\t" + p, file=sys.stderr)
+				else:
+					print("OK", q.name, file=sys.stderr)
+		return failed
+
+	def main(self):
+		if self.dbPath is not None:
+			failed = self.check(self.dbPath, self.analyticsDBPath)
+		else:
+			with tempfile.TemporaryDirectory() as tempDir:
+				tempDir = Path(tempDir)
+				dbPath = tempDir / "db.sqlite"
+				analyticsDBPath = tempDir / "analytics.sqlite"
+				createTinyDB(dbPath, analyticsDBPath)
+				failed = self.check(dbPath, analyticsDBPath)
+		return int(bool(failed))
+
+
+if __name__ == "__main__":
+	QueryPlansChecker.run()
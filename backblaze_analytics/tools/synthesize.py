@@ -0,0 +1,61 @@
+import datetime
+from pathlib import Path
+
+from plumbum import cli
+
+from ..synthetic import SyntheticDataset, SyntheticDatasetConfig
+from .NeedingOutputDirCommand import NeedingOutputDirCommand
+
+
+class SyntheticDatasetGenerator(NeedingOutputDirCommand):
+	"""Generates a synthetic Backblaze-like dataset: daily CSV files, zip archives of them, and normalized DBs. The same parameters and seed always give the same dataset."""
+
+	drivesCount = cli.SwitchAttr("--drives", int, default=1000, help="Count of drives in the fleet")
+	daysCount = cli.SwitchAttr("--days", int, default=90, help="Count of days in the dataset")
+	startDate = cli.SwitchAttr("--start-date", datetime.date.fromisoformat, default=datetime.date(2016, 1, 1), help="The date of the first day, YYYY-MM-DD")
+	seed = cli.SwitchAttr("--seed", int, default=0, help="Seed of the PRNG")
+	failureRateMultiplier = cli.SwitchAttr("--failure-rate-multiplier", float, default=1.0, help="Multiplies the annualized failure rates of all the models")
+	schemaChangeDay = cli.SwitchAttr("--schema-change-day", int, default=None, help="Index of the day since which the CSV files contain the full set of columns. By default it is in the middle of the day range")
+	postFailureUse = cli.SwitchAttr("--post-failure-use", float, default=0.1, help="Fraction of the failed drives used after a failure")
+	multipleFailures = cli.SwitchAttr("--multiple-failures", float, default=0.3, help="Fraction of the drives used after a failure failing once more")
+	missingSerials = cli.SwitchAttr("--missing-serials", float, default=0.002, help="Fraction of the drives of the first model having no serial number in some records")
+
+	csv = cli.Flag("--csv", help="Write the daily CSV files")
+	zip = cli.Flag("--zip", help="Write zip archives with CSV files like the ones on Backblaze website")
+	db = cli.Flag("--db", help="Write normalized `db.sqlite` and preprocessed `analytics.sqlite`")
+
+	def makeConfig(self):
+		schemaChanges = None
+		if self.schemaChangeDay is not None:
+			from ..datasetDescription import smartAttrIDs
+
+			schemaChanges = ((0, smartAttrIDs[:-8]), (self.schemaChangeDay, smartAttrIDs))
+		return SyntheticDatasetConfig(
+			drivesCount=self.drivesCount,
+			daysCount=self.daysCount,
+			startDate=self.startDate,
+			failureRateMultiplier=self.failureRateMultiplier,
+			schemaChanges=schemaChanges,
+			postFailureUse=self.postFailureUse,
+			multipleFailures=self.multipleFailures,
+			missingSerials=self.missingSerials,
+			seed=self.seed,
+		)
+
+	def main(self):
+		if not (self.csv or self.zip or self.db):
+			self.help()
+			return -1
+
+		destFolder = Path(self.destFolder)
+		ds = SyntheticDataset(self.makeConfig())
+		if self.csv:
+			ds.writeCSVs(destFolder / "csv")
+		if self.zip:
+			ds.writeZips(destFolder / "dataset")
+		if self.db:
+			ds.createDBs(destFolder / "db.sqlite", destFolder / "analytics.sqlite")
+
+
+if __name__ == "__main__":
+	SyntheticDatasetGenerator.run()
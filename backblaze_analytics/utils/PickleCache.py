@@ -1,43 +1,299 @@
-__all__ = ("PickleCache",)
+__all__ = ("PickleCache", "useCacheDir", "fileFingerprint", "dbFingerprint", "codeFingerprint", "evict")
 
-import lzma
+import hashlib
+import importlib.util
+import io
+import json
 import os
+import pickle
+import platform
+import shutil
+import sqlite3
+import sys
+from contextlib import contextmanager
 from pathlib import Path
 
 from lazy_object_proxy import Proxy
 
-#try:
-#	import joblib
-#except BaseException:
-#	import pickle as joblib
-try:
-	import _pickle as joblib
-except BaseException:
-	import pickle as joblib
+from . import memoryManager as memoryManagerModule
+
 cacheDir = Path("./cache/pickles")
+maxCacheSize = 16 << 30  # bytes, the least recently used entries are evicted above it
+entrySuffix = ".entry"
+legacySuffix = ".pickle.xz"
+framesCompression = "uncompressed"  # Feather files are memory-mapped, compressed ones would have to be decompressed
+pickleCompression = "zstd"  # of the rest of an object
+
+
+@contextmanager
+def useCacheDir(newCacheDir: Path):
+	"""Temporarily redirects the caches created within the block into another dir. Useful for benchmarks not to pollute and not to reuse the main caches."""
+	global cacheDir
+	prev = cacheDir
+	cacheDir = Path(newCacheDir)
+	try:
+		yield cacheDir
+	finally:
+		cacheDir = prev
+
+
+def fileFingerprint(fileName: Path):
+	"""Identity of a file: its resolved path, size and modification time. `None` for a missing file."""
+	fileName = Path(fileName)
+	if not fileName.exists():
+		return None
+	st = fileName.stat()
+	return [str(fileName.resolve()), st.st_size, st.st_mtime_ns]
+
+
+def dbFingerprint(dbFileName: Path):
+	"""Identity of an SQLite DB: the fingerprints of the file and of its WAL, `user_version` and a hash of the schema. `PRAGMA data_version` is not used, since it is meaningful only within a single connection."""
+	res = fileFingerprint(dbFileName)
+	if res is None:
+		return None
+	res.append(fileFingerprint(str(dbFileName) + "-wal"))
+	db = sqlite3.connect("file:" + str(Path(dbFileName).resolve()) + "?mode=ro", uri=True)
+	try:
+		res.append(next(db.execute("PRAGMA user_version;"))[0])
+		schema = db.execute("select `type`, `name`, `sql` from `sqlite_master` order by `name`;").fetchall()
+	finally:
+		db.close()
+	res.append(hashlib.sha1(json.dumps(schema).encode("utf-8")).hexdigest())
+	return res
+
+
+def codeFingerprint(*moduleNames: str):
+	"""Hashes of the sources of the modules, the modules are not imported"""
+	res = {}
+	for name in moduleNames:
+		spec = importlib.util.find_spec(name)
+		res[name] = hashlib.sha1(Path(spec.origin).read_bytes()).hexdigest()[:12]
+	return res
+
+
+def digestFingerprint(fingerprint):
+	return hashlib.sha1(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def fileLock(lockFileName: Path):
+	"""An exclusive lock of a file, blocks till it is released by the other processes"""
+	with open(lockFileName, "a+b") as f:
+		if platform.system() == "Windows":
+			import msvcrt
+
+			f.seek(0)
+			while True:
+				try:
+					msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+					break
+				except OSError:  # LK_LOCK gives up after 10 attempts
+					pass
+			try:
+				yield
+			finally:
+				f.seek(0)
+				msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+		else:
+			import fcntl
+
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def getPyArrow():
+	"""`pyarrow` is optional, without it the objects are pickled entirely and uncompressed"""
+	try:
+		import pyarrow
+		import pyarrow.feather
+	except ImportError:
+		return None
+	return pyarrow
+
+
+def isFeatherable(obj):
+	"""Feather stores only the frames with string column names, the other ones don't round-trip"""
+	pandas = sys.modules.get("pandas")  # if pandas is not imported, there are no frames
+	if pandas is None or not isinstance(obj, pandas.DataFrame):
+		return False
+	return not isinstance(obj.columns, pandas.MultiIndex) and all(isinstance(c, str) for c in obj.columns)
+
+
+class FramesPickler(pickle.Pickler):
+	"""Pickles an object storing the `pandas.DataFrame`s within it into separate Feather files in `framesDir`"""
+
+	def __init__(self, file, framesDir: Path, pyarrow):
+		super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+		self.framesDir = framesDir
+		self.pyarrow = pyarrow
+		self.savedFrames = {}
+
+	def persistent_id(self, obj):
+		if self.pyarrow is None or not isFeatherable(obj):  # without `pyarrow` the frames are pickled as they are
+			return None
+		res = self.savedFrames.get(id(obj))
+		if res is not None:
+			return res
+		try:
+			table = self.pyarrow.Table.from_pandas(obj)
+		except (self.pyarrow.ArrowException, ValueError, TypeError):  # i.e. mixed types in an object column
+			return None
+		res = ("frame", str(len(self.savedFrames)) + ".feather")
+		self.framesDir.mkdir(exist_ok=True)
+		self.pyarrow.feather.write_feather(table, str(self.framesDir / res[1]), compression=framesCompression)
+		self.savedFrames[id(obj)] = res
+		return res
+
+
+class FramesUnpickler(pickle.Unpickler):
+	def __init__(self, file, framesDir: Path, pyarrow):
+		super().__init__(file)
+		self.framesDir = framesDir
+		self.pyarrow = pyarrow
+		self.loadedFrames = {}
+
+	def persistent_load(self, pid):
+		kind, fileName = pid
+		if kind != "frame":
+			raise pickle.UnpicklingError("Unknown persistent id", pid)
+		res = self.loadedFrames.get(fileName)
+		if res is None:
+			res = self.loadedFrames[fileName] = self.pyarrow.feather.read_table(str(self.framesDir / fileName), memory_map=True).to_pandas()
+		return res
+
+
+def writeEntry(entryDir: Path, obj):
+	"""Stores an object into a dir: the frames within it as Feather files, the rest as a zstd-compressed pickle"""
+	pyarrow = getPyArrow()
+	entryDir.mkdir()
+	framesDir = entryDir / "frames"
+	if pyarrow is not None:
+		with pyarrow.CompressedOutputStream(str(entryDir / ("object.pickle." + pickleCompression)), pickleCompression) as f:
+			FramesPickler(f, framesDir, pyarrow).dump(obj)
+	else:
+		with (entryDir / "object.pickle").open("wb") as f:
+			FramesPickler(f, framesDir, None).dump(obj)
+
+
+def readEntry(entryDir: Path):
+	pyarrow = getPyArrow()
+	compressedFileName = entryDir / ("object.pickle." + pickleCompression)
+	if compressedFileName.exists():
+		if pyarrow is None:
+			raise ImportError("The cache entry " + str(entryDir) + " is compressed, reading it requires `pyarrow`")
+		with pyarrow.CompressedInputStream(pyarrow.OSFile(str(compressedFileName)), pickleCompression) as f:
+			return FramesUnpickler(io.BufferedReader(f), entryDir / "frames", pyarrow).load()
+	with (entryDir / "object.pickle").open("rb") as f:
+		return FramesUnpickler(f, entryDir / "frames", pyarrow).load()
+
+
+def getSize(path: Path):
+	if path.is_dir():
+		return sum(fn.stat().st_size for fn in path.rglob("*") if fn.is_file())
+	return path.stat().st_size
+
 
+def removeEntry(path: Path):
+	if path.is_dir():
+		shutil.rmtree(str(path))
+	else:
+		path.unlink()
 
-def makeProxyFunc(name, prefix, creatorFunc):
+
+def evict(maxSize: int = None, keep=()):
+	"""Removes the least recently used entries of all the caches in the cache dir till their total size fits into `maxSize`. The `.pickle.xz` files of the previous versions are evicted too. Returns the list of removed entries."""
+	if maxSize is None:
+		maxSize = maxCacheSize
+	keep = {Path(k).resolve() for k in keep}
+	entries = []
+	for suffix in (entrySuffix, legacySuffix):
+		for fn in cacheDir.rglob("*" + suffix):
+			try:
+				entries.append((fn.stat().st_mtime_ns, getSize(fn), fn))
+			except FileNotFoundError:  # removed by another process
+				continue
+	total = sum(e[1] for e in entries)
+	removed = []
+	for mtime, size, fn in sorted(entries, key=lambda e: e[0]):
+		if total <= maxSize:
+			break
+		if fn.resolve() in keep:
+			continue
+		try:
+			removeEntry(fn)
+		except FileNotFoundError:
+			pass
+		except OSError:  # memory-mapped by another process on Windows
+			continue
+		total -= size
+		removed.append(fn)
+	return removed
+
+
+def makeProxyFunc(name, prefix, creatorFunc, fingerprintFunc=None, maxSize: int = None):
 	prefixDir = cacheDir / prefix
-	pickleFileName = prefixDir / (name + ".pickle.xz")
+
+	def getEntryDir():
+		fingerprint = fingerprintFunc() if fingerprintFunc is not None else None
+		return prefixDir / (name + "-" + digestFingerprint(fingerprint) + entrySuffix)
+
+	def load(entryDir):
+		res = readEntry(entryDir)
+		os.utime(str(entryDir))  # marks it as recently used, atime is unreliable
+		return res
 
 	def proxyFunc():
-		if pickleFileName.exists():
-			with lzma.open(pickleFileName, "rb") as f:
-				res = joblib.load(f)
-		else:
-			os.makedirs(str(prefixDir), exist_ok=True)
+		entryDir = getEntryDir()
+		if entryDir.exists():
+			return load(entryDir)
+
+		os.makedirs(str(prefixDir), exist_ok=True)
+		with fileLock(prefixDir / (name + ".lock")):
+			entryDir = getEntryDir()
+			if entryDir.exists():  # created by another process while we were waiting
+				return load(entryDir)
 			res = creatorFunc()
-			with lzma.open(pickleFileName, "wb") as f:
-				joblib.dump(res, f, protocol=-1)
+			entryDir = getEntryDir()  # the creator may have modified the inputs itself, i.e. stored the results of augmenters into the DB
+			tmpDir = entryDir.parent / (entryDir.name + "." + str(os.getpid()) + ".tmp")
+			if tmpDir.exists():
+				shutil.rmtree(str(tmpDir))
+			writeEntry(tmpDir, res)
+			os.replace(str(tmpDir), str(entryDir))
+		evict(maxSize, keep=(entryDir,))
 		return res
 
 	return proxyFunc
 
 
 class PickleCache:
-	"""If the object is not cached, creates it and pickles, otherwise loads it from pickle"""
+	"""If the object is not cached, creates it and pickles, otherwise loads it from pickle. The `pandas.DataFrame`s within the objects are stored as uncompressed Feather files and memory-mapped on load, the rest is pickled and compressed with zstd; both require `pyarrow`, without it the objects are just pickled. An entry is keyed by the digest of `fingerprint()`, which must return a JSON-serializable description of everything the objects depend on (see `dbFingerprint` and `codeFingerprint`), so the stale entries are not used and rebuilt. The least recently used entries are evicted when the cache dir exceeds `maxSize` bytes. Creation of an entry is guarded by a file lock, so concurrent processes create it only once. The loaded objects are kept within the RSS budget of `memoryManager` (see `utils.memoryManager`) and can be evicted explicitly with `evict`."""
 
-	def __init__(self, creators: dict, prefix=""):
+	def __init__(self, creators: dict, prefix="", fingerprint=None, maxSize: int = None, derived: dict = None, memoryManager=None):
+		self.memoryManager = memoryManager if memoryManager is not None else memoryManagerModule.memoryManager
 		for name, creator in creators.items():
-			setattr(self, name, Proxy(makeProxyFunc(name, prefix, creator)))
+			setattr(self, name, Proxy(self.tracked(name, makeProxyFunc(name, prefix, creator, fingerprint, maxSize))))
+		if derived:  # cheap to derive from the cached objects, so not stored
+			for name, creator in derived.items():
+				setattr(self, name, Proxy(self.tracked(name, creator)))
+
+	def tracked(self, name: str, func):
+		"""Reports the loaded objects to the memory manager"""
+
+		def trackedFunc():
+			res = func()
+			self.memoryManager.loaded(self, name, res)
+			return res
+
+		return trackedFunc
+
+	def evict(self, name: str):
+		"""Drops the reference to an object, it is reloaded from the on-disk cache (or derived again) on the next access. Returns if it was loaded."""
+		proxy = getattr(self, name)
+		self.memoryManager.forget(self, name)
+		if proxy.__resolved__:
+			del proxy.__wrapped__
+			return True
+		return False
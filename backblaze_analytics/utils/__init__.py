@@ -2,6 +2,7 @@ import collections
 import importlib
 import platform
 import sys
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -9,7 +10,7 @@ import _io
 from dateutil.relativedelta import relativedelta
 from psutil import virtual_memory
 
-__all__ = ("pathRes", "find7z", "nearestPowerOf2", "flattenDict", "getInterpreterCommand", "fancyTimeDelta")
+__all__ = ("pathRes", "find7z", "nearestPowerOf2", "flattenDict", "getInterpreterCommand", "fancyTimeDelta", "exportStream", "detectFormat")
 
 
 def fancyTimeDelta(d: timedelta):
@@ -110,10 +111,10 @@ def export(data, file: (Path, str, _io._IOBase) = None, format: str = None):
 	data = makeSerializeable(data)
 
 	if isinstance(file, _io._IOBase):
-		return exporter.dump(file, data)
+		return exporter.dump(data, file)
 	elif file is None:
 		return exporter.dumps(data)
-	elif isinstance(file, str):
+	elif isinstance(file, Path):
 		mode = "w" + allowedFormats[format]
 		with file.open(mode) as file:
 			return exporter.dump(data, file)
@@ -121,6 +122,69 @@ def export(data, file: (Path, str, _io._IOBase) = None, format: str = None):
 		raise ValueError("file argument is of wrong type")
 
 
+streamingFormats = {"jsonl": "t", "msgpack": "b"}
+compressors = {"gz": "gzip", "xz": "lzma", "bz2": "bz2"}
+
+
+def detectFormat(filePath: str):
+	"""Returns the format and the compression from the extensions of a file name like `drives.jsonl.gz`"""
+	suffixes = [s[1:] for s in Path(filePath).suffixes]
+	compression = None
+	if suffixes and suffixes[-1] in compressors:
+		compression = suffixes.pop()
+	return (suffixes[-1] if suffixes else None), compression
+
+
+@contextmanager
+def openBinaryOutput(file: Path = None, compression: str = None):
+	"""Opens a file or stdout (if `file` is `None`) for binary writing, wrapped into a compressor"""
+	raw = sys.stdout.buffer if file is None else Path(file).open("wb")
+	f = importlib.import_module(compressors[compression]).open(raw, "wb") if compression else raw
+	try:
+		yield f
+	finally:
+		if compression:
+			f.close()
+		if file is None:
+			raw.flush()
+		else:
+			raw.close()
+
+
+def genRecordsEncoder(format: str):
+	if format == "jsonl":
+		import json
+
+		return lambda rec: json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n"
+	elif format == "msgpack":
+		try:
+			import msgpack
+		except ImportError as ex:
+			raise ImportError("MessagePack export requires `msgpack`, install it with `pip install msgpack`") from ex
+		return msgpack.Packer().pack
+	raise AttributeError("Valid streaming formats are: " + ", ".join(streamingFormats.keys()) + " but you have passed " + str(format), "format")
+
+
+def exportStream(tables, file: (Path, str) = None, format: str = None, compression: str = None):
+	"""Writes the rows of the tables one by one as `{"table": name, "row": row}` records, as lines of JSON or as a stream of MessagePack maps, so only a row is kept in memory. `tables` is an iterable of `(name, rows)` pairs, `None` rows are skipped. `file` is `None` for stdout. Returns the count of the written rows."""
+	if format is None:
+		if file is None:
+			format = "jsonl"
+		else:
+			format, detectedCompression = detectFormat(file)
+			if compression is None:
+				compression = detectedCompression
+	encode = genRecordsEncoder(format)
+	count = 0
+	with openBinaryOutput(file, compression) as f:
+		for name, rows in tables:
+			for r in rows:
+				if r is not None:
+					f.write(encode({"table": name, "row": makeSerializeable(dict(r))}))
+					count += 1
+	return count
+
+
 def getDBMmapSize(fileName: Path, initialSize: int = 1024 * 1024 * 1024, maxSize: int = None, leave: (int, float) = 0.2, emptyFileSize: int = 1024):
 	fileName = Path(fileName)
 	fSize = fileName.stat().st_size
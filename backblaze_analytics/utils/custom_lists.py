@@ -72,3 +72,9 @@ class CustomBaseList(SilentList):
 
 	def __enumerate__(self):
 		raise NotImplementedError()
+
+
+class ZeroBasedList(CustomBaseList):
+	"""A `CustomBaseList` for the ids starting from 0"""
+
+	base = 0
@@ -0,0 +1,94 @@
+"""Keeps the objects loaded by `PickleCache`s within a budget of RSS of the process. Long sessions load more and more frames, and nothing is ever released by itself, since the caches keep the references."""
+
+__all__ = ("MemoryManager", "memoryManager", "estimateSize")
+
+import sys
+import weakref
+from collections import OrderedDict
+from gc import collect
+
+from psutil import Process, virtual_memory
+
+defaultBudgetFraction = 0.75  # of the physical memory
+
+
+def estimateSize(obj):
+	"""Memory taken by an object in bytes: exact for data frames and the objects having them in `pds` (learning tasks), shallow for the rest"""
+	if hasattr(obj, "memory_usage"):
+		res = obj.memory_usage(deep=True)
+		return int(res.sum() if hasattr(res, "sum") else res)
+	pds = getattr(obj, "pds", None)
+	if pds is not None:
+		return estimateSize(pds)
+	return sys.getsizeof(obj)
+
+
+class MemoryManager:
+	"""Tracks the objects loaded by the caches in the order of loading. When RSS of the process exceeds `budget` bytes (a fraction of the physical memory by default), evicts the least recently loaded ones from the caches till it fits. An evicted object is transparently reloaded from the on-disk cache on the next access. Objects still referenced elsewhere are not freed by eviction, so keep the references to the frames short-living. The caches are referenced weakly, so the manager doesn't keep the dropped ones alive."""
+
+	def __init__(self, budget: int = None):
+		self.budget = budget
+		self.entries = OrderedDict()  # (weakref.ref(cache), name) -> size
+		self.process = Process()
+
+	def getBudget(self):
+		if self.budget is None:
+			return int(virtual_memory().total * defaultBudgetFraction)
+		return self.budget
+
+	def rss(self):
+		return self.process.memory_info().rss
+
+	def prune(self):
+		"""Forgets the entries of the caches which have been garbage-collected"""
+		for key in [k for k in self.entries if k[0]() is None]:
+			del self.entries[key]
+
+	def loaded(self, cache, name: str, obj):
+		"""Called by a cache when an object is loaded or created"""
+		key = (weakref.ref(cache), name)  # a live ref is equal to the other refs of the same object
+		self.entries[key] = estimateSize(obj)
+		self.entries.move_to_end(key)
+		self.enforce(keep=(key,))
+
+	def forget(self, cache, name: str):
+		self.entries.pop((weakref.ref(cache), name), None)
+
+	def evict(self, cache, name: str):
+		"""Evicts an object from a cache and collects the garbage"""
+		res = cache.evict(name)
+		collect()
+		return res
+
+	def enforce(self, keep=()):
+		"""Evicts the least recently loaded objects till RSS fits into the budget. Returns the list of `(name, size)` of the evicted ones."""
+		self.prune()
+		budget = self.getBudget()
+		evicted = []
+		if self.rss() <= budget:
+			return evicted
+		for key in list(self.entries):
+			if key in keep or key not in self.entries:
+				continue
+			cacheRef, name = key
+			size = self.entries[key]
+			cache = cacheRef()
+			if cache is None:
+				del self.entries[key]
+				continue
+			self.evict(cache, name)
+			del cache
+			evicted.append((name, size))
+			if self.rss() <= budget:
+				break
+		if evicted:
+			print("Evicted from memory to fit into the budget of " + format(budget / (1 << 30), ".1f") + " GiB:", ", ".join(name + " (" + format(size / (1 << 20), ".1f") + " MiB)" for name, size in evicted), file=sys.stderr)
+		return evicted
+
+	def report(self):
+		"""`(name, size)` of the tracked objects in the order of loading, and RSS of the process"""
+		self.prune()
+		return [(name, size) for (cacheRef, name), size in self.entries.items()], self.rss()
+
+
+memoryManager = MemoryManager()
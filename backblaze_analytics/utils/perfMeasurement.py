@@ -0,0 +1,67 @@
+__all__ = ("PeakRSSSampler", "Measurement", "measure")
+
+import threading
+import time
+from contextlib import contextmanager
+
+from psutil import Process
+
+
+class PeakRSSSampler(threading.Thread):
+	"""Polls RSS of the current process in a background thread and tracks its maximum. `ru_maxrss` is not suitable, since it is the peak of the whole life of the process, not of a stage."""
+
+	def __init__(self, interval: float = 0.01):
+		super().__init__(daemon=True)
+		self.interval = interval
+		self.process = Process()
+		self.peak = self.process.memory_info().rss
+		self.stopEvent = threading.Event()
+
+	def run(self):
+		while not self.stopEvent.wait(self.interval):
+			self.peak = max(self.peak, self.process.memory_info().rss)
+
+	def stop(self):
+		self.stopEvent.set()
+		self.join()
+		self.peak = max(self.peak, self.process.memory_info().rss)
+		return self.peak
+
+
+class Measurement:
+	"""Results of measurement of a piece of code. Set `items` to the count of processed items to get the throughput."""
+
+	__slots__ = ("seconds", "items", "peakRSS", "rssBefore")
+
+	def __init__(self):
+		self.seconds = None
+		self.items = None
+		self.peakRSS = None
+		self.rssBefore = None
+
+	@property
+	def throughput(self):
+		if self.items is None or not self.seconds:
+			return None
+		return self.items / self.seconds
+
+	def toDict(self):
+		return {"seconds": self.seconds, "items": self.items, "throughput": self.throughput, "peakRSS": self.peakRSS, "rssBefore": self.rssBefore}
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + ", ".join(k + "=" + repr(v) for k, v in self.toDict().items()) + ")"
+
+
+@contextmanager
+def measure(interval: float = 0.01):
+	"""Measures wall time and peak RSS of the code in the `with` block"""
+	m = Measurement()
+	sampler = PeakRSSSampler(interval)
+	m.rssBefore = sampler.peak
+	sampler.start()
+	start = time.perf_counter()
+	try:
+		yield m
+	finally:
+		m.seconds = time.perf_counter() - start
+		m.peakRSS = sampler.stop()
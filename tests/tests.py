@@ -0,0 +1,50 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+thisDir = Path(__file__).absolute().parent
+sys.path.insert(0, str(thisDir.parent))
+
+import pandas
+
+from backblaze_analytics import database
+from backblaze_analytics.analysis import Analysis
+from backblaze_analytics.dataset import Dataset
+from backblaze_analytics.synthetic import SyntheticDataset, SyntheticDatasetConfig
+from backblaze_analytics.utils import PickleCache
+
+
+class PickleCacheTests(unittest.TestCase):
+	def testFramesWithoutPyArrow(self):
+		obj = {"frame": pandas.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]}), "other": [1, 2]}
+		with tempfile.TemporaryDirectory() as tempDir, mock.patch.object(PickleCache, "getPyArrow", lambda: None):
+			entryDir = Path(tempDir) / "test.entry"
+			PickleCache.writeEntry(entryDir, obj)
+			self.assertTrue((entryDir / "object.pickle").exists())
+			self.assertFalse((entryDir / "frames").exists())
+			res = PickleCache.readEntry(entryDir)
+		pandas.testing.assert_frame_equal(res["frame"], obj["frame"])
+		self.assertEqual(res["other"], obj["other"])
+
+
+class AnalysisTests(unittest.TestCase):
+	def testVendorsDomainIncludesUnknown(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			tempDir = Path(tempDir)
+			dbPath = tempDir / "db.sqlite"
+			analyticsDBPath = tempDir / "analytics.sqlite"
+			SyntheticDataset(SyntheticDatasetConfig(drivesCount=16, daysCount=8)).createDBs(dbPath, analyticsDBPath)
+			with database.DB(dbPath) as db:
+				vendorsIds = {v["id"] for v in db.getVendors()}
+			with PickleCache.useCacheDir(tempDir / "cache"), mock.patch.object(Analysis, "loadAndAugmentDataset", lambda self: Dataset(self.dbPath)):
+				a = Analysis(dbPath, analyticsDBPath)
+				a.computeDomains("vendor_id")
+				self.assertIn(0, a.domains["vendor_id"])
+				self.assertEqual(set(a.domains["vendor_id"]), vendorsIds)
+				self.assertEqual(a.ds.vendors[0]["name"], "Unknown")
+
+
+if __name__ == "__main__":
+	unittest.main()